@@ -0,0 +1,372 @@
+"""性能基准测试
+
+在本机启动一组模拟的 IPFS 网关，用 GatewaySpeedTest.test_cids 对其完整测速一轮，
+统计测速程序自身的开销：每秒探测数、每次探测的 CPU 时间、内存占用 (RSS) 和单轮耗时。
+不访问外部网络，结果可重复，用于比较探测后端、并发设置和发现热路径上的性能退化。
+
+模拟网关的行为按比例随机分配（可用 --mix 调整）：
+    fast      低延迟，不限速，返回 206
+    slow      高延迟，限速
+    full200   忽略 Range，返回 200 和完整内容
+    redirect  先返回 302，跟随后返回 206
+    reset     读取请求后直接发送 RST 断开连接
+    hang      接受连接但不响应（直到客户端超时断开）
+    error     返回 504
+
+模拟网关运行在独立进程中，其 CPU 时间不计入测速程序。在 Linux 上网关分布在多个
+回环地址 (127.0.x.y) 上，使连接池像面对不同主机一样工作。
+
+用法：
+    python ipfs_gateway_bench.py --sizes 100,1000,10000 --backend async
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+BENCH_SIZES = (100, 1000, 10000)    # 默认测试的网关数量
+BENCH_BODY_SIZE = 65536             # 模拟网关返回的内容大小 (字节)
+BENCH_MAX_HOSTS = 256               # 模拟网关最多使用的回环地址数量
+BENCH_SEED = 42
+
+# 各类模拟网关: 比例, 延迟中位数 (秒), 延迟的对数标准差, 限速 (字节/秒，None 表示不限速)
+FLEET_PROFILES = {
+    'fast':     {'weight': 0.60, 'latency': 0.03, 'sigma': 0.5, 'rate': None},
+    'slow':     {'weight': 0.15, 'latency': 0.30, 'sigma': 0.5, 'rate': 256 * 1024},
+    'full200':  {'weight': 0.05, 'latency': 0.05, 'sigma': 0.5, 'rate': None},
+    'redirect': {'weight': 0.05, 'latency': 0.05, 'sigma': 0.5, 'rate': None},
+    'reset':    {'weight': 0.05, 'latency': 0.01, 'sigma': 0.5, 'rate': None},
+    'hang':     {'weight': 0.02, 'latency': 0.0, 'sigma': 0.0, 'rate': None},
+    'error':    {'weight': 0.08, 'latency': 0.05, 'sigma': 0.5, 'rate': None},
+}
+
+
+def raise_fd_limit():
+    """把打开文件数的软限制提高到硬限制（上万个连接需要）"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 65536
+    if soft < target:
+        with contextlib.suppress(ValueError, OSError):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def loopback_hosts(count):
+    """返回 count 个可用的回环地址；只有 Linux 会路由整个 127.0.0.0/8"""
+    if not sys.platform.startswith('linux'):
+        return ['127.0.0.1']
+    return [f"127.0.{i // 254}.{i % 254 + 1}" for i in range(max(count, 1))]
+
+
+def assign_profiles(size, mix, seed):
+    """按比例为每个模拟网关分配行为类型"""
+    rng = random.Random(seed)
+    names = list(mix)
+    return rng.choices(names, weights=[mix[name] for name in names], k=size)
+
+
+class _FleetServer:
+    """模拟网关的 HTTP/1.1 服务端（在网关进程的事件循环中运行）"""
+
+    def __init__(self, kinds, body_size, seed):
+        self.kinds = kinds
+        self.body = b'\0' * body_size
+        self.rng = random.Random(seed)
+
+    def _latency(self, profile):
+        if not profile['latency']:
+            return 0
+        return self.rng.lognormvariate(math.log(profile['latency']), profile['sigma'])
+
+    @staticmethod
+    async def _read_request(reader):
+        """读取一个请求，返回 (target, headers)，连接关闭时返回 (None, None)"""
+        line = await reader.readline()
+        if not line:
+            return None, None
+        target = line.decode('latin-1').split(' ')[1]
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return target, headers
+
+    @staticmethod
+    def _head(status, reason, headers):
+        lines = [f"HTTP/1.1 {status} {reason}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _send_body(self, writer, body, rate):
+        if not rate:
+            writer.write(body)
+            await writer.drain()
+            return
+        step = 16384
+        for offset in range(0, len(body), step):
+            writer.write(body[offset:offset + step])
+            await writer.drain()
+            await asyncio.sleep(step / rate)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                target, headers = await self._read_request(reader)
+                if target is None:
+                    break
+                # 路径: /gw<序号>/ipfs/<cid>，跟随重定向后为 /gw<序号>/r/ipfs/<cid>
+                parts = target.split('/')
+                kind = self.kinds[int(parts[1][2:])]
+                profile = FLEET_PROFILES[kind]
+                await asyncio.sleep(self._latency(profile))
+
+                if kind == 'hang':
+                    await reader.read()     # 直到客户端断开
+                    break
+                if kind == 'reset':
+                    sock = writer.get_extra_info('socket')
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    writer.transport.abort()
+                    return
+                if kind == 'redirect' and parts[2] != 'r':
+                    location = '/'.join(parts[:2] + ['r'] + parts[2:])
+                    writer.write(self._head(302, 'Found', {'Location': location,
+                                                           'Content-Length': 0}))
+                    continue
+                if kind == 'error':
+                    writer.write(self._head(504, 'Gateway Timeout', {'Content-Length': 0}))
+                    continue
+
+                body = memoryview(self.body)
+                range_header = headers.get('range', '')
+                if kind != 'full200' and range_header.startswith('bytes='):
+                    start, _, end = range_header[6:].partition('-')
+                    start = int(start)
+                    end = min(int(end) if end else len(body) - 1, len(body) - 1)
+                    writer.write(self._head(206, 'Partial Content', {
+                        'Content-Range': f"bytes {start}-{end}/{len(body)}",
+                        'Content-Length': end - start + 1}))
+                    await self._send_body(writer, body[start:end + 1], profile['rate'])
+                else:
+                    writer.write(self._head(200, 'OK', {'Content-Length': len(body)}))
+                    await self._send_body(writer, body, profile['rate'])
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+
+def _run_fleet(kinds, body_size, hosts, seed, conn):
+    """模拟网关进程的入口：在所有回环地址的同一端口上监听，把端口号发回父进程"""
+    raise_fd_limit()
+    fleet = _FleetServer(kinds, body_size, seed)
+
+    async def main():
+        first = await asyncio.start_server(fleet.handle, hosts[0], 0, backlog=4096)
+        port = first.sockets[0].getsockname()[1]
+        servers = [first]
+        if len(hosts) > 1:
+            servers.append(await asyncio.start_server(fleet.handle, hosts[1:], port,
+                                                      backlog=4096))
+        conn.send(port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class MockGatewayFleet:
+    """在子进程中运行的一组模拟网关"""
+
+    def __init__(self, size, mix=None, body_size=BENCH_BODY_SIZE,
+                 max_hosts=BENCH_MAX_HOSTS, seed=BENCH_SEED):
+        self.size = size
+        self.mix = mix or {name: profile['weight'] for name, profile in FLEET_PROFILES.items()}
+        self.body_size = body_size
+        self.hosts = loopback_hosts(min(size, max_hosts))
+        self.seed = seed
+        self.kinds = assign_profiles(size, self.mix, seed)
+        self._process = None
+        self.port = None
+
+    def start(self):
+        """启动网关进程，返回网关 URL 列表"""
+        ctx = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_run_fleet, daemon=True,
+                                    args=(self.kinds, self.body_size, self.hosts,
+                                          self.seed, child_conn))
+        self._process.start()
+        if not parent_conn.poll(30):
+            self.stop()
+            raise RuntimeError("模拟网关启动超时")
+        self.port = parent_conn.recv()
+        return self.urls()
+
+    def urls(self):
+        return [f"http://{self.hosts[i % len(self.hosts)]}:{self.port}/gw{i}"
+                for i in range(self.size)]
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+def _cpu_seconds():
+    """本进程及已回收子进程（curl）的 CPU 时间"""
+    if resource is None:
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _rss_mb():
+    """返回 (当前 RSS, 峰值 RSS)，单位 MB，无法获取时为 None"""
+    current = None
+    with contextlib.suppress(OSError, ValueError):
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 上单位为 KB，macOS 上为字节
+        peak = peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+    return current, peak
+
+
+def run_benchmark(size, backend='async', cids=1, max_workers=None, mix=None,
+                  body_size=BENCH_BODY_SIZE, max_hosts=BENCH_MAX_HOSTS, seed=BENCH_SEED,
+                  round_deadline=None):
+    """对 size 个模拟网关完整测速一轮，返回统计结果"""
+    from ipfs_test_gateway_multi_cid import GatewaySpeedTest
+
+    raise_fd_limit()
+    fleet = MockGatewayFleet(size, mix=mix, body_size=body_size, max_hosts=max_hosts, seed=seed)
+    urls = fleet.start()
+    cid_list = [f"bafybenchmark{i}" for i in range(cids)]
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            main_file = os.path.join(tmp, 'ipfs_gateway.txt')
+            side_file = os.path.join(tmp, 'ipfs_gateway_side.txt')
+            with open(main_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(urls) + '\n')
+            open(side_file, 'w', encoding='utf-8').close()
+            # 测速程序会把最新的日志写到当前目录
+            os.chdir(tmp)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                tester = GatewaySpeedTest(main_file, side_file,
+                                          data_file=os.path.join(tmp, 'gateway_data.json'),
+                                          log_dir=os.path.join(tmp, 'logs'),
+                                          probe_backend=backend,
+                                          round_deadline=round_deadline)
+                cpu_start = _cpu_seconds()
+                wall_start = time.perf_counter()
+                tester.test_cids(cid_list, max_workers=max_workers)
+                wall = time.perf_counter() - wall_start
+                cpu = _cpu_seconds() - cpu_start
+                rss, peak_rss = _rss_mb()
+                tester.close()
+    finally:
+        os.chdir(cwd)
+        fleet.stop()
+
+    probes = size * cids
+    return {
+        'gateways': size,
+        'backend': backend,
+        'probes': probes,
+        'round_time': wall,
+        'probes_per_sec': probes / wall if wall > 0 else 0,
+        'cpu_per_probe_ms': cpu / probes * 1000,
+        'rss_mb': rss,
+        'peak_rss_mb': peak_rss,
+    }
+
+
+def parse_mix(value):
+    """解析 --mix fast=0.7,hang=0.1,...（未列出的类型比例为 0）"""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in FLEET_PROFILES:
+            raise argparse.ArgumentTypeError(f"未知的网关类型: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def format_results(results):
+    header = (f"{'网关数':>8} {'后端':>6} {'探测数':>8} {'单轮耗时(s)':>12} {'探测/秒':>10} "
+              f"{'CPU/探测(ms)':>13} {'RSS(MB)':>9} {'峰值RSS(MB)':>12}")
+    lines = [header, '-' * len(header)]
+    for r in results:
+        rss = f"{r['rss_mb']:.1f}" if r['rss_mb'] is not None else 'N/A'
+        peak = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else 'N/A'
+        lines.append(f"{r['gateways']:>8} {r['backend']:>6} {r['probes']:>8} {r['round_time']:>12.2f} "
+                     f"{r['probes_per_sec']:>10.1f} {r['cpu_per_probe_ms']:>13.3f} "
+                     f"{rss:>9} {peak:>12}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用本地模拟网关测量测速程序自身的性能')
+    parser.add_argument('--sizes', default=','.join(map(str, BENCH_SIZES)),
+                        help='要测试的网关数量，逗号分隔')
+    parser.add_argument('--backend', default='async', choices=('async', 'curl'))
+    parser.add_argument('--cids', type=int, default=1, help='每轮测试的 CID 数量')
+    parser.add_argument('--max-workers', type=int, default=None, help='并发数，默认使用后端的设置')
+    parser.add_argument('--body-size', type=int, default=BENCH_BODY_SIZE,
+                        help='模拟网关返回的内容大小 (字节)')
+    parser.add_argument('--max-hosts', type=int, default=BENCH_MAX_HOSTS,
+                        help='模拟网关最多使用的回环地址数量')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='各类网关的比例，如 fast=0.8,slow=0.1,hang=0.1')
+    parser.add_argument('--deadline', type=float, default=None, help='轮次截止时间 (秒)')
+    parser.add_argument('--seed', type=int, default=BENCH_SEED)
+    parser.add_argument('--json', default=None, help='把结果另存为 JSON 文件')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',') if s):
+        # 每个规模在独立的进程中运行，峰值内存互不影响
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_benchmark, size, args.backend, args.cids,
+                                     args.max_workers, args.mix, args.body_size,
+                                     args.max_hosts, args.seed, args.deadline).result()
+        results.append(result)
+        print(format_results([result]).splitlines()[-1] if len(results) > 1
+              else format_results([result]), flush=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
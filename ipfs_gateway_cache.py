@@ -0,0 +1,129 @@
+"""冷/热缓存识别
+
+__main__ 中的多轮测试反复请求同一批 CID：第一轮测的是网关从 IPFS 网络检索内容的能力，
+之后的轮次大多命中网关（或其前面 CDN）的 HTTP 缓存，两者原本混在同一个 EMA 里。
+CacheClassifier 把每次探测判定为冷 (cold) 或热 (warm)，依据依次为：
+
+1. 缓存破坏：带随机查询参数的请求绕过按 URL 缓存的 HTTP 缓存，按冷处理；
+2. 响应头：X-Cache / CF-Cache-Status / X-Cache-Status / X-Proxy-Cache / Cache-Status 中的
+   HIT 为热、MISS / EXPIRED / BYPASS 等为冷，Age 大于 0 为热；
+3. 重复次数：CACHE_WARM_WINDOW 秒内第一次请求该 (网关, CID) 为冷；
+4. 首字节时间特征：重复请求的首字节时间低于该网关冷首字节时间的 WARM_TTFB_RATIO 倍时为热，
+   否则说明缓存没有起作用，仍按冷处理；重复请求失败说明请求没有由缓存应答（命中缓存的请求
+   不会失败），也按冷处理，失败不会记到热得分上。
+
+判定结果写入测试结果的 'cache'（'cold' / 'warm'）和 'cache_reason'，网关的冷、热得分
+分别保存在 GatewayState 的 cache_scores 中（update_cache_score），原有的全局权重不变。
+"""
+import threading
+import time
+import uuid
+
+from ipfs_gateway_score import score_sample, update_score
+from ipfs_gateway_verify import probe_success
+
+CACHE_WARM_WINDOW = 3600    # 同一 (网关, CID) 在该时间 (秒) 内再次请求视为重复请求
+WARM_TTFB_RATIO = 0.5       # 重复请求的首字节时间低于冷首字节时间的该倍数时判定为命中缓存
+CACHE_BUST_PARAM = 'cb'     # 缓存破坏使用的查询参数名
+CACHE_SEEN_MAX = 262144     # 记录的 (网关, CID) 上次请求时间超过该数量时清理过期记录
+
+# 探测时保留的与缓存相关的响应头（小写）
+CACHE_HEADERS = ('age', 'x-cache', 'cf-cache-status', 'x-cache-status', 'x-proxy-cache',
+                 'cache-status')
+
+# 缓存状态头中表示未命中的取值
+MISS_VALUES = ('miss', 'expired', 'bypass', 'dynamic', 'revalidated', 'updating', 'stale')
+
+
+def cache_headers(headers):
+    """从响应头（小写键）中取出与缓存相关的几个，没有时返回空字典"""
+    return {name: headers[name] for name in CACHE_HEADERS if name in headers}
+
+
+def header_verdict(headers):
+    """按响应头判定 'warm' / 'cold'，响应头不能说明问题时返回 None"""
+    for name in CACHE_HEADERS[1:]:
+        value = headers.get(name)
+        if not value:
+            continue
+        value = value.lower()
+        if name == 'cache-status':
+            # RFC 9211: "Cache; hit" 或 "Cache; fwd=miss"，取最靠近客户端的一项
+            value = value.split(',')[-1]
+        if 'hit' in value:
+            return 'warm'
+        if any(miss in value for miss in MISS_VALUES):
+            return 'cold'
+    age = headers.get('age')
+    if age:
+        try:
+            if int(age.strip()) > 0:
+                return 'warm'
+        except ValueError:
+            pass
+    return None
+
+
+def bust_url(full_url):
+    """在测试 URL 上附加随机查询参数，绕过按 URL 缓存的 HTTP 缓存"""
+    separator = '&' if '?' in full_url else '?'
+    return f"{full_url}{separator}{CACHE_BUST_PARAM}={uuid.uuid4().hex[:12]}"
+
+
+class CacheClassifier:
+    """按缓存破坏、响应头、重复次数和首字节时间判定每次探测是冷还是热，可在多个工作线程中并发调用"""
+
+    def __init__(self, window=CACHE_WARM_WINDOW, ttfb_ratio=WARM_TTFB_RATIO, clock=time.monotonic):
+        self.window = window
+        self.ttfb_ratio = ttfb_ratio
+        self.clock = clock
+        self._last_seen = {}    # (url, cid) -> 上次请求的时间
+        self._lock = threading.Lock()
+
+    def classify(self, url, cid, test_result, cold_ttfb=None, busted=False):
+        """返回 (判定, 依据)，判定为 'cold' / 'warm'，熔断跳过和轮次截止的结果返回 (None, None)
+
+        cold_ttfb 为该网关冷请求首字节时间的 EMA (ms)，没有时不使用首字节时间特征。
+        """
+        if test_result.get('skipped') or test_result.get('deadline_exceeded'):
+            return None, None
+        now = self.clock()
+        with self._lock:
+            last = self._last_seen.get((url, cid))
+            self._last_seen[(url, cid)] = now
+            if len(self._last_seen) > CACHE_SEEN_MAX:
+                self._expire(now)
+
+        if busted:
+            return 'cold', 'bust'
+        verdict = header_verdict(test_result.get('cache_headers') or {})
+        if verdict is not None:
+            return verdict, 'header'
+        if last is None or now - last > self.window:
+            return 'cold', 'first'
+        if not probe_success(test_result):
+            return 'cold', 'failed'
+        ttfb = test_result.get('ttfb', test_result['response_time'])
+        if cold_ttfb and ttfb < self.ttfb_ratio * cold_ttfb:
+            return 'warm', 'ttfb'
+        return 'cold', 'ttfb'
+
+    def _expire(self, now):
+        """丢弃超出窗口的记录（调用方持有锁）"""
+        for key in [key for key, seen in self._last_seen.items() if now - seen > self.window]:
+            del self._last_seen[key]
+
+
+def new_cache_score():
+    """单类（冷或热）请求的得分，字段含义与网关×CID 矩阵的组合统计相同"""
+    return {'tests': 0, 'successes': 0, 'ema': 1.0, 'response_time': None, 'ttfb': None,
+            'speed': None, 'weight': 1.0}
+
+
+def update_cache_score(score, test_result, alpha, weight_func):
+    """把一次探测计入冷或热得分（原地更新）
+
+    评分量与全局权重相同（ipfs_gateway_score.score_sample），
+    weight_func(ema, response_time, speed_kb) 与全局权重使用同一公式。
+    """
+    return update_score(score, score_sample(test_result), alpha, weight_func)
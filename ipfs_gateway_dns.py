@@ -0,0 +1,302 @@
+"""进程内共享的 DNS 解析层
+
+原来 curl 每次探测都重新解析网关的主机名，异步引擎每建一条连接也要解析一次；解析不了的
+主机名要等到解析器超时才失败，这段时间被算进 15 秒的探测时限和评分用的首字节时间，
+结果只是一个笼统的 status_code 0。DnsResolver 在整个进程内共享：
+
+- 预解析：每轮探测开始前用线程池并行解析全部网关的主机名（prefetch）；
+- 缓存：成功的结果缓存 DNS_TTL 秒，NXDOMAIN / SERVFAIL / 超时缓存 DNS_NEGATIVE_TTL 秒，
+  期间同一主机名直接失败，不再占用探测时间；同一主机名同时只有一个解析在进行；
+- Happy Eyeballs：解析结果按 IPv6 / IPv4 交替排列，连接时每隔 HAPPY_EYEBALLS_DELAY 秒
+  依次向下一个地址发起连接，先建立的连接胜出（见 ipfs_gateway_probe）；
+- 解析失败抛出 DnsError（kind 为 'nxdomain' / 'servfail' / 'timeout' / 'noaddress'），
+  探测结果中记为 'dns_error'，与连接失败和超时区分开。
+
+系统解析接口 getaddrinfo 不返回记录的 TTL，默认使用固定的缓存时间；lookup 可替换为
+返回 (地址列表, TTL) 的其他解析函数（例如测试用的本地桩解析器）。
+"""
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+DNS_TTL = 300                   # 解析成功的缓存时间 (秒)
+DNS_NEGATIVE_TTL = 60           # 解析失败（NXDOMAIN / SERVFAIL / 超时）的缓存时间 (秒)
+DNS_TIMEOUT = 5                 # 单个主机名的解析时限 (秒)
+DNS_WORKERS = 64                # 执行解析的线程数
+DNS_PREFETCH_TIMEOUT = 10       # 预解析最多等待的时间 (秒)，未完成的解析在后台继续
+HAPPY_EYEBALLS_DELAY = 0.25     # 连接下一个地址之前等待的时间 (秒)，RFC 8305 建议 250ms
+
+
+class DnsError(OSError):
+    """主机名解析失败"""
+
+    def __init__(self, host, kind):
+        super().__init__(f"无法解析主机 {host}: {kind}")
+        self.host = host
+        self.kind = kind
+
+
+def dns_failure_result(kind):
+    """解析失败时的测试结果（没有发出请求）"""
+    return {
+        'response_time': 1500,
+        'status_code': 0,
+        'speed': 0,
+        'size': 0,
+        'dns_error': kind,
+    }
+
+
+def interleave_families(addresses):
+    """按 IPv6 / IPv4 交替排列地址（RFC 8305），各族内保持解析顺序并去重"""
+    v6, v4 = [], []
+    for address in dict.fromkeys(addresses):
+        (v6 if ':' in address else v4).append(address)
+    ordered = []
+    for i in range(max(len(v6), len(v4))):
+        ordered.extend(family[i] for family in (v6, v4) if i < len(family))
+    return ordered
+
+
+def system_lookup(host):
+    """用系统解析器解析主机名，返回 (地址列表, TTL)，TTL 未知时为 None"""
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        if e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+            raise DnsError(host, 'nxdomain') from None
+        raise DnsError(host, 'servfail') from None
+    except UnicodeError:
+        raise DnsError(host, 'nxdomain') from None
+    return [info[4][0] for info in infos], None
+
+
+def is_ip_literal(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DnsResolver:
+    """带缓存和否定缓存的共享解析器，可在多个线程和事件循环中并发使用"""
+
+    def __init__(self, ttl=DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL, timeout=DNS_TIMEOUT,
+                 workers=DNS_WORKERS, lookup=system_lookup, clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.lookup = lookup
+        self.clock = clock
+        self._cache = {}        # host -> (过期时间, 地址列表或 None, 失败类型或 None)
+        self._inflight = {}     # host -> 正在进行的解析 (concurrent.futures.Future)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')
+        self.lookups = 0        # 实际发出的解析次数
+        self.hits = 0           # 命中缓存的次数（含否定缓存）
+
+    def _cached(self, host):
+        """返回未过期的缓存项，调用方持有锁"""
+        entry = self._cache.get(host)
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            return entry
+        return None
+
+    @staticmethod
+    def _unpack(host, entry):
+        if entry[1] is None:
+            raise DnsError(host, entry[2])
+        return entry[1]
+
+    def _store(self, host, addresses, kind, ttl=None):
+        """写入缓存（调用方不持有锁）"""
+        if addresses is not None:
+            expires = self.clock() + (self.ttl if ttl is None else ttl)
+        else:
+            expires = self.clock() + self.negative_ttl
+        with self._lock:
+            self._cache[host] = (expires, addresses, kind)
+
+    def _run_lookup(self, host):
+        """在解析线程中执行一次解析，结果写入缓存"""
+        try:
+            addresses, ttl = self.lookup(host)
+            addresses = interleave_families(addresses)
+            if not addresses:
+                raise DnsError(host, 'noaddress')
+        except DnsError as e:
+            self._store(host, None, e.kind)
+            raise
+        except Exception:
+            self._store(host, None, 'servfail')
+            raise DnsError(host, 'servfail') from None
+        else:
+            self._store(host, addresses, None, ttl)
+            return addresses
+        finally:
+            with self._lock:
+                self._inflight.pop(host, None)
+
+    def _submit(self, host):
+        """返回该主机名的缓存项或正在进行的解析 (entry, future)，二者其一为 None"""
+        with self._lock:
+            entry = self._cached(host)
+            if entry is not None:
+                return entry, None
+            future = self._inflight.get(host)
+            if future is None:
+                self.lookups += 1
+                future = self._inflight[host] = self._executor.submit(self._run_lookup, host)
+            return None, future
+
+    def _timed_out(self, host):
+        """解析超时：在真正的结果返回前按否定缓存处理（结果返回后会覆盖）"""
+        self._store(host, None, 'timeout')
+        return DnsError(host, 'timeout')
+
+    def resolve(self, host):
+        """解析主机名，返回按 Happy Eyeballs 顺序排列的地址列表，失败时抛出 DnsError（阻塞调用）"""
+        if is_ip_literal(host):
+            return [host]
+        entry, future = self._submit(host)
+        if entry is not None:
+            return self._unpack(host, entry)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise self._timed_out(host) from None
+
+    async def resolve_async(self, host):
+        """resolve() 的协程版本，解析在线程池中进行，不阻塞事件循环"""
+        if is_ip_literal(host):
+            return [host]
+        entry, future = self._submit(host)
+        if entry is not None:
+            return self._unpack(host, entry)
+        # 每个等待者使用自己的 asyncio future：取消某个探测不会取消其他探测共享的解析
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def _copy(done):
+            if waiter.done():
+                return
+            if done.exception() is not None:
+                waiter.set_exception(done.exception())
+            else:
+                waiter.set_result(done.result())
+
+        def _on_done(done):
+            try:
+                loop.call_soon_threadsafe(_copy, done)
+            except RuntimeError:
+                pass    # 事件循环已经关闭
+
+        future.add_done_callback(_on_done)
+        try:
+            return await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out(host) from None
+
+    def prefetch(self, hosts, timeout=DNS_PREFETCH_TIMEOUT):
+        """并行解析一批主机名（已缓存的跳过），最多等待 timeout 秒
+
+        返回 {'resolved', 'failed', 'pending'}：pending 为超时仍未完成的解析，它们在后台继续，
+        之后的探测会等待同一个解析而不是重新发起。
+        """
+        futures, resolved, failed = [], 0, 0
+        for host in set(hosts):
+            if not host or is_ip_literal(host):
+                continue
+            entry, future = self._submit(host)
+            if future is not None:
+                futures.append(future)
+            elif entry[1] is not None:
+                resolved += 1
+            else:
+                failed += 1
+        done, not_done = wait(futures, timeout=timeout) if futures else ((), ())
+        for future in done:
+            if future.exception() is None:
+                resolved += 1
+            else:
+                failed += 1
+        return {'resolved': resolved, 'failed': failed, 'pending': len(not_done)}
+
+    def failure(self, host):
+        """该主机名当前缓存的失败类型，没有失败记录时返回 None"""
+        with self._lock:
+            entry = self._cache.get(host)
+        return entry[2] if entry is not None and entry[0] > self.clock() else None
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            live = [entry for entry in self._cache.values() if entry[0] > now]
+            return {
+                'cached': sum(1 for entry in live if entry[1] is not None),
+                'negative': sum(1 for entry in live if entry[1] is None),
+                'inflight': len(self._inflight),
+                'lookups': self.lookups,
+                'hits': self.hits,
+            }
+
+    def close(self):
+        """停止解析线程（不等待卡住的系统解析调用）"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """进程内共享的解析器（首次调用时创建）"""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = DnsResolver()
+        return _resolver
+
+
+async def open_happy_eyeballs(addresses, port, delay=HAPPY_EYEBALLS_DELAY, **kwargs):
+    """按 Happy Eyeballs 依次向各地址发起连接，返回最先建立的 (reader, writer)
+
+    每隔 delay 秒（或上一个尝试失败时立即）开始下一个地址的连接；一个连接建立后取消其余尝试，
+    已经建立的多余连接直接关闭。全部失败时抛出最后一个错误。kwargs 传给 asyncio.open_connection。
+    """
+    pending = set()
+    errors = []
+    winner = None
+    remaining = list(addresses)
+    try:
+        while winner is None and (remaining or pending):
+            if remaining:
+                pending.add(asyncio.ensure_future(
+                    asyncio.open_connection(remaining.pop(0), port, **kwargs)))
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result()[1].close()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for result in results:
+                if isinstance(result, tuple):
+                    result[1].close()
+    if winner is None:
+        raise errors[-1] if errors else OSError("没有可连接的地址")
+    return winner
@@ -0,0 +1,362 @@
+"""多源并行下载
+
+按 current_weight 取排名前 K 的网关，把 CID 的内容切分为若干字节范围，由各网关并发下载：
+
+- 工作队列：每个网关（每条连接）下载完一个分块后再领取下一个，快的网关自然分到更多分块；
+- 再平衡：传输过程中速度远低于其他网关的分块会被截短，剩余部分放回队列交给其他网关；
+- 对冲：队列为空时，空闲的连接对仍在下载的最慢分块发起重复请求，先完成者胜出；
+- 输出文件按总大小预先分配并做内存映射，各分块直接写入对应位置；
+- 每个分块的结果都按探测结果的格式交给 update_gateway_stats，下载本身也会更新网关权重。
+
+用法：
+    python ipfs_test_gateway_multi_cid.py fetch <CID> <输出文件> [--top-k 8] [--main-only]
+"""
+import argparse
+import asyncio
+import mmap
+import os
+import time
+
+from ipfs_gateway_probe import ProbeMetrics
+
+FETCH_TOP_K = 8                     # 参与下载的网关数量
+FETCH_CHUNK_SIZE = 1048576          # 分块大小 (字节)
+FETCH_CONNECTIONS_PER_GATEWAY = 2   # 每个网关同时下载的分块数
+FETCH_CHUNK_TIMEOUT = 30            # 单个分块请求的超时 (秒)
+FETCH_MAX_FAILURES = 3              # 网关连续失败多少次后不再使用
+FETCH_REBALANCE_INTERVAL = 0.5      # 检查慢速分块的间隔 (秒)
+FETCH_SLOW_RATIO = 0.25             # 分块速度低于各网关中位速度的该比例时视为慢速
+FETCH_MIN_SPLIT = 256 * 1024        # 截短慢速分块时至少保留给它的字节数
+FETCH_HEAD_SIZE = 65536             # 获取文件大小时下载的首块大小 (字节)
+
+
+def parse_content_range(value):
+    """解析 Content-Range: bytes <start>-<end>/<total>，返回 (start, total)，total 未知时为 None"""
+    if not value or not value.startswith('bytes '):
+        return None, None
+    span, _, total = value[6:].partition('/')
+    start = span.partition('-')[0]
+    try:
+        start = int(start) if start != '*' else None
+        total = int(total) if total not in ('', '*') else None
+    except ValueError:
+        return None, None
+    return start, total
+
+
+class _Source:
+    """参与下载的一个网关"""
+    __slots__ = ('url', 'full_url', 'alive', 'failures', 'rate', 'bytes', 'chunks')
+
+    def __init__(self, url, full_url):
+        self.url = url
+        self.full_url = full_url
+        self.alive = True
+        self.failures = 0           # 连续失败次数
+        self.rate = 0.0             # 最近完成分块的传输速度 (字节/秒，EMA)
+        self.bytes = 0              # 已下载的有效字节数
+        self.chunks = 0             # 已完成的分块数
+
+
+class _Chunk:
+    """一个字节范围 [start, end)，pos 为下一个要写入的位置
+
+    对冲时为同一剩余范围创建第二个 _Chunk，两者通过 twin 互相引用，先完成者取消另一个。
+    """
+    __slots__ = ('start', 'end', 'pos', 'done', 'twin', 'task', 'source',
+                 'fetch_pos', 'fetch_started')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.done = False
+        self.twin = None
+        self.task = None
+        self.source = None
+        self.fetch_pos = start      # 本次请求的起始位置
+        self.fetch_started = 0.0
+
+
+class MultiSourceFetcher:
+    """从多个网关并行下载同一个 CID
+
+    sources: [(网关URL, 完整下载URL), ...]，按优先级排列（第一个用于获取文件大小）
+    on_result: 每个分块完成或失败后调用 on_result(网关URL, 测试结果)
+    只能在 engine 的事件循环中运行：engine.run(fetcher.fetch(path))
+    """
+
+    def __init__(self, engine, sources, on_result=None, chunk_size=FETCH_CHUNK_SIZE,
+                 connections_per_gateway=FETCH_CONNECTIONS_PER_GATEWAY,
+                 chunk_timeout=FETCH_CHUNK_TIMEOUT, max_failures=FETCH_MAX_FAILURES,
+                 rebalance_interval=FETCH_REBALANCE_INTERVAL, slow_ratio=FETCH_SLOW_RATIO,
+                 min_split=FETCH_MIN_SPLIT, head_size=FETCH_HEAD_SIZE):
+        self.engine = engine
+        self.sources = [_Source(url, full_url) for url, full_url in sources]
+        self.on_result = on_result
+        self.chunk_size = chunk_size
+        self.connections_per_gateway = connections_per_gateway
+        self.chunk_timeout = chunk_timeout
+        self.max_failures = max_failures
+        self.rebalance_interval = rebalance_interval
+        self.slow_ratio = slow_ratio
+        self.min_split = min_split
+        self.head_size = head_size
+        self.rebalances = 0
+        self.hedges = 0
+        self._pending = []          # 待下载的分块（列表头部优先）
+        self._inflight = set()
+        self._view = None
+        self._changed = None
+
+    def _report(self, source, result):
+        if self.on_result is not None:
+            self.on_result(source.url, result)
+
+    def _failure(self, source, metrics):
+        """记录一次失败，连续失败过多的网关不再使用"""
+        code = metrics.http_code if metrics.http_code != 206 else 0
+        self._report(source, metrics.to_result(http_code=code, size_download=0))
+        source.failures += 1
+        if source.failures >= self.max_failures:
+            source.alive = False
+
+    def _success(self, source, metrics, size, elapsed):
+        self._report(source, metrics.to_result(http_code=206, size_download=size))
+        source.failures = 0
+        source.bytes += size
+        source.chunks += 1
+        rate = size / elapsed if elapsed > 0 else 0
+        source.rate = rate if not source.rate else 0.5 * source.rate + 0.5 * rate
+
+    async def _discover(self):
+        """从排名最靠前的可用网关下载一小段首块并取得文件总大小，返回 (total, 首块数据)
+
+        首块只有 head_size 字节，避免排名第一的网关较慢时拖慢所有分块的开始。
+        """
+        for source in self.sources:
+            buf = bytearray()
+            metrics = ProbeMetrics()
+
+            def sink(data):
+                buf.extend(data)
+
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(
+                    self.engine.fetch_range(source.full_url, 0, self.head_size - 1, sink, metrics),
+                    self.chunk_timeout)
+            except (asyncio.TimeoutError, OSError, ValueError, asyncio.IncompleteReadError):
+                self._failure(source, metrics)
+                continue
+
+            total = None
+            if metrics.http_code == 206:
+                range_start, total = parse_content_range(metrics.headers.get('content-range'))
+                if range_start != 0:
+                    total = None
+            elif metrics.http_code == 200:
+                # 网关不支持 Range：只有内容不超过首块大小时才能直接使用
+                try:
+                    content_length = int(metrics.headers.get('content-length'))
+                except (TypeError, ValueError):
+                    content_length = None   # 没有或无法解析：无法从该网关得知文件大小
+                if content_length == len(buf):
+                    total = len(buf)
+                else:
+                    source.alive = False
+            if total is None or len(buf) < min(total, self.head_size):
+                self._failure(source, metrics)
+                continue
+            self._success(source, metrics, len(buf), time.monotonic() - start)
+            return total, buf
+        return None, None
+
+    def _next_chunk(self, source):
+        """领取下一个分块；队列为空时对其他网关正在下载的剩余最多的分块发起对冲"""
+        if self._pending:
+            return self._pending.pop(0)
+        candidates = [chunk for chunk in self._inflight
+                      if chunk.twin is None and not chunk.done
+                      and chunk.source is not source and chunk.end > chunk.pos]
+        if not candidates:
+            return None
+        primary = max(candidates, key=lambda chunk: chunk.end - chunk.pos)
+        hedge = _Chunk(primary.pos, primary.end)
+        hedge.twin = primary
+        primary.twin = hedge
+        self.hedges += 1
+        return hedge
+
+    async def _download(self, source, chunk):
+        """下载 chunk 的剩余范围，返回 (metrics, 是否出错)"""
+        metrics = ProbeMetrics()
+        request_end = chunk.end
+        checked = False
+
+        def sink(data):
+            nonlocal checked
+            if chunk.done:
+                return False
+            if not checked:
+                # 必须是所请求范围的 206 响应，否则数据位置不对
+                range_start, _ = parse_content_range(metrics.headers.get('content-range'))
+                if metrics.http_code != 206 or range_start != chunk.fetch_pos:
+                    source.alive = False
+                    return False
+                checked = True
+            n = min(len(data), chunk.end - chunk.pos)
+            if n > 0:
+                self._view[chunk.pos:chunk.pos + n] = data[:n]
+                chunk.pos += n
+            # 分块被截短或已写满时停止读取（正常读完时让连接保持可复用）
+            if chunk.pos >= chunk.end and chunk.end < request_end:
+                return False
+            return True
+
+        try:
+            await asyncio.wait_for(
+                self.engine.fetch_range(source.full_url, chunk.pos, request_end - 1, sink, metrics),
+                self.chunk_timeout)
+        except (asyncio.TimeoutError, OSError, ValueError, asyncio.IncompleteReadError):
+            return metrics, True
+        return metrics, False
+
+    async def _run_chunk(self, source, chunk):
+        chunk.source = source
+        chunk.fetch_pos = chunk.pos
+        chunk.fetch_started = time.monotonic()
+        self._inflight.add(chunk)
+        task = chunk.task = asyncio.ensure_future(self._download(source, chunk))
+        await asyncio.wait([task])
+        self._inflight.discard(chunk)
+        self._changed.set()
+        if task.cancelled():
+            # 对冲中另一方先完成
+            return
+
+        metrics, _ = task.result()
+        size = chunk.pos - chunk.fetch_pos
+        twin = chunk.twin
+        if chunk.pos >= chunk.end:
+            chunk.done = True
+            if twin is not None and not twin.done:
+                # 对冲双方覆盖了同一剩余范围，另一方不再需要
+                twin.done = True
+                if twin.task is not None:
+                    twin.task.cancel()
+            self._success(source, metrics, size, time.monotonic() - chunk.fetch_started)
+            return
+
+        self._failure(source, metrics)
+        if twin is not None and not twin.done:
+            # 另一方仍在下载同一范围，直接交给它
+            twin.twin = None
+        elif not chunk.done:
+            self._pending.insert(0, _Chunk(chunk.pos, chunk.end))
+
+    async def _worker(self, source):
+        while source.alive and (self._pending or self._inflight):
+            chunk = self._next_chunk(source)
+            if chunk is None:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            await self._run_chunk(source, chunk)
+
+    async def _rebalance(self):
+        """定期把慢速分块的剩余部分拆出来，交给其他网关"""
+        while True:
+            await asyncio.sleep(self.rebalance_interval)
+            rates = sorted(source.rate for source in self.sources if source.alive and source.rate)
+            if len(rates) < 2:
+                continue
+            median = rates[len(rates) // 2]
+            now = time.monotonic()
+            for chunk in list(self._inflight):
+                elapsed = now - chunk.fetch_started
+                if chunk.twin is not None or chunk.done or elapsed < self.rebalance_interval:
+                    continue
+                rate = (chunk.pos - chunk.fetch_pos) / elapsed
+                if rate >= median * self.slow_ratio or chunk.end - chunk.pos <= 2 * self.min_split:
+                    continue
+                keep = max(self.min_split, int(rate * self.rebalance_interval * 2))
+                split = chunk.pos + keep
+                if split < chunk.end:
+                    self._pending.insert(0, _Chunk(split, chunk.end))
+                    chunk.end = split
+                    self.rebalances += 1
+                    self._changed.set()
+
+    async def fetch(self, output_path):
+        """下载到 output_path，返回下载摘要"""
+        start = time.monotonic()
+        self._changed = asyncio.Event()
+        total, first = await self._discover()
+        summary = {
+            'path': str(output_path),
+            'size': total,
+            'complete': False,
+        }
+        if total is None:
+            summary['elapsed'] = time.monotonic() - start
+            return summary
+
+        with open(output_path, 'w+b') as f:
+            f.truncate(total)
+            mapped = mmap.mmap(f.fileno(), total) if total else None
+            try:
+                self._view = memoryview(mapped) if mapped is not None else memoryview(bytearray())
+                self._view[:len(first)] = first
+                self._pending = [_Chunk(offset, min(offset + self.chunk_size, total))
+                                 for offset in range(len(first), total, self.chunk_size)]
+                workers = [asyncio.ensure_future(self._worker(source))
+                           for source in self.sources if source.alive
+                           for _ in range(self.connections_per_gateway)]
+                monitor = asyncio.ensure_future(self._rebalance())
+                try:
+                    if workers:
+                        await asyncio.gather(*workers)
+                finally:
+                    monitor.cancel()
+                    for chunk in list(self._inflight):
+                        if chunk.task is not None:
+                            chunk.task.cancel()
+                    for worker in workers:
+                        worker.cancel()
+                if mapped is not None:
+                    mapped.flush()
+            finally:
+                if self._view is not None:
+                    self._view.release()
+                    self._view = None
+                if mapped is not None:
+                    mapped.close()
+
+        elapsed = time.monotonic() - start
+        summary.update({
+            'complete': not self._pending and not self._inflight,
+            'elapsed': elapsed,
+            'throughput': total / elapsed if elapsed > 0 else 0,
+            'rebalances': self.rebalances,
+            'hedges': self.hedges,
+            'sources': {source.url: {'bytes': source.bytes, 'chunks': source.chunks,
+                                     'alive': source.alive}
+                        for source in self.sources},
+        })
+        if not summary['complete']:
+            # 所有网关都不可用，保留已下载的部分但标记为未完成
+            os.replace(output_path, f"{output_path}.partial")
+            summary['path'] = f"{output_path}.partial"
+        return summary
+
+
+def parse_fetch_args(argv):
+    """解析 fetch 模式的命令行参数"""
+    parser = argparse.ArgumentParser(prog='ipfs_test_gateway_multi_cid.py fetch',
+                                     description='从排名靠前的多个网关并行下载一个 CID')
+    parser.add_argument('cid', help='要下载的 CID')
+    parser.add_argument('output', help='输出文件路径')
+    parser.add_argument('--top-k', type=int, default=FETCH_TOP_K, help='参与下载的网关数量')
+    parser.add_argument('--main-only', action='store_true', help='只使用主网关')
+    return parser.parse_args(argv)
@@ -0,0 +1,589 @@
+"""探测历史时间序列
+
+网关数据中只保留最近 10 次的速度/权重历史，gateway_logs/*.log 是给人看的表格，无法查询。
+ProbeHistory 把每一次探测追加写入紧凑的二进制时间序列，并自动汇总为 1h/1d 两级：
+
+    raw-YYYYMMDD.bin    每次探测一条定长记录（RAW_FORMAT，52 字节）：
+                        时间戳、网关ID、CID ID、状态码、标志、字节数、各阶段耗时
+    1h-YYYYMM.bin       每个网关每小时/每天一条汇总（ROLLUP_FORMATS，128/192 字节）：次数、
+    1d-YYYY.bin         成功数、字节数、各组指标的有效次数、各指标的总和（float32，求平均）
+                        以及 ttfb 的对数分桶直方图（1h 为 16 位计数，求近似百分位）
+    ids.tsv             网关/CID 与整数 ID 的对应关系（追加写）
+
+1m 级不单独存储：探测频率通常不超过每个网关每分钟一次，每分钟的汇总大多只有一个样本，
+存下来比它汇总的原始记录还大。1m 的保留期与原始记录相同，查询时由原始记录现算。
+
+保留期按每个网关每分钟探测一次估算（每个网关每天 1440 条原始记录）：
+原始记录 8 天约 600 KB，1h 汇总 92 天约 280 KB，1d 汇总 10 年约 700 KB，合计每个网关不到 2 MB，
+原始记录覆盖"最近一周"的精确查询，1h 覆盖一个季度的逐小时趋势，更早的只保留逐日趋势。
+
+所有文件只追加不改写，按段（天/月/年）切分；写入时打开新段（以及测速程序每轮结束时调用
+prune()）会删除最后写入时间早于保留期限的段（RAW_RETENTION_DAYS、ROLLUP_RETENTION_DAYS），
+因此目录大小有上限，只做查询的进程（如命令行）不会删除任何文件。汇总记录可以合并，
+同一时间桶的多条记录（例如进程重启前后各写了一条）在查询时相加。
+原始记录在段内按时间顺序追加，查询时按时间戳二分查找窗口的起止位置，只读取窗口内的记录。
+
+查询：
+    history = ProbeHistory('gateway_history')
+    history.query(url, 'ttfb', days=7)          # {'count': ..., 'mean': ..., 'p50': ..., 'p95': ...}
+    history.percentile(url, 'ttfb', 95, days=7)
+    history.series(url, level='1h', days=30)    # 趋势：每小时的次数、成功率、平均耗时
+
+查询窗口在原始记录的保留期内时按原始记录精确计算（可按 CID 过滤），否则使用覆盖该窗口的
+最细一级汇总，百分位由直方图估算（相对误差约 ±20%）。
+
+用法：
+    python ipfs_gateway_history.py <网关URL> [--metric ttfb] [--days 7] [--dir gateway_history]
+"""
+import argparse
+import json
+import math
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+HISTORY_DIR = 'gateway_history'
+RAW_RETENTION_DAYS = 8          # 原始记录保留天数（覆盖"最近一周"的精确查询），1m 级由原始记录现算
+ROLLUP_RETENTION_DAYS = {       # 各级汇总的保留天数（存储估算见模块说明）
+    '1h': 92,
+    '1d': 3650,
+}
+ROLLUP_SECONDS = {'1m': 60, '1h': 3600, '1d': 86400}
+STORED_LEVELS = ('1h', '1d')    # 写入文件的汇总级别
+SEGMENT_FORMATS = {             # 各级数据的分段方式（按 UTC 日期）
+    'raw': '%Y%m%d',
+    '1h': '%Y%m',
+    '1d': '%Y',
+}
+
+# 记录的指标，顺序与原始记录中的字段顺序一致
+METRICS = ('response_time', 'dns', 'tcp', 'tls', 'ttfb', 'transfer', 'total')
+RESULT_FIELDS = {               # 指标 -> 测试结果中的字段 (ms)
+    'response_time': 'response_time',
+    'dns': 'dns_time',
+    'tcp': 'tcp_time',
+    'tls': 'tls_time',
+    'ttfb': 'ttfb',
+    'transfer': 'transfer_time',
+    'total': 'total_time',
+}
+COUNTED_METRICS = ('dns', 'ttfb', 'transfer')  # 汇总中记录有效次数的指标，同组的其他指标次数相同
+HIST_METRICS = ('ttfb',)        # 汇总中保留直方图的指标
+HIST_BINS = 32                  # 对数分桶：每 2 倍分 2 桶，覆盖 1ms ~ 32s
+
+FLAG_DEADLINE = 1               # 轮次截止产生的超时结果
+FLAG_COLD = 2                   # 判定为冷请求（未命中缓存，见 ipfs_gateway_cache）
+FLAG_WARM = 4                   # 判定为热请求（命中缓存）
+CACHE_FLAGS = {'cold': FLAG_COLD, 'warm': FLAG_WARM}
+FLAG_DNS = 8                    # 主机名解析失败（没有发出请求）
+FLAG_MISMATCH = 16              # 内容校验不一致（见 ipfs_gateway_verify），不计为成功
+FLAG_TRUSTLESS = 32             # 块/CAR 模式的探测（见 ipfs_gateway_trustless），成功与否看 FLAG_BLOCKS
+FLAG_BLOCKS = 64                # 块/CAR 模式下收到了至少一个完整的块
+FLAG_INCOMPLETE = 128           # 校验模式下响应不是完整的块，无法确认内容，不计为成功
+
+RAW_FORMAT = struct.Struct('<dIIHBxI7f')
+RAW_TIME = struct.Struct('<d')  # 原始记录开头的时间戳
+
+def _rollup_format(hist_type):
+    return struct.Struct(f'<IIIIQ{len(COUNTED_METRICS)}I{len(METRICS)}f'
+                         f'{len(HIST_METRICS) * HIST_BINS}{hist_type}')
+
+
+# 各级汇总的记录格式：1h 的直方图计数不会超过 16 位，1d 用 32 位
+ROLLUP_FORMATS = {'1h': _rollup_format('H'), '1d': _rollup_format('I')}
+HIST_LIMITS = {'1h': 0xFFFF, '1d': 0xFFFFFFFF}
+
+
+def hist_bin(ms):
+    """耗时 (ms) 所在的直方图桶：0 号桶为 <1ms，k 号桶为 [2^((k-1)/2), 2^(k/2)) ms"""
+    if ms < 1:
+        return 0
+    return min(int(math.log2(ms) * 2) + 1, HIST_BINS - 1)
+
+
+def hist_value(k):
+    """直方图第 k 桶的代表值（几何中点，ms）"""
+    if k == 0:
+        return 0.5
+    return 2 ** ((k - 0.5) / 2)
+
+
+def hist_percentile(hist, q):
+    """由直方图估算第 q 百分位（最近秩法），没有样本时返回 None"""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = max(math.ceil(q / 100 * total), 1)
+    seen = 0
+    for k, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return hist_value(k)
+    return hist_value(HIST_BINS - 1)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)), 1) - 1]
+
+
+def record_success(status_code, flags):
+    """按原始记录的状态码和标志判断探测是否成功（与 ipfs_gateway_verify.probe_success 一致）"""
+    if flags & (FLAG_MISMATCH | FLAG_INCOMPLETE):
+        return False
+    if flags & FLAG_TRUSTLESS:
+        return status_code in (200, 206) and bool(flags & FLAG_BLOCKS)
+    return status_code == 206
+
+
+def record_values(record):
+    """原始记录中本次探测实际测得的指标 {指标: ms}（记录中的 dns/tcp/tls 全为 0 表示复用了连接）"""
+    metrics = measured_metrics(record[3], record[5], any(record[7:10]))
+    return {metric: record[6 + i] for i, metric in enumerate(METRICS) if metric in metrics}
+
+
+def measured_metrics(status_code, size, connected):
+    """本次探测实际测得的指标
+
+    与分阶段耗时的记录规则一致：复用连接时没有 DNS/TCP/TLS，没有响应时没有首字节时间和总耗时，
+    没有下载数据时没有传输时间；响应时间（含 1500ms 的超时）始终记录。
+    """
+    metrics = ['response_time']
+    if connected:
+        metrics += ['dns', 'tcp', 'tls']
+    if status_code:
+        metrics += ['ttfb', 'total']
+    if size:
+        metrics.append('transfer')
+    return metrics
+
+
+class Rollup:
+    """一个时间桶内单个网关的汇总，可与同一桶的其他汇总相加"""
+    __slots__ = ('count', 'success', 'bytes', 'counts', 'sums', 'hists')
+
+    def __init__(self):
+        self.count = 0
+        self.success = 0
+        self.bytes = 0
+        self.counts = [0] * len(METRICS)
+        self.sums = [0.0] * len(METRICS)
+        self.hists = [[0] * HIST_BINS for _ in HIST_METRICS]
+
+    def add(self, success, size, values):
+        """加入一次探测，values 为本次测得的指标 {指标: ms}（只含 measured_metrics 中的指标）"""
+        self.count += 1
+        if success:
+            self.success += 1
+        self.bytes += size
+        for i, metric in enumerate(METRICS):
+            value = values.get(metric)
+            if value is not None:
+                self.counts[i] += 1
+                self.sums[i] += value
+        for i, metric in enumerate(HIST_METRICS):
+            value = values.get(metric)
+            if value is not None:
+                self.hists[i][hist_bin(value)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.success += other.success
+        self.bytes += other.bytes
+        for i in range(len(METRICS)):
+            self.counts[i] += other.counts[i]
+            self.sums[i] += other.sums[i]
+        for mine, theirs in zip(self.hists, other.hists):
+            for k in range(HIST_BINS):
+                mine[k] += theirs[k]
+
+    def pack(self, level, bucket, gateway_id):
+        limit = HIST_LIMITS[level]
+        hist = [min(count, limit) for h in self.hists for count in h]
+        counts = [self.counts[METRICS.index(metric)] for metric in COUNTED_METRICS]
+        return ROLLUP_FORMATS[level].pack(bucket, gateway_id, self.count, self.success,
+                                          self.bytes, *counts, *self.sums, *hist)
+
+    @classmethod
+    def unpack(cls, fields):
+        """由 ROLLUP_FORMATS 解出的字段（去掉时间桶和网关ID）构建"""
+        rollup = cls()
+        n, c = len(METRICS), len(COUNTED_METRICS)
+        rollup.count, rollup.success, rollup.bytes = fields[0], fields[1], fields[2]
+        counted = dict(zip(COUNTED_METRICS, fields[3:3 + c]))
+        # 同一组的指标总是一起测得（见 measured_metrics），响应时间每次都有
+        group = {'response_time': rollup.count, 'dns': counted['dns'], 'tcp': counted['dns'],
+                 'tls': counted['dns'], 'ttfb': counted['ttfb'], 'total': counted['ttfb'],
+                 'transfer': counted['transfer']}
+        rollup.counts = [group[metric] for metric in METRICS]
+        rollup.sums = list(fields[3 + c:3 + c + n])
+        hist = fields[3 + c + n:]
+        rollup.hists = [list(hist[i * HIST_BINS:(i + 1) * HIST_BINS])
+                        for i in range(len(HIST_METRICS))]
+        return rollup
+
+    def mean(self, metric):
+        i = METRICS.index(metric)
+        return self.sums[i] / self.counts[i] if self.counts[i] else None
+
+    def hist(self, metric):
+        return self.hists[HIST_METRICS.index(metric)] if metric in HIST_METRICS else None
+
+
+def _segment_start(level, name):
+    """由段文件名解析该段的起始时间 (UTC)"""
+    return datetime.strptime(name, SEGMENT_FORMATS[level]).replace(tzinfo=timezone.utc)
+
+
+def _segment_end(level, start):
+    """该段的结束时间（下一段的起始时间）"""
+    if SEGMENT_FORMATS[level] == '%Y%m%d':
+        return start + timedelta(days=1)
+    if SEGMENT_FORMATS[level] == '%Y%m':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def _bisect_time(f, count, ts, right=False):
+    """段内第一条时间戳不小于 ts（right=True 时为大于 ts）的原始记录序号，记录按时间顺序追加"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid * RAW_FORMAT.size)
+        value = RAW_TIME.unpack(f.read(RAW_TIME.size))[0]
+        if value < ts or (right and value == ts):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class ProbeHistory:
+    """追加写的探测历史及其 1m/1h/1d 汇总，可在多个线程中并发记录"""
+
+    def __init__(self, directory=HISTORY_DIR, raw_retention_days=RAW_RETENTION_DAYS,
+                 rollup_retention_days=None, clock=time.time):
+        self.dir = Path(directory)
+        self.retention = {'raw': raw_retention_days}
+        self.retention.update(rollup_retention_days or ROLLUP_RETENTION_DAYS)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = {'g': {}, 'c': {}}      # 类型 -> {名称: ID}
+        self._names = {'g': {}, 'c': {}}    # 类型 -> {ID: 名称}
+        self._files = {}                    # (级别, 段名) -> 追加写的文件
+        self._open = {level: {} for level in STORED_LEVELS}  # 级别 -> {网关ID: (时间桶, Rollup)}
+        self._load_ids()
+
+    # ---- 写入 ----
+
+    def _load_ids(self):
+        path = self.dir / 'ids.tsv'
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3:
+                    continue    # 崩溃时最后一行可能不完整
+                kind, id_, name = parts
+                self._ids[kind][name] = int(id_)
+                self._names[kind][int(id_)] = name
+
+    def _id(self, kind, name):
+        """返回名称的整数 ID，新名称追加写入 ids.tsv（调用方持有锁）"""
+        id_ = self._ids[kind].get(name)
+        if id_ is None:
+            id_ = len(self._ids[kind])
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with open(self.dir / 'ids.tsv', 'a', encoding='utf-8') as f:
+                f.write(f"{kind}\t{id_}\t{name}\n")
+            self._ids[kind][name] = id_
+            self._names[kind][id_] = name
+        return id_
+
+    def _segment(self, level, ts):
+        """返回时间戳所在段的追加写文件，进入新的段时关闭旧段并清理过期段（调用方持有锁）"""
+        name = time.strftime(SEGMENT_FORMATS[level], time.gmtime(ts))
+        f = self._files.get((level, name))
+        if f is None:
+            for key in [key for key in self._files if key[0] == level]:
+                self._files.pop(key).close()
+            self.dir.mkdir(parents=True, exist_ok=True)
+            f = self._files[(level, name)] = open(self.dir / f"{level}-{name}.bin", 'ab')
+            self._prune_level(level)
+        return f
+
+    def record(self, url, cid, result, ts=None):
+        """记录一次探测结果（熔断跳过的结果没有实际发出请求，不记录）"""
+        if result.get('skipped'):
+            return
+        status_code = result.get('status_code') or 0
+        size = int(result.get('size') or 0)
+        values = {metric: result.get(RESULT_FIELDS[metric], 0) or 0
+                  for metric in measured_metrics(status_code, size, bool(result.get('connect_time')))}
+        flags = FLAG_DEADLINE if result.get('deadline_exceeded') else 0
+        flags |= CACHE_FLAGS.get(result.get('cache'), 0)
+        if result.get('dns_error'):
+            flags |= FLAG_DNS
+        if result.get('integrity') == 'mismatch':
+            flags |= FLAG_MISMATCH
+        elif result.get('integrity') == 'incomplete':
+            flags |= FLAG_INCOMPLETE
+        if 'blocks' in result:
+            flags |= FLAG_TRUSTLESS | (FLAG_BLOCKS if result['blocks'] else 0)
+        success = record_success(status_code, flags)
+        with self._lock:
+            # 在锁内取时间戳，保证段内的原始记录按时间顺序追加（查询时据此二分查找）
+            ts = self._clock() if ts is None else ts
+            gateway_id = self._id('g', url)
+            cid_id = self._id('c', cid or '')
+            self._segment('raw', ts).write(RAW_FORMAT.pack(
+                ts, gateway_id, cid_id, status_code, flags, min(size, 0xFFFFFFFF),
+                *(result.get(RESULT_FIELDS[metric], 0) or 0 for metric in METRICS)))
+            for level in STORED_LEVELS:
+                seconds = ROLLUP_SECONDS[level]
+                bucket = int(ts // seconds * seconds)
+                current = self._open[level].get(gateway_id)
+                if current is None or current[0] != bucket:
+                    if current is not None:
+                        self._write_rollup(level, gateway_id, *current)
+                    current = self._open[level][gateway_id] = (bucket, Rollup())
+                current[1].add(success, size, values)
+
+    def _write_rollup(self, level, gateway_id, bucket, rollup):
+        self._segment(level, bucket).write(rollup.pack(level, bucket, gateway_id))
+
+    def flush(self):
+        """把缓冲中的原始记录写入文件（未结束的汇总时间桶仍保留在内存中，查询时一并计入）"""
+        with self._lock:
+            for f in self._files.values():
+                f.flush()
+
+    def close(self):
+        """写出所有未结束的汇总时间桶并关闭文件"""
+        with self._lock:
+            for level, buckets in self._open.items():
+                for gateway_id, (bucket, rollup) in buckets.items():
+                    self._write_rollup(level, gateway_id, bucket, rollup)
+                buckets.clear()
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    # ---- 保留期 ----
+
+    def _prune_level(self, level):
+        cutoff = self._clock() - self.retention[level] * 86400
+        for path in self.dir.glob(f"{level}-*.bin"):
+            if (level, path.stem.split('-', 1)[1]) in self._files:
+                continue
+            try:
+                # 段只追加写，最后写入时间早于期限说明整段记录都已过期
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def prune(self):
+        """删除超过保留期限的段（只由写入方调用）"""
+        with self._lock:
+            for level in self.retention:
+                self._prune_level(level)
+
+    # ---- 查询 ----
+
+    def _segments(self, level, since, until):
+        """与 [since, until] 重叠的段文件"""
+        paths = []
+        for path in sorted(self.dir.glob(f"{level}-*.bin")):
+            try:
+                start = _segment_start(level, path.stem.split('-', 1)[1])
+            except ValueError:
+                continue
+            if start.timestamp() <= until and _segment_end(level, start).timestamp() > since:
+                paths.append(path)
+        return paths
+
+    def _raw_records(self, gateway_id, cid_id, since, until):
+        if gateway_id is None:
+            return
+        size = RAW_FORMAT.size
+        for path in self._segments('raw', since, until):
+            with open(path, 'rb') as f:
+                count = f.seek(0, 2) // size
+                first = _bisect_time(f, count, since)
+                last = _bisect_time(f, count, until, right=True)
+                f.seek(first * size)
+                data = f.read((last - first) * size)
+            for record in RAW_FORMAT.iter_unpack(data[:len(data) - len(data) % size]):
+                if record[1] == gateway_id and (cid_id is None or record[2] == cid_id):
+                    yield record
+
+    def _rollups(self, level, gateway_id, since, until):
+        """合并后的 {时间桶: Rollup}，包括内存中尚未写出的时间桶；1m 级由原始记录现算"""
+        merged = {}
+        seconds = ROLLUP_SECONDS[level]
+        if level not in STORED_LEVELS:
+            start = since // seconds * seconds
+            for record in self._raw_records(gateway_id, None, start, until):
+                bucket = int(record[0] // seconds * seconds)
+                rollup = merged.get(bucket)
+                if rollup is None:
+                    rollup = merged[bucket] = Rollup()
+                rollup.add(record_success(record[3], record[4]), record[5], record_values(record))
+            return merged
+        record_format = ROLLUP_FORMATS[level]
+        for path in self._segments(level, since, until):
+            data = path.read_bytes()
+            data = data[:len(data) - len(data) % record_format.size]
+            for fields in record_format.iter_unpack(data):
+                bucket = fields[0]
+                if fields[1] != gateway_id or bucket + seconds <= since or bucket > until:
+                    continue
+                rollup = Rollup.unpack(fields[2:])
+                if bucket in merged:
+                    merged[bucket].merge(rollup)
+                else:
+                    merged[bucket] = rollup
+        with self._lock:
+            current = self._open[level].get(gateway_id)
+            if current is not None and current[0] + seconds > since and current[0] <= until:
+                merged.setdefault(current[0], Rollup()).merge(current[1])
+        return merged
+
+    def _window(self, since, until, days):
+        now = self._clock()
+        until = now if until is None else until
+        if since is None:
+            since = until - days * 86400
+        return since, until
+
+    def _level_for(self, since):
+        """覆盖 since 的最细一级数据：原始记录或某一级汇总"""
+        age_days = (self._clock() - since) / 86400
+        for level in ('raw',) + STORED_LEVELS:
+            if age_days <= self.retention[level]:
+                return level
+        return '1d'
+
+    def query(self, url, metric='ttfb', since=None, until=None, days=7, cid=None,
+              percentiles=(50, 95, 99), level=None, cache=None):
+        """统计网关在时间窗口内的某项指标
+
+        返回 {'level', 'count', 'success_rate', 'bytes', 'samples', 'mean', 'p50', 'p95', ...}；
+        count 为探测次数，samples 为测得该指标的次数。cache 为 'cold' / 'warm' 时只统计对应的请求。
+        窗口超出原始记录的保留期时使用汇总数据，此时不支持按 CID 或冷/热过滤，
+        百分位只对 HIST_METRICS 中的指标可用（其余为 None）。
+        """
+        if metric not in METRICS:
+            raise ValueError(f"未知的指标: {metric}")
+        if cache is not None and cache not in CACHE_FLAGS:
+            raise ValueError(f"未知的请求类型: {cache}")
+        since, until = self._window(since, until, days)
+        level = level or self._level_for(since)
+        self.flush()
+        stats = {'level': level, 'since': since, 'until': until}
+        gateway_id = self._ids['g'].get(url)
+        if level == 'raw':
+            cid_id = None
+            if cid is not None:
+                cid_id = self._ids['c'].get(cid, -1)
+            values, count, success, total_bytes = [], 0, 0, 0
+            cache_flag = CACHE_FLAGS[cache] if cache is not None else 0
+            for record in self._raw_records(gateway_id, cid_id, since, until):
+                if cache_flag and not record[4] & cache_flag:
+                    continue
+                count += 1
+                success += record_success(record[3], record[4])
+                total_bytes += record[5]
+                value = record_values(record).get(metric)
+                if value is not None:
+                    values.append(value)
+            stats.update(count=count, success_rate=success / count if count else None,
+                         bytes=total_bytes, samples=len(values),
+                         mean=sum(values) / len(values) if values else None)
+            for q in percentiles:
+                stats[f"p{q}"] = _percentile(values, q) if values else None
+            return stats
+
+        if cid is not None or cache is not None:
+            raise ValueError("汇总数据不区分 CID 和冷/热请求，按它们查询时窗口需在原始记录的保留期内")
+        total = Rollup()
+        if gateway_id is not None:
+            for rollup in self._rollups(level, gateway_id, since, until).values():
+                total.merge(rollup)
+        hist = total.hist(metric)
+        stats.update(count=total.count,
+                     success_rate=total.success / total.count if total.count else None,
+                     bytes=total.bytes, samples=total.counts[METRICS.index(metric)],
+                     mean=total.mean(metric))
+        for q in percentiles:
+            stats[f"p{q}"] = hist_percentile(hist, q) if hist else None
+        return stats
+
+    def percentile(self, url, metric='ttfb', q=95, **window):
+        """时间窗口内某项指标的第 q 百分位 (ms)，例如 percentile(url, 'ttfb', 95, days=7)"""
+        return self.query(url, metric, percentiles=(q,), **window)[f"p{q}"]
+
+    def series(self, url, level='1h', metric='ttfb', since=None, until=None, days=7):
+        """按时间桶返回趋势 [{'time', 'count', 'success_rate', 'mean', 'p95'}, ...]"""
+        if level not in ROLLUP_SECONDS:
+            raise ValueError(f"未知的汇总级别: {level}")
+        since, until = self._window(since, until, days)
+        self.flush()
+        gateway_id = self._ids['g'].get(url)
+        if gateway_id is None:
+            return []
+        rollups = self._rollups(level, gateway_id, since, until)
+        points = []
+        for bucket in sorted(rollups):
+            rollup = rollups[bucket]
+            hist = rollup.hist(metric)
+            points.append({
+                'time': bucket,
+                'count': rollup.count,
+                'success_rate': rollup.success / rollup.count if rollup.count else None,
+                'mean': rollup.mean(metric),
+                'p95': hist_percentile(hist, 95) if hist else None,
+            })
+        return points
+
+    def gateways(self):
+        """历史中出现过的网关"""
+        return list(self._ids['g'])
+
+
+def parse_history_args(argv):
+    parser = argparse.ArgumentParser(prog='ipfs_gateway_history.py',
+                                     description='查询网关的探测历史')
+    parser.add_argument('url', help='网关URL')
+    parser.add_argument('--dir', default=HISTORY_DIR, help='历史数据目录')
+    parser.add_argument('--metric', default='ttfb', choices=METRICS)
+    parser.add_argument('--days', type=float, default=7, help='查询最近多少天')
+    parser.add_argument('--cid', default=None, help='只统计该 CID 的探测')
+    parser.add_argument('--cache', default=None, choices=tuple(CACHE_FLAGS),
+                        help='只统计冷 (未命中缓存) 或热 (命中缓存) 请求')
+    parser.add_argument('--series', default=None, choices=tuple(ROLLUP_SECONDS),
+                        help='按该级别输出趋势而不是汇总')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_history_args(argv)
+    history = ProbeHistory(args.dir)
+    try:
+        if args.series:
+            result = history.series(args.url, level=args.series, metric=args.metric, days=args.days)
+        else:
+            result = history.query(args.url, args.metric, days=args.days, cid=args.cid,
+                                   cache=args.cache)
+    finally:
+        history.close()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return result
+
+
+if __name__ == '__main__':
+    main()
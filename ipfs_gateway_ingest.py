@@ -0,0 +1,257 @@
+"""网关列表导入
+
+原来只在没有数据文件时按行读取 ipfs_gateway.txt / ipfs_gateway_side.txt（只做 strip()），
+之后列表里新增的网关不会被加入；同一网关的不同写法（末尾斜杠、默认端口、大小写、
+未加方括号的 IPv6 地址）会成为多个网关，每个 CID 都被重复探测。导入阶段在每次启动时：
+
+1. 规范化：补全协议、协议和主机名小写、去掉默认端口、末尾斜杠、多余的 /ipfs 路径、
+   查询参数和片段，IPv6 地址加方括号；无法解析的行记录日志后跳过；
+2. 去重：规范化后相同的条目只保留一个，同时出现在主、侧列表中的按主网关处理；
+3. 按后端分组：同一注册域名（按公共后缀划分，见 base_domain）下、协议和端口相同且解析到完全相同地址集合的主机名
+   （例如 ipfs-1.example.com ~ ipfs-15.example.com 指向同一台服务器）合并为一个网关，
+   其余主机名记为它的别名（aliases）不再单独探测。只比较同一域名下的主机名，
+   避免把共用 CDN 任播地址的不同网关误合并；
+4. 增量合并：已有数据的键也按规范形式整理（重复的保留测试次数多的一条），只解析新网关所在的组，
+   列表中新出现的网关加入，已记录的别名不再加入，已有网关保留统计数据并按列表更新主/侧属性。
+"""
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from ipfs_gateway_dns import DnsError, get_resolver
+from ipfs_gateway_log import log_debug, log_info, log_warning
+
+INGEST_RESOLVE = True           # 是否解析主机名以合并指向同一后端的网关
+INGEST_RESOLVE_WORKERS = 32     # 解析主机名的并发线程数
+INGEST_RESOLVE_TIMEOUT = 10     # 解析全部主机名的总时限 (秒)，超时未完成的主机名不参与合并
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# 国家/地区顶级域名下常见的二级公共后缀标签（co.uk、com.cn、ac.jp、org.au ...）
+CCTLD_SECOND_LEVELS = frozenset((
+    'ac', 'co', 'com', 'edu', 'gov', 'gv', 'ltd', 'me', 'mil', 'ne', 'net', 'nhs', 'nom', 'or',
+    'org', 'plc', 'sch',
+))
+# 其他多级公共后缀：不同所有者可以在其下注册域名或部署服务（含托管平台的子域名）
+MULTI_LABEL_SUFFIXES = frozenset((
+    'eu.org', 'us.org', 'uk.net', 'gb.net', 'us.com', 'eu.com', 'cn.com', 'de.com', 'jpn.com',
+    'github.io', 'gitlab.io', 'pages.dev', 'workers.dev', 'vercel.app', 'netlify.app',
+    'herokuapp.com', 'fly.dev', 'onrender.com', 'web.app', 'firebaseapp.com', 'azurewebsites.net',
+    'cloudfront.net', 'appspot.com', 'dweb.link', 'ddns.net', 'duckdns.org',
+))
+
+
+def canonical_url(line):
+    """把列表中的一行规范化为网关URL，空行、注释和无法解析的行返回 None"""
+    text = line.strip()
+    if not text or text.startswith('#'):
+        return None
+    if '://' not in text:
+        text = 'https://' + text
+    scheme, rest = text.split('://', 1)
+    scheme = scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+    netloc, sep, path = rest.partition('/')
+    path = sep + path
+    netloc = netloc.rsplit('@', 1)[-1]
+
+    # 未加方括号的 IPv6 地址（如 https://2a01:4f8::20）整体作为主机名
+    if netloc.count(':') > 1 and not netloc.startswith('['):
+        try:
+            netloc = f"[{ipaddress.IPv6Address(netloc)}]"
+        except ValueError:
+            return None
+    try:
+        parts = urlsplit(f"{scheme}://{netloc}{path}")
+        port = parts.port
+    except ValueError:
+        return None
+    host = (parts.hostname or '').rstrip('.')
+    if not host:
+        return None
+    try:
+        address = ipaddress.ip_address(host)
+        host = f"[{address}]" if address.version == 6 else str(address)
+    except ValueError:
+        host = host.lower()
+
+    path = parts.path.rstrip('/')
+    # 测试URL由 _build_test_url 拼接 /ipfs/<CID>，列表中带的 /ipfs 前缀去掉
+    if path.lower() == '/ipfs':
+        path = ''
+    port_part = f":{port}" if port is not None and port != DEFAULT_PORTS[scheme] else ''
+    return f"{scheme}://{host}{port_part}{path}"
+
+
+def read_gateway_list(path):
+    """读取网关列表文件，返回按出现顺序去重后的规范URL列表"""
+    urls = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            url = canonical_url(line)
+            if url is None:
+                if line.strip() and not line.strip().startswith('#'):
+                    log_warning("忽略无法解析的网关: %s:%d %r", path, number, line.strip())
+                continue
+            urls.setdefault(url, None)
+    return list(urls)
+
+
+def public_suffix(host):
+    """主机名的公共后缀：MULTI_LABEL_SUFFIXES 中的多级后缀、两字母顶级域名下的常见二级后缀，
+    否则为顶级域名（没有依赖完整的公共后缀列表，未收录的多级后缀仍按顶级域名处理）"""
+    labels = host.split('.')
+    if len(labels) > 2 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-2:])
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in CCTLD_SECOND_LEVELS:
+        return '.'.join(labels[-2:])
+    return labels[-1]
+
+
+def base_domain(host):
+    """主机名的注册域名（公共后缀再加一级），IP 地址返回其本身"""
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+    suffix = public_suffix(host)
+    labels = host.split('.')
+    return '.'.join(labels[-(suffix.count('.') + 2):])
+
+
+def backend_key(url):
+    """分组时需要相同的部分：(协议, 端口, 注册域名, 路径)"""
+    parts = urlsplit(url)
+    return (parts.scheme, parts.port or DEFAULT_PORTS[parts.scheme],
+            base_domain(parts.hostname), parts.path)
+
+
+def resolve_addresses(host):
+    """用共享的解析器解析主机名的全部地址（结果留在缓存中供探测使用），失败时返回空集合"""
+    try:
+        return frozenset(get_resolver().resolve(host))
+    except DnsError:
+        return frozenset()
+
+
+def resolve_hosts(hosts, resolver=resolve_addresses, workers=INGEST_RESOLVE_WORKERS,
+                  timeout=INGEST_RESOLVE_TIMEOUT):
+    """并发解析主机名 {host: 地址集合}，超过 timeout 仍未完成的主机名不在结果中"""
+    if not hosts:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(hosts)))
+    try:
+        futures = {executor.submit(resolver, host): host for host in hosts}
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            log_warning("解析超时，%d 个主机名不参与合并", len(not_done))
+        return {futures[future]: future.result() for future in done}
+    finally:
+        # 不等待卡住的解析线程
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def group_aliases(urls, known=(), resolver=resolve_addresses, timeout=INGEST_RESOLVE_TIMEOUT):
+    """找出指向同一后端的网关，返回 {别名URL: 保留的网关URL}
+
+    urls 按优先顺序排列（先主网关后侧网关），同一组中已有数据（known）的网关优先保留，
+    其次是最靠前的一个。只有同一注册域名下、协议/端口/路径相同的主机名才需要解析，
+    且只解析含有新网关的组：已有的网关在之前的导入中已经分过组，不必每次启动都解析。
+    """
+    known = set(known)
+    candidates = {}
+    for url in urls:
+        candidates.setdefault(backend_key(url), []).append(url)
+    candidates = [sorted(group, key=lambda url: url not in known)
+                  for group in candidates.values()
+                  if len(group) > 1 and not known.issuperset(group)]
+    hosts = {urlsplit(url).hostname for group in candidates for url in group}
+    addresses = resolve_hosts(sorted(hosts), resolver=resolver, timeout=timeout)
+
+    aliases = {}
+    for group in candidates:
+        primary_by_addresses = {}
+        for url in group:
+            resolved = addresses.get(urlsplit(url).hostname)
+            if not resolved:
+                continue
+            primary = primary_by_addresses.setdefault(resolved, url)
+            if primary != url:
+                aliases[url] = primary
+    return aliases
+
+
+def ingest_gateway_lists(main_file, side_file, gateways=None, resolve=INGEST_RESOLVE,
+                         resolver=resolve_addresses):
+    """读取主、侧网关列表，返回 (entries, aliases)
+
+    gateways: 已有的网关数据 {url: 网关}，其中记录的别名不再作为新网关加入。
+    entries: {规范URL: 是否主网关}，按列表顺序；aliases: {别名URL: 保留的网关URL}
+    """
+    gateways = gateways or {}
+    recorded = {alias for gateway in gateways.values() for alias in gateway['aliases']}
+    entries = {}
+    for path, is_main in ((main_file, True), (side_file, False)):
+        if path is None or not Path(path).exists():
+            continue
+        for url in read_gateway_list(path):
+            if url not in recorded:
+                entries.setdefault(url, is_main)
+    known = {canonical_url(url) for url in gateways}
+    aliases = group_aliases(list(entries), known, resolver=resolver) if resolve else {}
+    for alias in aliases:
+        entries.pop(alias)
+    if aliases:
+        log_info("%d 个网关与其他网关指向同一后端，按别名合并", len(aliases))
+    return entries, aliases
+
+
+def merge_gateway_lists(gateways, entries, aliases, factory):
+    """把导入的列表增量合并到已有的网关数据中（原地修改 gateways）
+
+    gateways: {url: GatewayState}；factory(url, is_main) 创建新网关。
+    返回 (changed, removed)：需要写入存储的网关URL集合和需要从存储中删除的URL集合。
+    """
+    changed, removed = set(), set()
+
+    # 已有数据的键按规范形式整理，重复的保留测试次数多的一条
+    for url in list(gateways):
+        canonical = canonical_url(url)
+        if canonical is None or canonical == url:
+            continue
+        gateway = gateways.pop(url)
+        removed.add(url)
+        existing = gateways.get(canonical)
+        if existing is None or existing['total_attempts'] < gateway['total_attempts']:
+            gateway['url'] = canonical
+            gateways[canonical] = gateway
+        changed.add(canonical)
+        log_debug("网关URL规范化: %s -> %s", url, canonical)
+
+    added = 0
+    for url, is_main in entries.items():
+        gateway = gateways.get(url)
+        if gateway is None:
+            gateways[url] = factory(url, is_main)
+            changed.add(url)
+            added += 1
+        elif gateway['is_main'] != is_main:
+            gateway['is_main'] = is_main
+            changed.add(url)
+
+    for alias, primary in aliases.items():
+        if gateways.pop(alias, None) is not None:
+            removed.add(alias)
+        gateway = gateways.get(primary)
+        if gateway is not None and alias not in gateway['aliases']:
+            gateway['aliases'] = gateway['aliases'] + [alias]
+            changed.add(primary)
+
+    removed -= set(gateways)
+    changed &= set(gateways)
+    if added:
+        log_info("从网关列表新增 %d 个网关", added)
+    return changed, removed
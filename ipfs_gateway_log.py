@@ -0,0 +1,174 @@
+"""分级日志
+
+替代原来无条件打印到 stdout 的 debug_print：
+
+- 分级：TRACE < DEBUG < INFO < WARNING < ERROR，低于当前级别的调用只做一次级别判断；
+- 延迟格式化：log_debug("测试完成: %s", url, data=result) 只有在该级别启用时才拼接消息，
+  data 只在输出线程中序列化；
+- 所有输出都经队列交给后台线程写出，探测线程不再争用 stdout；
+- 可选的 JSON Lines 文件，每条日志一行，级别可以与控制台不同；
+- 按比例抽样的逐探测追踪（should_trace），不开 DEBUG 也能看到少量探测的完整细节。
+
+控制台格式与原来的 debug_print 相同：
+    [DEBUG] 2025-04-02 22:43:20.123 消息
+    [DEBUG] Data: {...}
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime
+
+TRACE = 5
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+logging.addLevelName(TRACE, 'TRACE')
+
+logger = logging.getLogger('ipfs_gateway')
+
+# 旧的 debug_print 前缀对应的级别，未列出的前缀（[START]、[TEST] 等）按 INFO 处理
+PREFIX_LEVELS = {
+    '[DEBUG] ': DEBUG,
+    '[ERROR] ': ERROR,
+    '[WARNING] ': WARNING,
+    '[TRACE] ': TRACE,
+}
+
+_listener = None
+
+
+def _timestamp(record):
+    return datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def _prefix(record):
+    return getattr(record, 'prefix', None) or f"[{record.levelname}] "
+
+
+class ConsoleFormatter(logging.Formatter):
+    """与原 debug_print 相同的控制台格式"""
+
+    def format(self, record):
+        prefix = _prefix(record)
+        text = f"{prefix}{_timestamp(record)} {record.getMessage()}"
+        data = getattr(record, 'data', None)
+        if data is not None:
+            text += f"\n{prefix}Data: {json.dumps(data, indent=2, ensure_ascii=False, default=str)}"
+        return text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志一个 JSON 对象"""
+
+    def format(self, record):
+        entry = {
+            'time': _timestamp(record),
+            'level': record.levelname,
+            'tag': _prefix(record).strip().strip('[]'),
+            'msg': record.getMessage(),
+        }
+        data = getattr(record, 'data', None)
+        if data is not None:
+            entry['data'] = data
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _level(value):
+    if isinstance(value, str):
+        return logging.getLevelName(value.upper())
+    return value
+
+
+def setup_logging(level=INFO, json_file=None, json_level=DEBUG, stream=None):
+    """配置日志输出：控制台（级别 level）和可选的 JSON Lines 文件（级别 json_level）
+
+    两个输出都挂在后台线程的 QueueListener 上，调用线程只把日志记录放入队列。
+    重复调用会先停止之前的后台线程。
+    """
+    global _listener
+    shutdown_logging()
+    level = _level(level)
+    handlers = []
+
+    console = logging.StreamHandler(stream or sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(ConsoleFormatter())
+    handlers.append(console)
+
+    effective = level
+    if json_file:
+        json_level = _level(json_level)
+        sink = logging.FileHandler(json_file, encoding='utf-8')
+        sink.setLevel(json_level)
+        sink.setFormatter(JsonLinesFormatter())
+        handlers.append(sink)
+        effective = min(level, json_level)
+
+    log_queue = queue.SimpleQueue()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(effective)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def log_enabled(level):
+    """该级别是否会被输出（用于在构造昂贵的 data 之前判断）"""
+    return logger.isEnabledFor(level)
+
+
+def _log(level, msg, args, data, prefix):
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={'data': data, 'prefix': prefix})
+
+
+def log_trace(msg, *args, data=None, prefix=None):
+    _log(TRACE, msg, args, data, prefix)
+
+
+def log_debug(msg, *args, data=None, prefix=None):
+    _log(DEBUG, msg, args, data, prefix)
+
+
+def log_info(msg, *args, data=None, prefix=None):
+    _log(INFO, msg, args, data, prefix)
+
+
+def log_warning(msg, *args, data=None, prefix=None):
+    _log(WARNING, msg, args, data, prefix)
+
+
+def log_error(msg, *args, data=None, prefix=None):
+    _log(ERROR, msg, args, data, prefix)
+
+
+def debug_print(msg, data=None, prefix="[DEBUG] "):
+    """兼容原来的调试输出函数：按前缀确定级别，[DEBUG] 为 DEBUG，[ERROR] 为 ERROR，其余为 INFO"""
+    _log(PREFIX_LEVELS.get(prefix, INFO), msg, (), data, prefix)
+
+
+def should_trace(rate, rng=random):
+    """逐探测追踪的抽样：以 rate 的概率返回 True"""
+    return rate > 0 and rng.random() < rate
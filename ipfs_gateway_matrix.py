@@ -0,0 +1,163 @@
+"""网关×CID 性能矩阵
+
+update_gateway_stats 把所有 CID 的结果合并成每个网关的一个 EMA 和权重，但同一网关对不同
+内容的表现差别很大：有的 CID 被它固定或缓存，有的要从 DHT 现找。CidMatrix 为每个出现过的
+(网关, CID) 组合单独保存 EMA、首字节时间、下载速度和权重（稀疏存储，只有测过的组合占内存），
+并回答"这个 CID 用哪些网关最快"：
+
+    matrix.update(url, cid, test_result)
+    matrix.best(cid, k, global_ranked)      # [(url, 得分, 'pair' / 'global'), ...]
+
+组合的得分向网关的全局权重收缩：score = (n·w_pair + CID_PRIOR·w_global) / (n + CID_PRIOR)，
+n 为该组合的测试次数。没有数据的组合直接使用全局权重，数据越多越接近组合自身的权重。
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+from pathlib import Path
+
+from ipfs_gateway_store import write_json_atomic
+from ipfs_gateway_score import score_sample, update_score
+
+CID_PRIOR = 2               # 收缩到全局权重的伪观测次数
+CID_MATRIX_TTL_DAYS = 30    # 超过该天数未测试的组合在保存时丢弃
+
+
+class PairStats:
+    """单个 (网关, CID) 组合的统计"""
+    __slots__ = ('tests', 'successes', 'ema', 'response_time', 'ttfb', 'speed', 'weight',
+                 'last_test_time')
+
+    FIELDS = __slots__
+
+    def __init__(self):
+        self.tests = 0
+        self.successes = 0
+        self.ema = 1.0
+        self.response_time = None   # 响应时间的 EMA (ms)
+        self.ttfb = None            # 成功时首字节时间的 EMA (ms)
+        self.speed = None           # 成功时下载速度的 EMA (KB/s)
+        self.weight = 1.0
+        self.last_test_time = None
+
+    # 按键读写字段，与缓存得分字典共用 update_score
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name in cls.FIELDS:
+            if data.get(name) is not None:
+                setattr(stats, name, data[name])
+        return stats
+
+
+class CidMatrix:
+    """稀疏的 网关×CID 统计矩阵，可在多个工作线程中并发更新
+
+    weight_func(ema, response_time, speed_kb) 计算组合的权重，与全局权重使用同一公式。
+    """
+
+    def __init__(self, weight_func, alpha, prior=CID_PRIOR):
+        self.weight_func = weight_func
+        self.alpha = alpha
+        self.prior = prior
+        self._pairs = {}        # cid -> {url: PairStats}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(pairs) for pairs in self._pairs.values())
+
+    def update(self, url, cid, test_result):
+        """计入一次探测结果（熔断跳过的结果不代表网关对该 CID 的表现，忽略）"""
+        if not cid or test_result.get('skipped'):
+            return
+        sample = score_sample(test_result)
+        with self._lock:
+            stats = self._pairs.setdefault(cid, {}).get(url)
+            if stats is None:
+                stats = self._pairs[cid][url] = PairStats()
+            update_score(stats, sample, self.alpha, self.weight_func)
+            stats.last_test_time = time.time()
+
+    def get(self, url, cid):
+        """返回组合统计的副本，没有数据时返回 None"""
+        with self._lock:
+            stats = self._pairs.get(cid, {}).get(url)
+            return stats.to_dict() if stats is not None else None
+
+    def pairs(self, cid):
+        """该 CID 下所有测过的网关 {url: 统计字典}"""
+        with self._lock:
+            return {url: stats.to_dict() for url, stats in self._pairs.get(cid, {}).items()}
+
+    def score(self, stats, global_weight):
+        """组合得分：按测试次数在组合权重和全局权重之间收缩"""
+        n = stats.tests
+        return (n * stats.weight + self.prior * global_weight) / (n + self.prior)
+
+    def best(self, cid, k, global_ranked, global_weight, accept=None):
+        """该 CID 得分最高的 k 个网关 [(url, 得分, 来源), ...]，来源为 'pair' 或 'global'
+
+        global_ranked: 按全局权重降序的 (url, weight) 可迭代对象（例如 RankIndex.iter_ranked()）
+        global_weight: url -> 全局权重
+        accept: 可选的过滤函数 url -> bool（例如只要主网关）
+
+        有数据的组合按收缩后的得分排序；其余网关按全局权重顺序只需取前 k 个，
+        总开销为 O(m log k + k)，m 为该 CID 测过的网关数。
+        """
+        with self._lock:
+            pairs = list(self._pairs.get(cid, {}).items())
+        scored = []
+        for url, stats in pairs:
+            if accept is not None and not accept(url):
+                continue
+            weight = global_weight(url)
+            if weight is None:
+                continue    # 已移除的网关
+            scored.append((self.score(stats, weight), url, 'pair'))
+        top_pairs = heapq.nlargest(k, scored)
+
+        with_data = {url for url, _ in pairs}
+        fallback = (
+            (weight, url, 'global') for url, weight in global_ranked
+            if url not in with_data and (accept is None or accept(url))
+        )
+        merged = heapq.merge(top_pairs, itertools.islice(fallback, k),
+                             key=lambda item: item[0], reverse=True)
+        return [(url, score, source) for score, url, source in itertools.islice(merged, k)]
+
+    def save(self, path, ttl_days=CID_MATRIX_TTL_DAYS):
+        """保存为 JSON {cid: {url: 统计}}，丢弃超过 ttl_days 未测试的组合"""
+        cutoff = time.time() - ttl_days * 86400
+        with self._lock:
+            for cid in list(self._pairs):
+                pairs = self._pairs[cid]
+                for url in [url for url, stats in pairs.items()
+                            if (stats.last_test_time or 0) < cutoff]:
+                    del pairs[url]
+                if not pairs:
+                    del self._pairs[cid]
+            data = {cid: {url: stats.to_dict() for url, stats in pairs.items()}
+                    for cid, pairs in self._pairs.items()}
+        write_json_atomic(path, data)
+
+    def load(self, path):
+        """从 save() 写出的文件加载，文件不存在时不做任何事"""
+        path = Path(path)
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            for cid, pairs in data.items():
+                self._pairs[cid] = {url: PairStats.from_dict(stats) for url, stats in pairs.items()}
@@ -0,0 +1,615 @@
+"""基于 asyncio 的网关探测引擎
+
+在单个事件循环中并发发起带 Range 的 GET 请求，取代每次探测都 fork 一个 curl 进程的做法。
+返回结果与 curl 探测保持一致：http_code / 首字节时间 / 等效速度 / 下载大小。
+同一网关的连接保存在按主机划分的 keep-alive 连接池中，跨 CID 和轮次复用。
+传入校验器（ipfs_gateway_verify.ContentVerifier）时响应体边读取边校验，结果记入 'integrity'；
+传入块流（ipfs_gateway_trustless）时按块/CAR 模式请求完整响应，块指标一并记入结果。
+"""
+import asyncio
+import ssl
+import time
+from urllib.parse import urlsplit, urljoin
+
+from ipfs_gateway_cache import cache_headers
+from ipfs_gateway_dns import DnsError, get_resolver, open_happy_eyeballs
+
+# 探测参数（与 curl 命令保持一致）
+PROBE_MAX_TIME = 15             # 单次探测最长时间 (秒)，对应 --max-time 15
+PROBE_RANGE_END = 1048576       # 请求范围上界，对应 --range 0-1048576
+PROBE_MAX_REDIRECTS = 20        # 最多跟随的重定向次数，对应 -L
+USER_AGENT = 'ipfs-gateway-checker/1.0'
+
+# 连接池参数
+POOL_MAX_PER_HOST = 4           # 每个主机最多保持的连接数
+POOL_MAX_TOTAL = 1000           # 全局最多保持的连接数
+POOL_IDLE_TIMEOUT = 60          # 空闲连接的最长保留时间 (秒)
+
+
+class ProbeMetrics:
+    """单次探测过程中逐步填充的测量值，超时后仍可读取已收集到的部分
+
+    各时间均为秒；time_starttransfer / time_total 从请求开始计时（与 curl 相同），
+    time_namelookup / time_tls 为对应阶段本身的耗时，time_connect 为建立连接的总耗时。
+    """
+    __slots__ = ('http_code', 'time_starttransfer', 'size_download', 'time_connect',
+                 'time_namelookup', 'time_tls', 'time_total', 'headers', 'dns_error',
+                 'integrity', 'block_metrics', 'body_complete')
+
+    def __init__(self):
+        self.http_code = 0
+        self.time_starttransfer = 0.0
+        self.size_download = 0
+        self.time_connect = 0.0         # 建立连接 (DNS + TCP + TLS) 的耗时，复用连接时为 0
+        self.time_namelookup = 0.0      # 其中 DNS 解析的耗时
+        self.time_tls = 0.0             # 其中 TLS 握手的耗时
+        self.time_total = 0.0           # 整个请求（含读取响应体）的耗时
+        self.headers = {}               # 最后一个响应的响应头（小写键）
+        self.dns_error = None           # 主机名解析失败的类型（见 ipfs_gateway_dns.DnsError）
+        self.integrity = None           # 内容校验结果（见 ipfs_gateway_verify），未校验时为 None
+        self.block_metrics = None       # 块/CAR 模式的块指标（见 ipfs_gateway_trustless）
+        self.body_complete = False      # 响应体是否完整读完（chunked 响应收到了结束块）
+
+    def to_result(self, http_code=None, size_download=None):
+        """按当前测量值构造测试结果字典，可覆盖状态码和下载大小
+
+        响应中带有缓存相关的响应头（Age、X-Cache 等）时一并放入 'cache_headers'，用于冷/热判定；
+        主机名解析失败时放入 'dns_error'，校验了内容时放入 'integrity'，块/CAR 模式下放入块指标。
+        """
+        result = build_probe_result(self.http_code if http_code is None else http_code,
+                                    self.time_starttransfer,
+                                    self.size_download if size_download is None else size_download,
+                                    self.time_connect,
+                                    time_total=self.time_total,
+                                    time_namelookup=self.time_namelookup,
+                                    time_tls=self.time_tls)
+        headers = cache_headers(self.headers)
+        if headers:
+            result['cache_headers'] = headers
+        if self.dns_error is not None:
+            result['dns_error'] = self.dns_error
+        if self.integrity is not None:
+            result['integrity'] = self.integrity
+        if self.block_metrics is not None:
+            result.update(self.block_metrics)
+        return result
+
+
+def build_probe_result(http_code, time_starttransfer, size_download, time_connect=0.0,
+                       time_total=None, time_namelookup=0.0, time_tls=0.0):
+    """根据测量值构造测试结果字典（curl 后端和异步后端共用）
+
+    connect_time 为本次探测建立连接的耗时，server_time 为首字节时间中扣除连接耗时的部分，
+    后者只反映网关自身的处理速度（单位均为 ms，上限 1500）。
+
+    分阶段耗时（ms，不设上限）：dns_time / tcp_time / tls_time 为建立连接的三个阶段，
+    ttfb 为首字节时间，transfer_time 为从首字节到传输结束的时间，total_time 为总耗时。
+    下载速度按 size / transfer_time 计算，不再把建立连接和等待首字节的时间混入吞吐量；
+    响应体随响应头一起到达（transfer_time 为 0）时按总耗时计算。
+    """
+    if time_total is None:
+        time_total = time_starttransfer
+    # 没有收到响应时不存在传输阶段
+    transfer = max(time_total - time_starttransfer, 0) if time_starttransfer > 0 else 0.0
+    phases = {
+        'dns_time': time_namelookup * 1000,
+        'tcp_time': max(time_connect - time_namelookup - time_tls, 0) * 1000,
+        'tls_time': time_tls * 1000,
+        'ttfb': time_starttransfer * 1000,
+        'transfer_time': transfer * 1000,
+        'total_time': time_total * 1000
+    }
+
+    connect_time = min(time_connect * 1000, 1500)
+    if size_download == 0:
+        return {
+            'response_time': 1500,
+            'status_code': http_code,
+            'speed': 0,
+            'size': 0,
+            'connect_time': connect_time,
+            'server_time': 1500,
+            **phases
+        }
+
+    # 确保响应时间不超过1500ms
+    response_time = min(time_starttransfer * 1000, 1500)
+
+    # 计算传输阶段的下载速度
+    if transfer > 0:
+        effective_speed = size_download / transfer
+    else:
+        effective_speed = size_download / time_total if time_total > 0 else 0
+
+    return {
+        'response_time': response_time,
+        'status_code': http_code,
+        'speed': effective_speed,
+        'size': size_download,
+        'connect_time': connect_time,
+        'server_time': min(max(time_starttransfer - time_connect, 0) * 1000, 1500),
+        **phases
+    }
+
+
+class PooledConnection:
+    """连接池中的一条连接"""
+    __slots__ = ('key', 'reader', 'writer', 'last_used', 'reused')
+
+    def __init__(self, key, reader, writer, now):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = now
+        self.reused = False
+
+    def is_usable(self):
+        """连接是否仍可发送请求（对端未关闭）"""
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """按 (scheme, host, port) 划分的 keep-alive 连接池
+
+    每个主机和全局都有连接数上限；达到全局上限时优先关闭最久未用的空闲连接，
+    否则等待其他连接归还。空闲超过 idle_timeout 的连接在下次获取时被淘汰。
+    连接池只在引擎的事件循环中使用，因此不需要加锁。
+    新建连接时主机名由共享的 DnsResolver 解析（缓存命中时 DNS 阶段接近 0），按 Happy Eyeballs 连接。
+    """
+
+    def __init__(self, ssl_context, max_per_host=POOL_MAX_PER_HOST,
+                 max_total=POOL_MAX_TOTAL, idle_timeout=POOL_IDLE_TIMEOUT, resolver=None):
+        self.ssl_context = ssl_context
+        self.resolver = resolver or get_resolver()
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self._idle = {}             # key -> [PooledConnection]，末尾为最近归还的连接
+        self._open_per_host = {}    # key -> 已打开（空闲 + 使用中）的连接数
+        self._open_total = 0
+        self._waiters = []          # 等待连接名额的 future
+
+    def _wake_waiters(self):
+        """唤醒所有等待者，由它们重新检查是否可以获取连接"""
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _release_slot(self, key):
+        """释放一个连接名额"""
+        self._open_total -= 1
+        count = self._open_per_host.get(key, 1) - 1
+        if count > 0:
+            self._open_per_host[key] = count
+        else:
+            self._open_per_host.pop(key, None)
+
+    def _discard(self, conn):
+        """关闭连接并释放名额"""
+        conn.close()
+        self._release_slot(conn.key)
+
+    def evict_idle(self, now=None):
+        """淘汰空闲超时或已被对端关闭的连接"""
+        now = time.monotonic() if now is None else now
+        for key in list(self._idle):
+            alive = []
+            for conn in self._idle[key]:
+                if now - conn.last_used > self.idle_timeout or not conn.is_usable():
+                    self._discard(conn)
+                else:
+                    alive.append(conn)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+
+    def _evict_oldest_idle(self):
+        """关闭全局最久未用的一条空闲连接，成功返回 True"""
+        oldest = None
+        for conns in self._idle.values():
+            if conns and (oldest is None or conns[0].last_used < oldest.last_used):
+                oldest = conns[0]
+        if oldest is None:
+            return False
+        self._idle[oldest.key].remove(oldest)
+        if not self._idle[oldest.key]:
+            del self._idle[oldest.key]
+        self._discard(oldest)
+        return True
+
+    def _take_idle(self, key):
+        """取出该主机一条可用的空闲连接"""
+        conns = self._idle.get(key)
+        now = time.monotonic()
+        while conns:
+            conn = conns.pop()
+            if now - conn.last_used <= self.idle_timeout and conn.is_usable():
+                if not conns:
+                    del self._idle[key]
+                conn.reused = True
+                return conn
+            self._discard(conn)
+        self._idle.pop(key, None)
+        return None
+
+    async def acquire(self, scheme, host, port):
+        """获取一条连接，返回 (connection, (DNS, TCP, TLS) 各阶段耗时秒数)，复用连接时均为 0"""
+        key = (scheme, host, port)
+        while True:
+            conn = self._take_idle(key)
+            if conn is not None:
+                return conn, (0.0, 0.0, 0.0)
+            if self._open_per_host.get(key, 0) < self.max_per_host:
+                if self._open_total < self.max_total or self._evict_oldest_idle():
+                    break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        # 先占用名额，避免等待建连期间超出上限
+        self._open_per_host[key] = self._open_per_host.get(key, 0) + 1
+        self._open_total += 1
+
+        try:
+            reader, writer, phases = await self._connect(scheme, host, port)
+        except BaseException:
+            self._release_slot(key)
+            self._wake_waiters()
+            raise
+        return PooledConnection(key, reader, writer, time.monotonic()), phases
+
+    async def _connect(self, scheme, host, port):
+        """依次进行 DNS 解析、TCP 连接和 TLS 握手并分别计时，返回 (reader, writer, (dns, tcp, tls))"""
+        use_tls = scheme == 'https'
+        start = time.monotonic()
+        addresses = await self.resolver.resolve_async(host)    # 解析失败时抛出 DnsError
+        resolved = time.monotonic()
+
+        # Python 3.11 之前的 StreamWriter 没有 start_tls()，此时 TLS 握手计入 TCP 阶段
+        tls_inline = use_tls and not hasattr(asyncio.StreamWriter, 'start_tls')
+        reader, writer = await open_happy_eyeballs(
+            addresses, port,
+            ssl=self.ssl_context if tls_inline else None,
+            server_hostname=host if tls_inline else None)
+        connected = time.monotonic()
+
+        tls_time = 0.0
+        if use_tls and not tls_inline:
+            try:
+                await writer.start_tls(self.ssl_context, server_hostname=host)
+            except BaseException:
+                writer.close()
+                raise
+            tls_time = time.monotonic() - connected
+        return reader, writer, (resolved - start, connected - resolved, tls_time)
+
+    def release(self, conn, reusable):
+        """归还连接；不可复用的连接直接关闭"""
+        if reusable and conn.is_usable():
+            conn.last_used = time.monotonic()
+            self._idle.setdefault(conn.key, []).append(conn)
+        else:
+            self._discard(conn)
+        self._wake_waiters()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        for conns in self._idle.values():
+            for conn in conns:
+                self._discard(conn)
+        self._idle.clear()
+
+    def stats(self):
+        """返回连接池当前状态"""
+        return {
+            'open_total': self._open_total,
+            'idle_total': sum(len(conns) for conns in self._idle.values()),
+            'hosts': len(self._open_per_host)
+        }
+
+
+class AsyncProbeEngine:
+    """进程内异步探测引擎
+
+    引擎持有一个独立的事件循环，调用方通过 run() 在当前线程中驱动协程。
+    并发量由信号量控制，数千个探测可以共享同一个事件循环。
+    事件循环和连接池在引擎的整个生命周期内保持不变，因此连接可以跨多次 run() 复用。
+    """
+
+    def __init__(self, max_concurrency=1000, max_time=PROBE_MAX_TIME,
+                 range_end=PROBE_RANGE_END, max_redirects=PROBE_MAX_REDIRECTS,
+                 pool_max_per_host=POOL_MAX_PER_HOST, pool_max_total=POOL_MAX_TOTAL,
+                 pool_idle_timeout=POOL_IDLE_TIMEOUT, resolver=None):
+        self.max_concurrency = max_concurrency
+        self.max_time = max_time
+        self.range_end = range_end
+        self.max_redirects = max_redirects
+        self._loop = asyncio.new_event_loop()
+        self._ssl_context = ssl.create_default_context()
+        self.pool = ConnectionPool(self._ssl_context,
+                                   max_per_host=pool_max_per_host,
+                                   max_total=pool_max_total,
+                                   idle_timeout=pool_idle_timeout,
+                                   resolver=resolver)
+
+    def run(self, coro):
+        """在引擎的事件循环中运行协程并返回结果"""
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        """关闭连接池和事件循环"""
+        if not self._loop.is_closed():
+            self.pool.close()
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+    async def probe(self, full_url, verifier=None, stream=None):
+        """探测单个 URL，返回与 test_single_gateway 相同结构的结果字典
+
+        verifier: 可选的内容校验器，响应体在读取的同时送入校验器（不缓存、不读第二遍）
+        stream: 可选的块流（RawBlockStream / CarStream），不带 Range 按其媒体类型请求完整响应，
+                响应体交给 stream.feed() 统计块（块流自行校验，此时不使用 verifier）
+        """
+        metrics = ProbeMetrics()
+        start = self._loop.time()
+        if stream is not None:
+            fetch = self._fetch(full_url, metrics, start, sink=stream.feed,
+                                accept=stream.accept, limit=stream.max_bytes)
+        else:
+            sink = verifier.update if verifier is not None else None
+            fetch = self._fetch(full_url, metrics, start, sink=sink)
+        try:
+            await asyncio.wait_for(fetch, self.max_time)
+        except asyncio.TimeoutError:
+            # 与 curl --max-time 相同：超时后仍使用已经收集到的数据
+            pass
+        except DnsError as e:
+            # 解析失败与连接失败区分：结果中记为 dns_error
+            metrics.dns_error = e.kind
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            # 连接失败、TLS 错误或响应格式错误：未收到响应头时 http_code 保持为 0
+            pass
+        metrics.time_total = self._loop.time() - start
+        if stream is not None:
+            metrics.block_metrics = stream.finish(metrics.http_code, metrics.headers, start,
+                                                  complete=metrics.body_complete)
+        elif verifier is not None:
+            metrics.integrity = verifier.finish(metrics.http_code, metrics.headers,
+                                                metrics.size_download)
+        return metrics.to_result()
+
+    async def fetch_range(self, full_url, range_start, range_end, sink, metrics=None):
+        """下载 [range_start, range_end] 字节范围（含两端），用于多源下载
+
+        响应体数据依次交给 sink(data)，sink 返回 False 时停止读取并关闭连接。
+        sink 被调用时 metrics.http_code / metrics.headers 已经是当前响应的值，
+        调用方据此确认服务器确实返回了所请求的范围（206 + Content-Range）。
+        不设超时，由调用方控制；返回 metrics。
+        """
+        metrics = metrics or ProbeMetrics()
+        start = self._loop.time()
+        try:
+            await self._fetch(full_url, metrics, start,
+                              range_start=range_start, range_end=range_end, sink=sink)
+        finally:
+            metrics.time_total = self._loop.time() - start
+        return metrics
+
+    async def probe_many(self, jobs, max_concurrency=None, max_per_group=None, probe_func=None):
+        """并发探测多个任务，按完成顺序产出 (key, result)
+
+        jobs: 可迭代的 (key, full_url) 或 (key, full_url, group) 序列
+        max_concurrency: 同时进行的探测数，默认使用引擎的设置
+        max_per_group: 同一 group（通常是网关）同时进行的最大探测数，None 表示不限制
+        probe_func: 可选的协程函数 probe_func(key, full_url)，用于替代 self.probe 包装额外逻辑
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        group_semaphores = {}
+        if probe_func is None:
+            async def probe_func(key, full_url):
+                return await self.probe(full_url)
+
+        async def _run(key, full_url, group):
+            if max_per_group is None or group is None:
+                async with semaphore:
+                    return key, await probe_func(key, full_url)
+            group_semaphore = group_semaphores.get(group)
+            if group_semaphore is None:
+                group_semaphore = group_semaphores[group] = asyncio.Semaphore(max_per_group)
+            # 先占用分组名额再占用全局名额，避免排队中的任务占住全局并发
+            async with group_semaphore:
+                async with semaphore:
+                    return key, await probe_func(key, full_url)
+
+        self.pool.evict_idle()
+        tasks = []
+        for job in jobs:
+            key, full_url = job[0], job[1]
+            group = job[2] if len(job) > 2 else None
+            tasks.append(asyncio.ensure_future(_run(key, full_url, group)))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 等待被取消的探测退出，让它们归还连接名额
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch(self, full_url, metrics, start, range_start=0, range_end=None, sink=None,
+                     accept=None, limit=None):
+        """发送请求并跟随重定向，读取响应体直到范围上界
+
+        accept 不为空时（块/CAR 请求）按该媒体类型请求完整响应，不带 Range，最多读取 limit 字节。
+        """
+        if range_end is None:
+            range_end = self.range_end
+        if accept is None:
+            request_headers = f"Accept: */*\r\nRange: bytes={range_start}-{range_end}\r\n"
+            limit = range_end - range_start + 1
+        else:
+            request_headers = f"Accept: {accept}\r\n"
+        url = full_url
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError(f"不支持的协议: {parts.scheme}")
+            use_tls = parts.scheme == 'https'
+            port = parts.port or (443 if use_tls else 80)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            host_header = parts.netloc.rsplit('@', 1)[-1]
+            request = (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host_header}\r\n"
+                f"User-Agent: {USER_AGENT}\r\n"
+                f"{request_headers}\r\n"
+            ).encode('latin-1')
+
+            conn, version, status, headers = await self._send_request(
+                parts.scheme, parts.hostname, port, request, metrics)
+            reusable = False
+            try:
+                metrics.http_code = status
+                metrics.headers = headers
+                metrics.time_starttransfer = self._loop.time() - start
+
+                location = headers.get('location')
+                if 300 <= status < 400 and location:
+                    reusable = await self._drain_body(conn.reader, headers)
+                    url = urljoin(url, location)
+                    continue
+
+                if status in (204, 304):
+                    reusable = True
+                else:
+                    reusable = await self._read_body(conn.reader, headers, metrics, limit, sink)
+                metrics.body_complete = reusable
+                return
+            finally:
+                reusable = reusable and self._keep_alive(version, headers)
+                self.pool.release(conn, reusable)
+        # 超过重定向次数上限时保留最后一次的状态码
+
+    async def _send_request(self, scheme, host, port, request, metrics):
+        """通过连接池发送请求并读取响应头，返回 (connection, version, status, headers)
+
+        复用的连接可能已被服务器关闭，此时换一条新连接重试一次。
+        """
+        while True:
+            conn, (dns, tcp, tls) = await self.pool.acquire(scheme, host, port)
+            metrics.time_namelookup += dns
+            metrics.time_tls += tls
+            metrics.time_connect += dns + tcp + tls
+            try:
+                conn.writer.write(request)
+                await conn.writer.drain()
+                version, status, headers = await self._read_head(conn.reader)
+                return conn, version, status, headers
+            except (OSError, asyncio.IncompleteReadError):
+                self.pool.release(conn, False)
+                if not conn.reused:
+                    raise
+            except BaseException:
+                self.pool.release(conn, False)
+                raise
+
+    @staticmethod
+    def _keep_alive(version, headers):
+        """响应是否允许复用连接"""
+        if version != 'HTTP/1.1':
+            return False
+        return 'close' not in headers.get('connection', '').lower()
+
+    async def _drain_body(self, reader, headers):
+        """读取并丢弃重定向响应的响应体，成功读完返回 True"""
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            return False
+        content_length = headers.get('content-length')
+        if content_length is None:
+            return False
+        remaining = int(content_length)
+        if remaining > 65536:
+            return False
+        while remaining > 0:
+            data = await reader.read(remaining)
+            if not data:
+                return False
+            remaining -= len(data)
+        return True
+
+    async def _read_head(self, reader):
+        """读取状态行和响应头，跳过 1xx 中间响应，返回 (version, status, headers)"""
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise asyncio.IncompleteReadError(b'', None)
+            fields = status_line.decode('latin-1').split(None, 2)
+            if len(fields) < 2 or not fields[0].startswith('HTTP/'):
+                raise ValueError(f"无效的状态行: {status_line!r}")
+            status = int(fields[1])
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if 100 <= status < 200:
+                continue
+            return fields[0], status, headers
+
+    async def _read_body(self, reader, headers, metrics, limit, sink=None):
+        """读取响应体，最多读取 limit 字节（请求范围的长度）
+
+        服务器忽略 Range 返回 200 时也只读取同样大小的数据，避免探测下载整个文件。
+        sink 不为空时每段数据都交给 sink(data)，返回 False 时立即停止读取。
+        响应体被完整读完（连接可以复用）时返回 True。
+        """
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while metrics.size_download < limit:
+                size_line = await reader.readline()
+                if not size_line:
+                    return False
+                chunk_size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+                if chunk_size == 0:
+                    # 读取 trailer 直到空行
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            return line != b''
+                remaining = chunk_size
+                while remaining > 0 and metrics.size_download < limit:
+                    data = await reader.read(min(remaining, 65536))
+                    if not data:
+                        return False
+                    remaining -= len(data)
+                    metrics.size_download += len(data)
+                    if sink is not None and sink(data) is False:
+                        return False
+                if remaining > 0:
+                    return False
+                await reader.readline()
+            return False
+
+        content_length = headers.get('content-length')
+        if content_length is None:
+            remaining = limit
+        else:
+            remaining = min(int(content_length), limit)
+        while remaining > 0:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                return False
+            remaining -= len(data)
+            metrics.size_download += len(data)
+            if sink is not None and sink(data) is False:
+                return False
+        return content_length is not None and int(content_length) <= limit
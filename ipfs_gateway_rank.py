@@ -0,0 +1,126 @@
+"""增量排名索引
+
+RankIndex 按权重增量维护网关排名（不依赖 NumPy），update_gateway_stats 每次只移动被测网关的位置，
+支持 top-K、名次和分位数查询，不需要每次排名都整体排序。
+"""
+import bisect
+
+
+class RankIndex:
+    """按权重维护的增量排名索引
+
+    内部是分桶的有序列表（每个桶是有序的 Python 列表，桶之间首尾有序），
+    键为 (-weight, seq)：权重相同的网关按加入顺序排列，与按权重稳定排序的结果一致。
+    更新为 O(log n + 桶大小)，top-K、名次查询和分位数查询都不需要物化完整列表。
+    不依赖 numpy。
+    """
+
+    def __init__(self, load=512):
+        self._load = load
+        self._buckets = []      # [[(neg_weight, seq), ...], ...]
+        self._maxes = []        # 每个桶的最大键
+        self._keys = {}         # url -> 当前键
+        self._seq = {}          # url -> 加入顺序
+        self._urls = {}         # seq -> url
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, url):
+        return url in self._keys
+
+    def _locate(self, key):
+        """返回键应插入的桶号"""
+        idx = bisect.bisect_left(self._maxes, key)
+        return min(idx, len(self._buckets) - 1)
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        b = self._locate(key)
+        bucket = self._buckets[b]
+        bisect.insort(bucket, key)
+        self._maxes[b] = bucket[-1]
+        if len(bucket) > 2 * self._load:
+            # 桶过大时一分为二
+            self._buckets[b:b + 1] = [bucket[:self._load], bucket[self._load:]]
+            self._maxes[b:b + 1] = [bucket[self._load - 1], bucket[-1]]
+
+    def _delete(self, key):
+        b = self._locate(key)
+        bucket = self._buckets[b]
+        i = bisect.bisect_left(bucket, key)
+        del bucket[i]
+        if bucket:
+            self._maxes[b] = bucket[-1]
+        else:
+            del self._buckets[b]
+            del self._maxes[b]
+
+    def update(self, url, weight):
+        """设置网关的权重（新网关则加入）"""
+        old_key = self._keys.get(url)
+        if old_key is not None:
+            if old_key[0] == -weight:
+                return
+            self._delete(old_key)
+        else:
+            if url not in self._seq:
+                seq = len(self._seq)
+                self._seq[url] = seq
+                self._urls[seq] = url
+            self._size += 1
+        key = (-weight, self._seq[url])
+        self._keys[url] = key
+        self._insert(key)
+
+    def remove(self, url):
+        """移除网关"""
+        key = self._keys.pop(url, None)
+        if key is None:
+            return
+        self._delete(key)
+        self._size -= 1
+
+    def iter_ranked(self):
+        """按权重降序迭代 (url, weight)"""
+        for bucket in self._buckets:
+            for neg_weight, seq in bucket:
+                yield self._urls[seq], -neg_weight
+
+    def top(self, k):
+        """返回权重最高的 k 个 (url, weight)"""
+        result = []
+        for item in self.iter_ranked():
+            if len(result) >= k:
+                break
+            result.append(item)
+        return result
+
+    def rank(self, url):
+        """返回网关的名次（0 表示权重最高），不存在时返回 None"""
+        key = self._keys.get(url)
+        if key is None:
+            return None
+        b = self._locate(key)
+        before = sum(len(bucket) for bucket in self._buckets[:b])
+        return before + bisect.bisect_left(self._buckets[b], key)
+
+    def weight(self, url):
+        key = self._keys.get(url)
+        return -key[0] if key is not None else None
+
+    def percentile(self, url):
+        """网关权重的百分位：权重不高于它的网关所占比例 (0~1]"""
+        key = self._keys.get(url)
+        if key is None:
+            return None
+        # 权重严格更高的网关数量
+        higher_key = (key[0], -1)
+        b = self._locate(higher_key)
+        higher = (sum(len(bucket) for bucket in self._buckets[:b])
+                  + bisect.bisect_left(self._buckets[b], higher_key))
+        return (self._size - higher) / self._size
@@ -0,0 +1,241 @@
+"""测试汇总报告
+
+原来的汇总报告要在 gateway_logs/ 中为每个 CID 查找最新的日志文件，再逐行读回其中的
+"统计信息"段落，耗时随历史日志数量增长。现在每个探测结果在计入网关统计的同时累加到所属
+CID 的汇总（CidAggregates），汇总报告直接由这些汇总和一次排名结果生成：
+
+    data = summary_data(cids, aggregates, ranked_gateways)
+    render_text(data)       # 原有的文本格式 (summary_report_latest.log)
+    render_json(data)       # 供看板使用
+    render_csv(data)        # 每个 CID 一行
+"""
+import csv
+import io
+import json
+import threading
+from datetime import datetime
+
+from ipfs_gateway_verify import probe_success
+
+SUMMARY_TOP_K = 20
+
+# 速度分布区间: 名称, 下限 (含), 上限 (不含)，单位 KB/s
+SPEED_RANGES = (
+    ('极快 (>1000KB/s)', 1000, None),
+    ('快速 (500-1000KB/s)', 500, 1000),
+    ('中等 (200-500KB/s)', 200, 500),
+    ('慢速 (50-200KB/s)', 50, 200),
+    ('极慢 (<50KB/s)', None, 50),
+)
+
+CSV_FIELDS = ('cid', 'gateways', 'successful_gateways', 'probes', 'successes', 'timeouts',
+              'dns_failures', 'integrity_failures', 'deadline_exceeded', 'skipped', 'bytes',
+              'avg_response_time', 'avg_download_speed')
+
+
+class CidAggregate:
+    """单个 CID 的探测汇总，每个结果 O(1) 累加"""
+    __slots__ = ('gateways', 'ok_gateways', 'probes', 'successes', 'timeouts', 'dns_failures',
+                 'integrity_failures', 'deadline_exceeded', 'skipped', 'bytes', 'response_time_sum',
+                 'speed_sum', 'speed_count')
+
+    def __init__(self):
+        self.gateways = set()
+        self.ok_gateways = set()
+        self.probes = 0
+        self.successes = 0
+        self.timeouts = 0
+        self.dns_failures = 0       # 主机名解析失败（不计入 timeouts）
+        self.integrity_failures = 0 # 返回 206 但内容与 CID 不符（不计入 successes）
+        self.deadline_exceeded = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.response_time_sum = 0.0
+        self.speed_sum = 0.0
+        self.speed_count = 0
+
+    def add(self, url, result):
+        self.gateways.add(url)
+        self.probes += 1
+        if result.get('skipped'):
+            self.skipped += 1
+        if result.get('deadline_exceeded'):
+            self.deadline_exceeded += 1
+        status_code = result.get('status_code')
+        if result.get('integrity') == 'mismatch':
+            self.integrity_failures += 1
+        elif probe_success(result):
+            self.successes += 1
+            self.ok_gateways.add(url)
+        elif result.get('dns_error'):
+            self.dns_failures += 1
+        elif not status_code:
+            self.timeouts += 1
+        self.bytes += result.get('size') or 0
+        self.response_time_sum += min(result.get('response_time') or 0, 1500)
+        speed = (result.get('speed') or 0) / 1024
+        if speed > 0:
+            self.speed_sum += speed
+            self.speed_count += 1
+
+    def to_dict(self):
+        return {
+            'gateways': len(self.gateways),
+            'successful_gateways': len(self.ok_gateways),
+            'probes': self.probes,
+            'successes': self.successes,
+            'timeouts': self.timeouts,
+            'dns_failures': self.dns_failures,
+            'integrity_failures': self.integrity_failures,
+            'deadline_exceeded': self.deadline_exceeded,
+            'skipped': self.skipped,
+            'bytes': self.bytes,
+            'avg_response_time': self.response_time_sum / self.probes if self.probes else 0,
+            'avg_download_speed': self.speed_sum / self.speed_count if self.speed_count else 0,
+        }
+
+
+class CidAggregates:
+    """各 CID 的汇总，可在多个工作线程中并发累加"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_cid = {}
+
+    def add(self, cid, url, result):
+        with self._lock:
+            aggregate = self._by_cid.get(cid)
+            if aggregate is None:
+                aggregate = self._by_cid[cid] = CidAggregate()
+            aggregate.add(url, result)
+
+    def reset(self, cids=None):
+        """清空指定 CID（默认全部）的汇总，开始新一轮测试时调用"""
+        with self._lock:
+            if cids is None:
+                self._by_cid.clear()
+            else:
+                for cid in cids:
+                    self._by_cid.pop(cid, None)
+
+    def stats(self, cid):
+        with self._lock:
+            aggregate = self._by_cid.get(cid)
+            return aggregate.to_dict() if aggregate is not None else CidAggregate().to_dict()
+
+
+def summary_data(cids, aggregates, ranked_gateways, top_k=SUMMARY_TOP_K):
+    """汇总报告的全部数据（一次遍历排名结果）"""
+    active = [gw for gw in ranked_gateways if gw['test_count'] > 0]
+    overall = {'total_gateways': len(ranked_gateways), 'active_gateways': len(active)}
+    if active:
+        avg_speeds = [gw['avg_download_speed'] for gw in active if gw['avg_download_speed'] > 0]
+        if avg_speeds:
+            overall['avg_download_speed'] = sum(avg_speeds) / len(avg_speeds)
+            overall['max_download_speed'] = max(gw['max_download_speed'] for gw in active)
+        response_times = [gw['last_response_time'] for gw in active]
+        overall['avg_response_time'] = sum(response_times) / len(response_times)
+        overall['min_response_time'] = min(response_times)
+        overall['avg_success_rate'] = sum(gw['success_rate'] for gw in active) / len(active)
+
+    distribution = {}
+    for name, low, high in SPEED_RANGES:
+        distribution[name] = sum(
+            1 for gw in active
+            if (low is None or gw['avg_download_speed'] >= low)
+            and (high is None or gw['avg_download_speed'] < high))
+
+    top = [{
+        'url': gw['url'],
+        'weight': gw['weight'],
+        'success_rate': gw['success_rate'] if gw['test_count'] > 0 else None,
+        'last_response_time': gw['last_response_time'],
+        'avg_download_speed': gw['avg_download_speed'],
+        'max_download_speed': gw['max_download_speed'],
+        'speed_stability': gw['speed_stability'],
+    } for gw in ranked_gateways[:top_k]]
+
+    return {
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'cid_count': len(cids),
+        'top': top,
+        'cids': {cid: aggregates.stats(cid) for cid in cids},
+        'overall': overall,
+        'speed_distribution': distribution,
+    }
+
+
+def render_text(data):
+    """原有的文本格式"""
+    lines = ["=== IPFS网关测试汇总报告 ===\n\n"]
+    lines.append(f"测试时间: {data['time']}\n")
+    lines.append(f"测试的CID数量: {data['cid_count']}\n\n")
+
+    lines.append("\n=== 性能最佳的网关 (Top 20) ===\n")
+    lines.append("-" * 120 + "\n")
+    lines.append(f"{'网关URL':<49} {'权重':<6} {'成功率':<5} {'响应时间':<7} {'平均速度':<8} {'最大速度':<9} {'不稳定性':<8}\n")
+    lines.append("-" * 120 + "\n")
+    for gw in data['top']:
+        success_rate = f"{gw['success_rate']:.2%}" if gw['success_rate'] is not None else "N/A"
+        lines.append(
+            f"{gw['url']:<50} "
+            f"{gw['weight']:<8.3f} "
+            f"{success_rate:<8} "
+            f"{gw['last_response_time'] or 0:<10.1f} "
+            f"{gw['avg_download_speed']:<12.1f} "
+            f"{gw['max_download_speed']:<12.1f} "
+            f"{gw['speed_stability']:<8.2f}\n"
+        )
+
+    lines.append("\n=== 各CID详细测试结果 ===\n")
+    for cid, stats in data['cids'].items():
+        lines.append(f"\nCID: {cid}\n")
+        lines.append("-" * 50 + "\n")
+        lines.append(f"总网关数: {stats['gateways']}\n")
+        lines.append(f"成功访问的网关数: {stats['successful_gateways']}\n")
+        lines.append(f"平均响应时间: {stats['avg_response_time']:.2f}ms\n")
+        lines.append(f"平均下载速度: {stats['avg_download_speed']:.2f}KB/s\n")
+        lines.append(f"探测次数: {stats['probes']} (成功 {stats['successes']}, "
+                     f"超时/连接失败 {stats['timeouts']}, DNS失败 {stats['dns_failures']}, "
+                     f"校验失败 {stats['integrity_failures']}, "
+                     f"轮次截止 {stats['deadline_exceeded']})\n")
+
+    lines.append("\n\n=== 网关性能分析 ===\n")
+    overall = data['overall']
+    lines.append(f"\n总网关数量: {overall['total_gateways']}")
+    lines.append(f"\n活跃网关数量: {overall['active_gateways']}")
+    if overall['active_gateways'] > 0:
+        if 'avg_download_speed' in overall:
+            lines.append(f"\n平均下载速度: {overall['avg_download_speed']:.2f} KB/s")
+            lines.append(f"\n最高下载速度: {overall['max_download_speed']:.2f} KB/s")
+        lines.append(f"\n平均响应时间: {overall['avg_response_time']:.2f} ms")
+        lines.append(f"\n最快响应时间: {overall['min_response_time']:.2f} ms")
+        lines.append(f"\n平均成功率: {overall['avg_success_rate']:.2%}")
+
+    lines.append("\n\n=== 速度分布统计 ===\n")
+    if overall['active_gateways'] > 0:
+        for name, count in data['speed_distribution'].items():
+            percentage = (count / overall['active_gateways']) * 100
+            lines.append(f"\n{name}: {count} 个网关 ({percentage:.1f}%)")
+    return ''.join(lines)
+
+
+def render_json(data):
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def render_csv(data):
+    """每个 CID 一行的汇总"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    for cid, stats in data['cids'].items():
+        writer.writerow({'cid': cid, **stats})
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'text': render_text,
+    'json': render_json,
+    'csv': render_csv,
+}
@@ -0,0 +1,331 @@
+"""探测调度相关的组件
+
+CircuitBreaker: 按网关的熔断器，连续连接失败/超时的网关在冷却期内跳过实际探测。
+ProbeScheduler: 按网关权重分配每轮探测预算的调度器（利用 + 探索）。
+"""
+import heapq
+import math
+import random
+import threading
+import time
+from datetime import datetime
+
+# 熔断器参数
+BREAKER_THRESHOLD = 3               # 连续连接失败/超时多少次后熔断
+BREAKER_HALF_OPEN_INTERVAL = 60     # 熔断后每隔多少秒放行一次试探性探测 (半开状态)
+
+# 熔断器状态
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+def is_connect_failure(test_result):
+    """是否为连接失败或超时（没有收到任何 HTTP 响应）"""
+    return test_result.get('status_code', 0) == 0
+
+
+def skipped_result():
+    """熔断期间跳过探测时记录的失败结果"""
+    return {
+        'response_time': 1500,
+        'status_code': 0,
+        'speed': 0,
+        'size': 0,
+        'connect_time': 0,
+        'server_time': 1500,
+        'skipped': True
+    }
+
+
+def deadline_result():
+    """轮次截止时仍未完成的探测记录的超时结果（与 curl --max-time 超时的评分方式相同）"""
+    return {
+        'response_time': 1500,
+        'status_code': 0,
+        'speed': 0,
+        'size': 0,
+        'connect_time': 0,
+        'server_time': 1500,
+        'deadline_exceeded': True
+    }
+
+
+class _BreakerEntry:
+    __slots__ = ('state', 'failures', 'opened_at', 'trial_in_flight')
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+
+class CircuitBreaker:
+    """按网关的熔断器
+
+    - closed: 正常探测，统计连续的连接失败/超时次数；
+    - open: 连续失败达到 threshold 次后熔断，后续探测直接记为失败，不占用网络；
+    - half_open: 熔断超过 half_open_interval 秒后放行一次试探，成功则恢复，失败则重新计时，
+      试探没有完成（release()）则回到 open，下次 allow() 时重新放行。
+
+    探测可能来自多个工作线程，因此所有状态修改都在锁内进行。
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 half_open_interval=BREAKER_HALF_OPEN_INTERVAL, clock=time.monotonic):
+        self.threshold = threshold
+        self.half_open_interval = half_open_interval
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.skipped = 0        # 累计跳过的探测次数
+
+    def allow(self, url):
+        """探测前调用：返回 True 表示应当实际探测，False 表示跳过"""
+        if not self.threshold:
+            return True
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry.state == STATE_CLOSED:
+                return True
+            if (entry.state == STATE_OPEN and not entry.trial_in_flight
+                    and self._clock() - entry.opened_at >= self.half_open_interval):
+                entry.state = STATE_HALF_OPEN
+                entry.trial_in_flight = True
+                return True
+            self.skipped += 1
+            return False
+
+    def record(self, url, test_result):
+        """实际探测完成后调用，更新该网关的熔断状态"""
+        if not self.threshold:
+            return
+        failed = is_connect_failure(test_result)
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                if not failed:
+                    return
+                entry = self._entries[url] = _BreakerEntry()
+
+            if entry.state == STATE_HALF_OPEN:
+                entry.trial_in_flight = False
+                if failed:
+                    entry.state = STATE_OPEN
+                    entry.opened_at = self._clock()
+                else:
+                    entry.state = STATE_CLOSED
+                    entry.failures = 0
+                return
+
+            if not failed:
+                entry.failures = 0
+                return
+            entry.failures += 1
+            if entry.state == STATE_CLOSED and entry.failures >= self.threshold:
+                entry.state = STATE_OPEN
+                entry.opened_at = self._clock()
+
+    def release(self, url):
+        """放行的探测没有完成（被轮次截止取消或抛出异常）时调用，代替 record()
+
+        半开状态的试探没有结果，退回熔断状态并清除在途标记，冷却期已过，下次 allow() 仍会放行试探；
+        否则半开状态会一直等待永远不会到来的 record()，该网关此后的探测全部被跳过。
+        """
+        if not self.threshold:
+            return
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry.state == STATE_HALF_OPEN:
+                entry.state = STATE_OPEN
+                entry.trial_in_flight = False
+
+    def state(self, url):
+        """返回网关当前的熔断状态"""
+        with self._lock:
+            entry = self._entries.get(url)
+            return entry.state if entry else STATE_CLOSED
+
+    def open_count(self):
+        """当前处于熔断（含半开）状态的网关数量"""
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if entry.state != STATE_CLOSED)
+
+
+# 调度器参数
+SCHEDULE_MIN_INTERVAL = 300         # 权重为 1 的网关的复测间隔 (秒)
+SCHEDULE_MAX_INTERVAL = 6 * 3600    # 复测间隔上限 (秒)
+UCB_EXPLORATION = 1.0               # UCB 探索系数 c
+
+
+def last_tested(gateway):
+    """网关上次测试的时间戳，从未测试（或无法解析）时返回 None"""
+    value = gateway.get('last_test_time')
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def success_stats(gateway):
+    """从 success_history 中取出 (成功次数, 失败次数)"""
+    history = gateway.get('success_history') or []
+    successes = sum(history)
+    return successes, len(history) - successes
+
+
+class EpsilonGreedyStrategy:
+    """ε-greedy：探索名额在其余网关中按 陈旧程度 / 权重 加权随机抽取（不放回）
+
+    陈旧程度为距上次测试的秒数，越久没测、权重越低的网关越容易被抽中；从未测试过的网关优先。
+    不放回的加权抽样用 Efraimidis-Spirakis 方法：每个网关取键 ln(u) / w，取键最大的 k 个。
+    """
+    name = 'epsilon'
+
+    def __init__(self, w_min=0.001):
+        self.w_min = w_min
+
+    def pick(self, candidates, k, gateways, rng, total_tests, now=None):
+        now = time.time() if now is None else now
+
+        def key(url):
+            gateway = gateways[url]
+            tested = last_tested(gateway)
+            if tested is None:
+                return float('inf')
+            staleness = max(now - tested, 1.0)
+            weight = staleness / max(gateway.get('current_weight') or 0, self.w_min)
+            return math.log(1.0 - rng.random()) / weight
+
+        return heapq.nlargest(k, candidates, key=key)
+
+
+class UCBStrategy:
+    """UCB1：按 近期成功率 + c·sqrt(ln(总测试数) / 该网关测试数) 选取探索对象"""
+    name = 'ucb'
+
+    def __init__(self, exploration=UCB_EXPLORATION):
+        self.exploration = exploration
+
+    def pick(self, candidates, k, gateways, rng, total_tests, now=None):
+        log_total = math.log(max(total_tests, 1))
+
+        def score(url):
+            gateway = gateways[url]
+            successes, failures = success_stats(gateway)
+            trials = successes + failures
+            if trials == 0 or gateway.get('test_count', 0) == 0:
+                return float('inf')
+            mean = successes / trials
+            return mean + self.exploration * math.sqrt(log_total / gateway['test_count'])
+
+        return heapq.nlargest(k, candidates, key=score)
+
+
+class ThompsonStrategy:
+    """Thompson 采样：对每个网关的成功率按 Beta(成功+1, 失败+1) 采样，取样本最大的网关"""
+    name = 'thompson'
+
+    def pick(self, candidates, k, gateways, rng, total_tests, now=None):
+        def sample(url):
+            successes, failures = success_stats(gateways[url])
+            return rng.betavariate(successes + 1, failures + 1)
+
+        return heapq.nlargest(k, candidates, key=sample)
+
+
+STRATEGIES = {
+    EpsilonGreedyStrategy.name: EpsilonGreedyStrategy,
+    UCBStrategy.name: UCBStrategy,
+    ThompsonStrategy.name: ThompsonStrategy,
+}
+
+
+class ProbeScheduler:
+    """按权重分配探测预算的调度器
+
+    每个网关的下次应测时间 next_due_time 由其权重决定（权重越高复测越频繁），
+    保存在网关条目中随网关数据一起持久化。调度器用以 next_due_time 为键的小顶堆
+    取出到期网关，单次取出为 O(log n)。
+
+    每轮预算中 (1-ε) 用于到期的网关（利用），至多 ε·预算 交给探索策略
+    （epsilon / ucb / thompson）从剩余网关中挑选陈旧或低权重的网关；
+    到期网关不足时利用部分没用完的名额不转给探索，本轮少测一些。
+    """
+
+    def __init__(self, gateways, budget, epsilon=0.2, strategy='epsilon',
+                 min_interval=SCHEDULE_MIN_INTERVAL, max_interval=SCHEDULE_MAX_INTERVAL,
+                 w_min=0.001, rng=None, clock=time.time):
+        self.gateways = gateways
+        self.budget = budget
+        self.epsilon = epsilon
+        self.strategy = STRATEGIES[strategy]() if isinstance(strategy, str) else strategy
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.w_min = w_min
+        self.rng = rng or random.Random()
+        self._clock = clock
+        self._heap = []
+        self._due = {}          # url -> 堆中有效条目的 next_due_time（用于惰性删除）
+        for url, gateway in gateways.items():
+            self._due[url] = gateway.get('next_due_time') or 0
+        self._heap = [(due, url) for url, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def interval_for(self, weight):
+        """根据权重计算复测间隔：权重越高间隔越短"""
+        return min(self.max_interval, self.min_interval / max(weight or 0, self.w_min))
+
+    def add(self, url):
+        """加入新网关（立即到期）"""
+        if url not in self._due:
+            self._due[url] = 0
+            heapq.heappush(self._heap, (0, url))
+
+    def select(self, budget=None):
+        """选出本轮要探测的网关列表"""
+        budget = self.budget if budget is None else budget
+        now = self._clock()
+        exploit_budget = budget - int(round(budget * self.epsilon))
+
+        selected = []
+        chosen = set()
+        while self._heap and len(selected) < exploit_budget:
+            due, url = self._heap[0]
+            if self._due.get(url) != due or url not in self.gateways:
+                heapq.heappop(self._heap)     # 过期条目
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            del self._due[url]
+            selected.append(url)
+            chosen.add(url)
+
+        explore_budget = min(budget - exploit_budget, budget - len(selected))
+        if explore_budget > 0:
+            candidates = [url for url in self.gateways if url not in chosen]
+            total_tests = sum(gw.get('test_count', 0) for gw in self.gateways.values())
+            for url in self.strategy.pick(candidates, explore_budget, self.gateways,
+                                          self.rng, total_tests, now=now):
+                selected.append(url)
+                chosen.add(url)
+        return selected
+
+    def record(self, url, gateway):
+        """网关探测并更新统计后调用，按新权重安排下次应测时间"""
+        due = self._clock() + self.interval_for(gateway.get('current_weight'))
+        gateway['next_due_time'] = due
+        self._due[url] = due
+        heapq.heappush(self._heap, (due, url))
+
+    def release(self, urls):
+        """把选中但未被探测的网关放回堆中（保持原到期时间）"""
+        for url in urls:
+            if url not in self._due and url in self.gateways:
+                due = self.gateways[url].get('next_due_time') or 0
+                self._due[url] = due
+                heapq.heappush(self._heap, (due, url))
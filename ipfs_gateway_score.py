@@ -0,0 +1,59 @@
+"""单次探测的评分量
+
+全局权重（update_gateway_stats）、冷/热缓存得分（ipfs_gateway_cache）和网关×CID 矩阵
+（ipfs_gateway_matrix）对同一次探测使用同一组评分量，由 score_sample 统一取出：
+
+- success：是否成功（ipfs_gateway_verify.probe_success）；
+- response_time：参与评分的响应时间 (ms，上限 MAX_SCORED_TIME)；
+- ttfb：首字节时间 (ms)；
+- speed：下载速度 (KB/s)。
+
+块/CAR 模式的结果（有完整的块，见 ipfs_gateway_trustless）用首块时间代替响应时间和首字节时间，
+用块吞吐量代替下载速度。缓存得分和矩阵组合的 EMA 由 update_score 按同一规则更新。
+"""
+from collections import namedtuple
+
+from ipfs_gateway_verify import probe_success
+
+MAX_SCORED_TIME = 1500      # 参与评分的响应时间上限 (ms)，与超时结果的响应时间相同
+
+ScoreSample = namedtuple('ScoreSample', ('success', 'response_time', 'ttfb', 'speed'))
+
+
+def smooth(old, value, alpha):
+    """EMA 的一步更新，还没有旧值时直接取新值"""
+    return value if old is None else alpha * value + (1 - alpha) * old
+
+
+def score_sample(test_result, server_time=False):
+    """取出一次探测的评分量 ScoreSample(success, response_time, ttfb, speed)
+
+    server_time 为 True 时响应时间改用扣除建立连接耗时的服务器处理时间（结果中有的话）。
+    """
+    success = 1 if probe_success(test_result) else 0
+    response_time = min(test_result['response_time'], MAX_SCORED_TIME)
+    ttfb = test_result.get('ttfb', response_time)
+    speed = test_result['speed'] / 1024
+    if server_time and 'server_time' in test_result:
+        response_time = min(test_result['server_time'], MAX_SCORED_TIME)
+    if test_result.get('blocks'):
+        response_time = ttfb = min(test_result['first_block_time'], MAX_SCORED_TIME)
+        speed = test_result['block_speed'] / 1024
+    return ScoreSample(success, response_time, ttfb, speed)
+
+
+def update_score(score, sample, alpha, weight_func):
+    """把一次探测的评分量计入得分（原地更新并返回）
+
+    score 按键读写 tests / successes / ema / response_time / ttfb / speed / weight；
+    首字节时间和速度只在成功时更新。weight_func(ema, response_time, speed_kb) 与全局权重使用同一公式。
+    """
+    score['tests'] += 1
+    score['successes'] += sample.success
+    score['ema'] = alpha * sample.success + (1 - alpha) * score['ema']
+    score['response_time'] = smooth(score['response_time'], sample.response_time, alpha)
+    if sample.success:
+        score['ttfb'] = smooth(score['ttfb'], sample.ttfb, alpha)
+        score['speed'] = smooth(score['speed'], sample.speed, alpha)
+    score['weight'] = weight_func(score['ema'], score['response_time'], score['speed'] or 0)
+    return score
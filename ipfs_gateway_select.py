@@ -0,0 +1,219 @@
+"""按权重随机选取网关
+
+update_gateway_stats 计算的权重（EMA^BETA × γ_time × γ_speed，下限 W_MIN）可直接用于
+加权负载均衡。GatewaySelector 用 Vose 别名法（alias method）建表，每次抽样 O(1)：
+
+    selector = GatewaySelector.from_state_file('gateway_data.json')
+    url = selector.pick()                               # 按权重抽取
+    url = selector.pick(exclude={failed_url})           # 排除刚失败的网关
+    url = selector.pick(main_only=True)                 # 只在主网关中抽取
+    selector.update(url, new_weight)                    # 权重变化，批量惰性重建
+
+别名表建好后不再修改，权重变化时只把包含该网关的池（全部 + 主网关或次选网关）标记为过期。
+测速过程中每个探测结果都会更新权重，若每次抽样前都重建，更新与抽样交替时每次抽样都是 O(n)；
+因此过期的表在建成后 max_stale 秒内继续使用（期间的更新累积到下一次重建，一次 O(n) 摊到
+这段时间内的全部抽样上），已移除的网关在抽样时跳过。max_stale=0 时每次更新后都立即重建。
+抽样无需加锁，可在多个工作线程中共享同一个选择器。
+"""
+import random
+import threading
+import time
+
+from ipfs_gateway_store import open_state_store
+
+POOL_ALL = 'all'
+POOL_MAIN = 'main'
+POOL_SIDE = 'side'
+MAX_REJECTS = 16            # 带排除项抽样时最多重抽的次数，超过后改为线性抽样
+REJECT_FALLBACK_RATIO = 0.5  # 被排除网关的权重占比达到该比例时直接线性抽样
+MAX_STALE = 1.0             # 过期的别名表最多继续使用的秒数（从建表时算起）
+
+
+class AliasTable:
+    """Vose 别名表：按权重 O(1) 抽样，建表 O(n)"""
+    __slots__ = ('urls', 'prob', 'alias', 'weights', 'total')
+
+    def __init__(self, items):
+        """items 为 [(url, weight), ...]，权重不大于 0 的条目不会被抽中"""
+        items = [(url, float(weight)) for url, weight in items if weight and weight > 0]
+        self.urls = [url for url, _ in items]
+        self.weights = dict(items)
+        self.total = sum(weight for _, weight in items)
+        n = len(items)
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        if not n:
+            return
+
+        scaled = [weight * n / self.total for _, weight in items]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # 剩余条目的概率因浮点误差可能略偏离 1，直接取 1
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.urls)
+
+    def sample(self, rng):
+        """抽取一个网关：同一个随机数的整数部分选列，小数部分决定取本列还是别名"""
+        u = rng.random() * len(self.urls)
+        i = int(u)
+        if u - i < self.prob[i]:
+            return self.urls[i]
+        return self.urls[self.alias[i]]
+
+
+class GatewaySelector:
+    """按权重随机选取网关，支持排除项和主网关过滤
+
+    每个网关池（全部 / 主网关 / 次选网关）各有一张别名表，按需惰性构建。
+    update() / remove() 只把受影响的池标记为过期，过期的表最多再使用 max_stale 秒后批量重建。
+    """
+
+    def __init__(self, rng=None, max_stale=MAX_STALE, clock=time.monotonic):
+        self._rng = rng or random.Random()
+        self._weights = {}          # url -> 权重
+        self._is_main = {}          # url -> 是否为主网关
+        self._tables = {}           # 池名 -> AliasTable，只在锁内替换
+        self._built_at = {}         # 池名 -> 建表时间
+        self._stale = set()         # 有未生效更新的池
+        self._lock = threading.Lock()
+        self.max_stale = max_stale
+        self.clock = clock
+        self.rebuilds = 0           # 累计重建别名表的次数
+
+    @classmethod
+    def from_gateways(cls, gateways, rng=None):
+        """从网关数据 {url: gateway} 构建"""
+        selector = cls(rng=rng)
+        for url, gateway in gateways.items():
+            selector._weights[url] = gateway.get('current_weight', 0)
+            selector._is_main[url] = gateway.get('is_main', False)
+        return selector
+
+    @classmethod
+    def from_state_file(cls, path='gateway_data.json', backend='json', rng=None):
+        """从测速程序保存的网关数据文件构建（供取数进程直接嵌入使用）"""
+        store = open_state_store(backend, path)
+        try:
+            gateways = store.load() or {}
+        finally:
+            store.close()
+        return cls.from_gateways(gateways, rng=rng)
+
+    def __len__(self):
+        return len(self._weights)
+
+    def __contains__(self, url):
+        return url in self._weights
+
+    def update(self, url, weight, is_main=None):
+        """设置网关的权重（新网关则加入），包含该网关的别名表标记为过期"""
+        with self._lock:
+            was_main = self._is_main.get(url)
+            if is_main is not None:
+                self._is_main[url] = is_main
+            else:
+                self._is_main.setdefault(url, False)
+            if self._weights.get(url) == weight and was_main == self._is_main[url]:
+                return
+            self._weights[url] = weight
+            self._invalidate(url, was_main)
+
+    def remove(self, url):
+        with self._lock:
+            if self._weights.pop(url, None) is not None:
+                self._invalidate(url, self._is_main.pop(url, None))
+
+    def refresh(self):
+        """立即让所有更新生效（下次抽样时重建全部过期的表）"""
+        with self._lock:
+            for pool in self._stale:
+                self._tables.pop(pool, None)
+            self._stale.clear()
+
+    def _invalidate(self, url, was_main):
+        """把包含该网关（更新前或更新后）的池标记为过期，调用方持有锁"""
+        pools = {POOL_ALL}
+        for main in (was_main, self._is_main.get(url)):
+            if main is not None:
+                pools.add(POOL_MAIN if main else POOL_SIDE)
+        self._stale.update(pools)
+
+    def weight(self, url):
+        return self._weights.get(url)
+
+    def _table(self, pool):
+        table = self._tables.get(pool)
+        if table is not None and (pool not in self._stale
+                                  or self.clock() - self._built_at[pool] < self.max_stale):
+            return table
+        with self._lock:
+            table = self._tables.get(pool)
+            if table is None or (pool in self._stale
+                                 and self.clock() - self._built_at[pool] >= self.max_stale):
+                if pool == POOL_ALL:
+                    items = self._weights.items()
+                else:
+                    main = pool == POOL_MAIN
+                    items = [(url, weight) for url, weight in self._weights.items()
+                             if self._is_main.get(url, False) == main]
+                table = self._tables[pool] = AliasTable(items)
+                self._built_at[pool] = self.clock()
+                self._stale.discard(pool)
+                self.rebuilds += 1
+            return table
+
+    def pick(self, exclude=(), main_only=False, pool=None):
+        """按权重抽取一个网关，没有可选网关时返回 None
+
+        exclude: 不参与抽样的网关集合；pool: 'all' / 'main' / 'side'，main_only=True 等价于 'main'。
+        """
+        table = self._table(pool or (POOL_MAIN if main_only else POOL_ALL))
+        if not table.urls:
+            return None
+        if not exclude:
+            url = table.sample(self._rng)
+            if url in self._weights:
+                return url
+
+        # 被排除的权重较少时拒绝采样，重抽几次仍未命中则退回线性抽样；
+        # 过期的表中可能还有已移除的网关，同样跳过
+        excluded = sum(table.weights.get(url, 0) for url in exclude)
+        if excluded < table.total * REJECT_FALLBACK_RATIO:
+            for _ in range(MAX_REJECTS):
+                url = table.sample(self._rng)
+                if url not in exclude and url in self._weights:
+                    return url
+        return self._pick_linear(table, exclude)
+
+    def _pick_linear(self, table, exclude):
+        """在排除后的网关中线性加权抽样 O(n)"""
+        candidates = [url for url in table.urls if url not in exclude and url in self._weights]
+        if not candidates:
+            return None
+        weights = [table.weights[url] for url in candidates]
+        return self._rng.choices(candidates, weights=weights)[0]
+
+    def pick_many(self, k, exclude=(), main_only=False, pool=None):
+        """不重复地抽取最多 k 个网关（依次抽样并把已抽中的网关加入排除项）"""
+        chosen = []
+        excluded = set(exclude)
+        for _ in range(k):
+            url = self.pick(exclude=excluded, main_only=main_only, pool=pool)
+            if url is None:
+                break
+            chosen.append(url)
+            excluded.add(url)
+        return chosen
@@ -0,0 +1,214 @@
+"""常驻服务模式
+
+保持一个 GatewaySpeedTest 实例常驻内存，按固定间隔重新测速，并在本地提供一个
+HTTP/JSON 接口。接口直接读取由 update_gateway_stats 原地更新的内存状态（每个网关取一致快照）：
+
+    GET /health                     服务状态
+    GET /top?k=20&main_only=1       按权重排序的前 K 个网关
+    GET /top?cid=<CID>&k=20         该 CID 表现最好的前 K 个网关（网关×CID 矩阵，没有数据时按全局权重）
+    GET /gateway?url=<网关URL>      单个网关的统计信息、名次和权重百分位
+    GET /pick?exclude=<URL>&main_only=1   按权重随机选取一个网关
+    GET /history?url=<网关URL>&metric=ttfb&days=7   探测历史中某项指标的统计（次数、平均值、p50/p95/p99）
+    GET /history?url=<网关URL>&cache=cold           只统计冷 (未命中缓存) 或热 (命中缓存) 请求
+
+用法：
+    python ipfs_test_gateway_multi_cid.py serve --port 8765 --interval 600
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8765
+SERVE_INTERVAL = 600        # 两次测速之间的间隔 (秒)
+SERVE_TOP_K = 20
+
+
+class GatewayApiHandler(BaseHTTPRequestHandler):
+    """本地 JSON 接口"""
+    server_version = 'ipfs-gateway-checker'
+
+    def log_message(self, format, *args):
+        # 接口调用频繁，不输出访问日志
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        route = {
+            '/health': self.server.api.health,
+            '/top': self.server.api.top,
+            '/gateway': self.server.api.gateway,
+            '/pick': self.server.api.pick,
+            '/history': self.server.api.history,
+        }.get(parts.path)
+        if route is None:
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        try:
+            status, payload = route(params)
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        self._send_json(payload, status=status)
+
+
+class GatewayApi:
+    """接口的查询逻辑：排名在测速器的锁内读取，网关字段通过 gateway_snapshot 读取"""
+
+    def __init__(self, tester):
+        self.tester = tester
+        self.started_at = time.time()
+        self.rounds = 0
+        self.last_round_at = None
+
+    @staticmethod
+    def _flag(params, name):
+        return params.get(name, '0').lower() in ('1', 'true', 'yes')
+
+    def health(self, params):
+        with self.tester.lock:
+            count = len(self.tester.gateway_data['gateways'])
+        return 200, {
+            'status': 'ok',
+            'gateways': count,
+            'rounds': self.rounds,
+            'last_round_at': self.last_round_at,
+            'uptime': time.time() - self.started_at,
+            'dns': self.tester.resolver.stats(),
+        }
+
+    def top(self, params):
+        k = int(params.get('k', SERVE_TOP_K))
+        main_only = self._flag(params, 'main_only')
+        cid = params.get('cid')
+        if cid:
+            return self._top_for_cid(cid, k, main_only)
+        gateways = self.tester.gateway_data['gateways']
+        ranked = []
+        with self.tester.lock:
+            for url, weight in self.tester.rank_index.iter_ranked():
+                if len(ranked) >= k:
+                    break
+                if main_only and not gateways[url]['is_main']:
+                    continue
+                ranked.append((url, weight))
+        result = []
+        for url, weight in ranked:
+            gateway = self.tester.gateway_snapshot(url)
+            result.append({
+                'url': url,
+                'weight': weight,
+                'is_main': gateway['is_main'],
+                'ema': gateway['current_ema'],
+                'last_response_time': gateway['last_response_time'],
+                'avg_download_speed': gateway['avg_download_speed'],
+            })
+        return 200, {'gateways': result}
+
+    def _top_for_cid(self, cid, k, main_only):
+        result = []
+        for url, score, source in self.tester.best_gateways_for_cid(cid, k, main_only):
+            pair = self.tester.cid_matrix.get(url, cid) or {}
+            result.append({
+                'url': url,
+                'score': score,
+                'source': source,
+                'tests': pair.get('tests', 0),
+                'ema': pair.get('ema'),
+                'ttfb': pair.get('ttfb'),
+                'speed': pair.get('speed'),
+            })
+        return 200, {'cid': cid, 'gateways': result}
+
+    def gateway(self, params):
+        url = params.get('url')
+        if not url:
+            raise ValueError('缺少参数 url')
+        gateway = self.tester.gateway_snapshot(url)
+        if gateway is None:
+            return 404, {'error': f'unknown gateway: {url}'}
+        return 200, {
+            'gateway': gateway,
+            'rank': self.tester.gateway_rank(url),
+            'percentile': self.tester.weight_percentile(url),
+        }
+
+    def pick(self, params):
+        exclude = set(params.get('exclude', '').split(',')) - {''}
+        main_only = self._flag(params, 'main_only')
+        url = self.tester.pick_gateway(exclude=exclude, main_only=main_only)
+        if url is None:
+            return 404, {'error': 'no gateway available'}
+        return 200, {'url': url, 'weight': self.tester.selector.weight(url)}
+
+    def history(self, params):
+        url = params.get('url')
+        if not url:
+            raise ValueError('缺少参数 url')
+        if self.tester.history is None:
+            return 404, {'error': 'probe history is disabled'}
+        stats = self.tester.history.query(url, params.get('metric', 'ttfb'),
+                                          days=float(params.get('days', 7)),
+                                          cid=params.get('cid'), cache=params.get('cache'))
+        return 200, {'url': url, **stats}
+
+
+def start_api_server(tester, host=SERVE_HOST, port=SERVE_PORT):
+    """在后台线程中启动接口服务，返回 (server, api)"""
+    api = GatewayApi(tester)
+    server = ThreadingHTTPServer((host, port), GatewayApiHandler)
+    server.daemon_threads = True
+    server.api = api
+    thread = threading.Thread(target=server.serve_forever, name='gateway-api', daemon=True)
+    thread.start()
+    return server, api
+
+
+def serve(tester, cids, host=SERVE_HOST, port=SERVE_PORT, interval=SERVE_INTERVAL,
+          budget=0, max_rounds=None, log=print):
+    """常驻运行：启动接口服务并按间隔重新测速
+
+    budget > 0 时每轮使用调度模式只探测 budget 个网关，否则每轮完整测试所有网关。
+    """
+    server, api = start_api_server(tester, host, port)
+    log(f"接口服务已启动: http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        while max_rounds is None or api.rounds < max_rounds:
+            if budget:
+                tester.run_scheduled_round(cids, budget=budget, round_idx=api.rounds)
+            else:
+                tester.test_cids(cids, api.rounds)
+            api.rounds += 1
+            api.last_round_at = time.time()
+            if max_rounds is not None and api.rounds >= max_rounds:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log("收到中断信号，停止服务")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def parse_serve_args(argv):
+    """解析 serve 模式的命令行参数"""
+    parser = argparse.ArgumentParser(prog='ipfs_test_gateway_multi_cid.py serve',
+                                     description='常驻测速并提供本地 HTTP/JSON 接口')
+    parser.add_argument('--host', default=SERVE_HOST, help='监听地址')
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help='监听端口')
+    parser.add_argument('--interval', type=float, default=SERVE_INTERVAL,
+                        help='两次测速之间的间隔 (秒)')
+    parser.add_argument('--budget', type=int, default=0,
+                        help='每轮探测的网关数量，0 表示每轮测试全部网关')
+    return parser.parse_args(argv)
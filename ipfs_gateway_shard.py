@@ -0,0 +1,296 @@
+"""分片探测与可合并的网关统计
+
+单个进程里的一个线程池/事件循环负责全部探测和统计更新。分片模式把网关按 URL 的哈希
+分到 N 个分片，每个分片在独立的进程（或另一台机器）里用自己的 GatewaySpeedTest 运行
+run_speed_test，结束后输出一份可合并的统计增量（delta）：
+
+- 计数：探测次数、成功次数、跳过次数、下载字节数，直接相加；
+- EMA + 时间戳：分片自己的成功率 EMA 及其更新时间，合并时按 EMA_HALF_LIFE 把较早的一方
+  衰减到同一时刻，再按各自的权重平均（满足交换律和结合律，合并顺序不影响结果）。分片的 EMA
+  在它的网关数据中跨多次运行累积，权重取这个 EMA 的有效样本数（ema_weight，按累计测试次数
+  计算，随次数增加趋于 EMA 窗口 N），而不是本次运行的测试次数；
+- 直方图：首字节时间 (ms) 和下载速度 (KB/s) 的对数分桶计数（与探测历史相同的分桶），相加即可。
+
+协调端合并各分片的增量，按与全局权重相同的公式（成功率 EMA、首字节时间中位数、速度中位数）
+得到一个排名。同一网关可以由多个节点（不同地区的探测点）分别测量，合并时一起计入。
+
+用法：
+    # 本机多进程：4 个分片并行探测后合并
+    python ipfs_test_gateway_multi_cid.py shard --shards 4
+    # 多节点：每个节点运行自己的分片并写出增量文件，再在任一台机器上合并
+    python ipfs_test_gateway_multi_cid.py shard --shards 2 --index 0 --node tokyo
+    python ipfs_test_gateway_multi_cid.py merge gateway_shards/delta-*.json
+"""
+import argparse
+import json
+import multiprocessing
+import socket
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from ipfs_gateway_history import HIST_BINS, hist_bin, hist_percentile
+from ipfs_gateway_log import log_info, setup_logging
+from ipfs_gateway_store import DEFAULT_STATE_FILES, write_json_atomic
+from ipfs_gateway_verify import probe_success
+
+SHARD_DIR = 'gateway_shards'    # 分片的网关数据、增量文件和合并排名所在的目录
+SHARD_COUNT = 4                 # 本机多进程模式的默认分片数
+EMA_HALF_LIFE = 6 * 3600        # 合并 EMA 时较早一方的权重每隔该时间 (秒) 减半
+
+
+def ema_weight(tests, alpha):
+    """tests 次观测得到的 EMA 的有效样本数 (Σw)² / Σw²，其中第 i 新的观测权重 w_i = α(1-α)^i
+
+    1 次观测为 1，随次数增加趋于 (2-α)/α（α = 2/(N+1) 时即 N），更早的观测已经几乎不影响 EMA。
+    """
+    if tests <= 0:
+        return 0.0
+    q = 1 - alpha
+    total = 1 - q ** tests
+    squares = alpha * alpha * (1 - q ** (2 * tests)) / (1 - q * q)
+    return total * total / squares
+
+
+def shard_of(url, shards):
+    """网关所属的分片号（CRC32，不受 Python 哈希随机化影响，各进程和节点一致）"""
+    return zlib.crc32(url.encode('utf-8')) % shards
+
+
+def default_node():
+    """默认的节点名（主机名）"""
+    return socket.gethostname()
+
+
+class GatewayDelta:
+    """单个网关的可合并统计"""
+    __slots__ = ('tests', 'successes', 'skipped', 'bytes', 'ema', 'ema_time', 'ema_weight',
+                 'ttfb_hist', 'speed_hist', 'nodes')
+
+    def __init__(self):
+        self.tests = 0              # 实际发出的探测次数（不含熔断跳过）
+        self.successes = 0          # 其中成功（206 且内容校验没有失败）的次数
+        self.skipped = 0            # 熔断跳过的次数
+        self.bytes = 0
+        self.ema = 1.0
+        self.ema_time = 0.0         # EMA 的更新时间 (Unix 时间戳)
+        self.ema_weight = 0.0       # 合并时 EMA 的权重（有效样本数，随时间衰减）
+        self.ttfb_hist = [0] * HIST_BINS    # 成功探测的首字节时间 (ms)
+        self.speed_hist = [0] * HIST_BINS   # 成功探测的下载速度 (KB/s)
+        self.nodes = set()          # 参与测量的节点
+
+    def add(self, test_result):
+        """计入一次探测结果"""
+        if test_result.get('skipped'):
+            self.skipped += 1
+            return
+        self.tests += 1
+        self.bytes += test_result.get('size') or 0
+        if probe_success(test_result):
+            self.successes += 1
+            self.ttfb_hist[hist_bin(test_result.get('ttfb', test_result['response_time']))] += 1
+            self.speed_hist[hist_bin(test_result['speed'] / 1024)] += 1
+
+    def set_ema(self, ema, ema_time, weight):
+        self.ema = ema
+        self.ema_time = ema_time
+        self.ema_weight = weight
+
+    def merge(self, other):
+        """把另一份增量合并进来（原地）"""
+        self.tests += other.tests
+        self.successes += other.successes
+        self.skipped += other.skipped
+        self.bytes += other.bytes
+        self.ttfb_hist = [a + b for a, b in zip(self.ttfb_hist, other.ttfb_hist)]
+        self.speed_hist = [a + b for a, b in zip(self.speed_hist, other.speed_hist)]
+        self.nodes |= other.nodes
+
+        # 把两份 EMA 衰减到较晚的时间戳后按权重平均
+        ema_time = max(self.ema_time, other.ema_time)
+        own = self.ema_weight * 0.5 ** ((ema_time - self.ema_time) / EMA_HALF_LIFE)
+        theirs = other.ema_weight * 0.5 ** ((ema_time - other.ema_time) / EMA_HALF_LIFE)
+        if own + theirs > 0:
+            self.ema = (self.ema * own + other.ema * theirs) / (own + theirs)
+        self.ema_time = ema_time
+        self.ema_weight = own + theirs
+        return self
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['nodes'] = sorted(self.nodes)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        delta = cls()
+        for name in cls.__slots__:
+            if data.get(name) is not None:
+                setattr(delta, name, data[name])
+        delta.nodes = set(delta.nodes)
+        return delta
+
+
+def merge_deltas(deltas):
+    """合并多份分片增量（delta 文件的内容），返回 {url: GatewayDelta}"""
+    merged = {}
+    for delta in deltas:
+        for url, data in delta['gateways'].items():
+            gateway = GatewayDelta.from_dict(data)
+            if url in merged:
+                merged[url].merge(gateway)
+            else:
+                merged[url] = gateway
+    return merged
+
+
+def rank_merged(merged, weight_func):
+    """由合并后的统计计算排名，按权重降序返回字典列表
+
+    weight_func(ema, response_time, speed_kb) 与全局权重使用同一公式；响应时间取首字节时间中位数
+    （没有成功探测时为 1500ms），速度取下载速度中位数。
+    """
+    ranked = []
+    for url, gateway in merged.items():
+        ttfb_p50 = hist_percentile(gateway.ttfb_hist, 50)
+        speed_p50 = hist_percentile(gateway.speed_hist, 50)
+        response_time = min(ttfb_p50, 1500) if ttfb_p50 is not None else 1500
+        ranked.append({
+            'url': url,
+            'weight': weight_func(gateway.ema, response_time, speed_p50 or 0),
+            'ema': gateway.ema,
+            'tests': gateway.tests,
+            'successes': gateway.successes,
+            'success_rate': gateway.successes / gateway.tests if gateway.tests else 0,
+            'skipped': gateway.skipped,
+            'ttfb_p50': ttfb_p50,
+            'ttfb_p95': hist_percentile(gateway.ttfb_hist, 95),
+            'speed_p50': speed_p50,
+            'nodes': sorted(gateway.nodes),
+        })
+    ranked.sort(key=lambda item: item['weight'], reverse=True)
+    return ranked
+
+
+def shard_name(node, shard, shards):
+    return f"{node}-{shard}of{shards}"
+
+
+def probe_shard(cids, shard=0, shards=1, node=None, shard_dir=SHARD_DIR, options=None,
+                log_level=None):
+    """运行一个分片：只探测属于该分片的网关，写出并返回增量
+
+    每个分片使用自己的网关数据文件（shard_dir/<节点>-<分片>of<分片数>），EMA 跨多次运行累积；
+    不记录探测历史和网关×CID 矩阵，避免多个进程写同一组文件。
+    options 为传给 GatewaySpeedTest 的其他参数（网关列表文件、探测后端等）。
+    可以作为 ProcessPoolExecutor 的任务在子进程中运行。
+    """
+    # 延迟导入：主程序导入本模块时不产生循环依赖，子进程中按需加载
+    from ipfs_test_gateway_multi_cid import ALPHA, STATE_BACKEND, GatewaySpeedTest
+
+    if log_level is not None:
+        setup_logging(log_level)
+    node = node or default_node()
+    name = shard_name(node, shard, shards)
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(exist_ok=True)
+    options = dict(options or {})
+    backend = options.setdefault('state_backend', STATE_BACKEND)
+    data_file = shard_dir / f"{name}{Path(DEFAULT_STATE_FILES[backend]).suffix}"
+
+    tester = GatewaySpeedTest(data_file=str(data_file), history_dir=None, cid_matrix_file=None,
+                              **options)
+    try:
+        urls = [url for url in tester.gateway_data['gateways'] if shard_of(url, shards) == shard]
+        log_info("分片 %s: %d 个网关", name, len(urls), prefix="[SHARD] ")
+        gateways = {url: GatewayDelta() for url in urls}
+        for idx, cid in enumerate(cids):
+            for item in tester.run_speed_test(cid, cids, idx, urls=urls):
+                gateways[item['url']].add(item['result'])
+        now = time.time()
+        for url, gateway in gateways.items():
+            # EMA 包含该分片以往运行的测试，按累计测试次数计算权重
+            state = tester.gateway_snapshot(url)
+            gateway.set_ema(state['current_ema'], now, ema_weight(state['test_count'], ALPHA))
+            gateway.nodes.add(node)
+    finally:
+        tester.close()
+
+    delta = {
+        'node': node,
+        'shard': shard,
+        'shards': shards,
+        'time': now,
+        'cids': list(cids),
+        'gateways': {url: gateway.to_dict() for url, gateway in gateways.items()},
+    }
+    write_json_atomic(shard_dir / f"delta-{name}.json", delta)
+    return delta
+
+
+def run_local_shards(cids, shards=SHARD_COUNT, node=None, shard_dir=SHARD_DIR, options=None,
+                     log_level=None):
+    """在本机用 shards 个进程并行运行全部分片，返回各分片的增量
+
+    子进程使用 spawn 方式启动，不继承父进程的探测引擎、日志线程和锁。
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=shards, mp_context=context) as executor:
+        futures = [executor.submit(probe_shard, cids, shard, shards, node, shard_dir, options,
+                                   log_level)
+                   for shard in range(shards)]
+        return [future.result() for future in futures]
+
+
+def load_deltas(paths):
+    deltas = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            deltas.append(json.load(f))
+    return deltas
+
+
+def coordinate(deltas, weight_func, output=None):
+    """合并各分片的增量并排名，output 指定时把排名写入该 JSON 文件"""
+    ranked = rank_merged(merge_deltas(deltas), weight_func)
+    if output is not None:
+        write_json_atomic(output, {
+            'time': time.time(),
+            'deltas': [{'node': delta['node'], 'shard': delta['shard'], 'shards': delta['shards'],
+                        'time': delta['time']} for delta in deltas],
+            'ranking': ranked,
+        })
+    return ranked
+
+
+def format_ranking(ranked, top_k=20):
+    """排名的文本表格"""
+    lines = [f"{'网关URL':<46} {'权重':<6} {'成功率':<5} {'首字节p50':<8} {'速度p50':<9} {'节点'}"]
+    for item in ranked[:top_k]:
+        ttfb = f"{item['ttfb_p50']:.0f}" if item['ttfb_p50'] is not None else "N/A"
+        speed = f"{item['speed_p50']:.0f}" if item['speed_p50'] is not None else "N/A"
+        lines.append(f"{item['url']:<50} {item['weight']:<8.3f} {item['success_rate']:<8.2%} "
+                     f"{ttfb:<11} {speed:<11} {','.join(item['nodes'])}")
+    return '\n'.join(lines)
+
+
+def parse_shard_args(argv):
+    """解析 shard 模式的命令行参数"""
+    parser = argparse.ArgumentParser(prog='ipfs_test_gateway_multi_cid.py shard',
+                                     description='按网关哈希分片并行探测，合并各分片的统计')
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help='分片数')
+    parser.add_argument('--index', type=int, default=None,
+                        help='只运行该分片并写出增量文件（多节点模式），默认在本机用多进程运行全部分片')
+    parser.add_argument('--node', default=None, help='节点名，默认为主机名')
+    parser.add_argument('--dir', default=SHARD_DIR, help='分片数据和增量文件的目录')
+    return parser.parse_args(argv)
+
+
+def parse_merge_args(argv):
+    """解析 merge 模式的命令行参数"""
+    parser = argparse.ArgumentParser(prog='ipfs_test_gateway_multi_cid.py merge',
+                                     description='合并各分片/节点的增量文件并输出排名')
+    parser.add_argument('deltas', nargs='+', help='增量文件 (delta-*.json)')
+    parser.add_argument('--dir', default=SHARD_DIR, help='合并排名的输出目录')
+    return parser.parse_args(argv)
@@ -0,0 +1,134 @@
+"""网关状态对象
+
+原来每个网关是一个普通字典，update_gateway_stats 每次都要调用 ensure_gateway_fields
+重新构造一个完整的字典，而且只能由单个消费线程更新。GatewayState 用 __slots__ 固定字段：
+
+- 只在加载或创建时补全一次字段，之后原地更新，不再逐次重建；
+- 保留字典式的访问方式（gateway['current_weight']、gateway.get(...)），原有的读取代码无需修改；
+- 每个网关的更新在它所属的条带锁（StripedLocks，按 URL 哈希分配）内进行，
+  不同网关的结果可以在多个工作线程/探测任务中并发应用；
+- to_dict() 在锁内调用即得到该网关的一致快照，用于排名、保存和接口读取。
+"""
+import threading
+
+from ipfs_gateway_cache import new_cache_score
+from ipfs_gateway_trustless import new_block_stats
+
+LOCK_STRIPES = 64           # 条带锁数量：不同网关大多落在不同的锁上，又不必为每个网关建锁
+
+# 分阶段耗时: 阶段名 -> 测试结果中的字段 (ms)
+PHASES = {
+    'dns': 'dns_time',
+    'tcp': 'tcp_time',
+    'tls': 'tls_time',
+    'ttfb': 'ttfb',
+    'transfer': 'transfer_time',
+}
+
+# 字段 -> 默认值，列表/字典类型的默认值为工厂函数
+GATEWAY_FIELDS = {
+    'url': '',
+    'is_main': False,
+    'success_count': 0,              # 只统计206的成功次数
+    'test_count': 0,                 # 只统计有效的测试次数（排除200状态码）
+    'current_ema': 1.0,
+    'current_weight': 1.0,
+    'last_test_time': None,
+    'last_response_time': None,
+    'last_status_code': None,
+    'last_download_speed': None,     # 最后一次下载速度 (KB/s)
+    'last_connect_time': None,       # 最后一次建立连接 (DNS+TCP+TLS) 耗时 (ms)，复用连接时为0
+    'last_dns_error': None,          # 最后一次探测的主机名解析失败类型（成功解析时为 None）
+    'last_integrity': None,          # 最后一次内容校验的结果（'ok' / 'mismatch' / 'incomplete'，未校验时为 None）
+    'integrity_failures': 0,         # 内容校验不一致的次数
+    'mismatch_ema': 0.0,             # 校验不一致率的 EMA，只由实际完成校验的探测更新
+    'avg_download_speed': 0,         # 平均下载速度
+    'download_speeds_history': list, # 历史下载速度记录
+    # 历史数据相关字段
+    'total_attempts': 0,             # 总尝试次数（包括所有状态码）
+    'response_times_history': list,  # 存储最近N次响应时间
+    'success_history': list,         # 存储最近N次成功状态
+    'weight_history': list,          # 存储最近N次权重
+    'next_due_time': None,           # 调度模式下的下次应测时间 (Unix时间戳)
+    'phase_history': lambda: {phase: [] for phase in PHASES},  # 最近的分阶段耗时 (ms)
+    'aliases': list,                 # 指向同一后端、合并到该网关的其他URL（见 ipfs_gateway_ingest）
+    'cache_scores': lambda: {'cold': new_cache_score(), 'warm': new_cache_score()},  # 冷/热请求分别的得分
+    'block_stats': new_block_stats,  # 块/CAR 模式的首块时间、块/秒、块吞吐量（见 ipfs_gateway_trustless）
+}
+
+
+def _default(name):
+    value = GATEWAY_FIELDS[name]
+    return value() if callable(value) else value
+
+
+def _copy(value):
+    """复制可变字段（历史列表、分阶段耗时），快照不随之后的原地更新变化"""
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    return value
+
+
+class GatewayState:
+    """单个网关的统计状态，字段固定，支持字典式访问"""
+    __slots__ = tuple(GATEWAY_FIELDS)
+
+    def __init__(self, url='', is_main=False):
+        self.reset()
+        self.url = url
+        self.is_main = is_main
+
+    def reset(self):
+        """把除 url / is_main 以外的字段恢复为默认值"""
+        for name in GATEWAY_FIELDS:
+            if name not in ('url', 'is_main') or not hasattr(self, name):
+                setattr(self, name, _default(name))
+
+    @classmethod
+    def from_dict(cls, data):
+        """由已保存的网关字典构建，缺失或为 None 的字段取默认值，未知字段忽略"""
+        state = cls(data.get('url', ''), data.get('is_main', False))
+        for name in GATEWAY_FIELDS:
+            value = data.get(name)
+            if value is not None:
+                setattr(state, name, value)
+        return state
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        if name not in GATEWAY_FIELDS:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in GATEWAY_FIELDS
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in GATEWAY_FIELDS else default
+
+    def keys(self):
+        return GATEWAY_FIELDS.keys()
+
+    def to_dict(self):
+        """复制为普通字典（调用方持有该网关的锁时即为一致快照）"""
+        return {name: _copy(getattr(self, name)) for name in GATEWAY_FIELDS}
+
+    def __repr__(self):
+        return f"GatewayState({self.url!r}, weight={self.current_weight:.4f})"
+
+
+class StripedLocks:
+    """按键哈希分配的一组锁：同一网关总是落在同一把锁上"""
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
@@ -0,0 +1,278 @@
+"""网关状态存储后端
+
+- JsonStateStore: 整个文件一次写入（原有格式），通过临时文件 + 替换保证写入原子性；
+- SqliteStateStore: SQLite (WAL)，每次 update_gateway_stats 只写一行；
+- AppendLogStateStore: 追加写的 JSON Lines 日志，启动时回放，超过阈值后压缩为快照。
+
+所有后端都提供 load() / put() / delete() / flush() / export_json() / close() 接口。
+flush() 接受 {url: gateway}，或返回它的无参函数（由后端决定何时取快照，见 AppendLogStateStore.flush）。
+"""
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# 各后端默认的数据文件
+DEFAULT_STATE_FILES = {
+    'json': 'gateway_data.json',
+    'sqlite': 'gateway_data.db',
+    'log': 'gateway_data.jsonl',
+}
+LOG_COMPACT_RATIO = 10      # 追加日志的行数超过网关数的多少倍时压缩
+
+
+def _encode(obj):
+    """JSON 序列化钩子：网关状态对象（GatewayState）按字典写入"""
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def _snapshot(gateways):
+    """flush() 的参数可以是网关字典，也可以是返回网关字典的函数"""
+    return gateways() if callable(gateways) else gateways
+
+
+def write_json_atomic(path, data):
+    """先写入临时文件再替换目标文件，写入中途崩溃不会截断原文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, default=_encode)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonStateStore:
+    """整文件 JSON 存储（原有格式 {'gateways': {url: gateway}}）"""
+    name = 'json'
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        """返回 {url: gateway}，文件不存在时返回 None"""
+        if not self.path.exists():
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)['gateways']
+
+    def put(self, url, gateway):
+        """整文件存储在 flush() 时统一写入"""
+
+    def put_many(self, gateways):
+        self.flush(gateways)
+
+    def delete(self, url):
+        """整文件存储在下次 flush() 时不再包含该网关"""
+
+    def flush(self, gateways):
+        """把全部网关写入文件"""
+        write_json_atomic(self.path, {'gateways': _snapshot(gateways)})
+
+    def export_json(self, path, gateways):
+        write_json_atomic(path, {'gateways': gateways})
+
+    def close(self):
+        pass
+
+
+class SqliteStateStore:
+    """SQLite (WAL) 存储：每个网关一行，只保存当前状态
+
+    每次 put() 是一条独立的 UPSERT 事务，崩溃时最多丢失正在写入的那一条。
+    """
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS gateways ('
+            'url TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL)')
+
+    def load(self):
+        """返回 {url: gateway}，数据库为空时返回 None"""
+        with self._lock:
+            rows = self._conn.execute('SELECT url, data FROM gateways').fetchall()
+        if not rows:
+            return None
+        return {url: json.loads(data) for url, data in rows}
+
+    def put(self, url, gateway):
+        """写入单个网关的当前状态"""
+        data = json.dumps(gateway, separators=(',', ':'), default=_encode)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO gateways (url, data) VALUES (?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET data = excluded.data',
+                (url, data))
+
+    def put_many(self, gateways):
+        """在一个事务中写入多个网关"""
+        rows = [(url, json.dumps(gateway, separators=(',', ':'), default=_encode))
+                for url, gateway in gateways.items()]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO gateways (url, data) VALUES (?, ?) '
+                    'ON CONFLICT(url) DO UPDATE SET data = excluded.data',
+                    rows)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, url):
+        with self._lock:
+            self._conn.execute('DELETE FROM gateways WHERE url = ?', (url,))
+
+    def flush(self, gateways):
+        """每次 put() 都已提交，这里只做 WAL 检查点"""
+        with self._lock:
+            self._conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def export_json(self, path, gateways):
+        write_json_atomic(path, {'gateways': gateways})
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AppendLogStateStore:
+    """追加写日志存储：每次 put() 追加一行 {"url": ..., "gateway": {...}}
+
+    启动时按顺序回放，同一网关以最后一行为准；日志行数超过网关数的
+    LOG_COMPACT_RATIO 倍时，在 flush() 中重写为只含当前状态的快照。
+    """
+    name = 'log'
+
+    def __init__(self, path, compact_ratio=LOG_COMPACT_RATIO):
+        self.path = Path(path)
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._lines = 0
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def load(self):
+        """回放日志，返回 {url: gateway}，日志不存在或为空时返回 None"""
+        if not self.path.exists():
+            return None
+        gateways = {}
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能只写了一半，忽略即可
+                    continue
+                if record.get('deleted'):
+                    gateways.pop(record['url'], None)
+                else:
+                    gateways[record['url']] = record['gateway']
+                lines += 1
+        self._lines = lines
+        return gateways or None
+
+    def put(self, url, gateway):
+        line = json.dumps({'url': url, 'gateway': gateway}, separators=(',', ':'),
+                          default=_encode)
+        with self._lock:
+            f = self._open()
+            f.write(line + '\n')
+            f.flush()
+            self._lines += 1
+
+    def put_many(self, gateways):
+        for url, gateway in gateways.items():
+            self.put(url, gateway)
+
+    def delete(self, url):
+        """追加一条删除记录，回放时移除该网关"""
+        line = json.dumps({'url': url, 'deleted': True}, separators=(',', ':'))
+        with self._lock:
+            f = self._open()
+            f.write(line + '\n')
+            f.flush()
+            self._lines += 1
+
+    def flush(self, gateways):
+        """日志过长时压缩为快照
+
+        调用方复制网关状态需要网关锁，而 put() 在网关锁内调用，所以快照只能在存储锁外取得：
+        先记下旧日志的长度再取快照，快照写入新文件后，把旧日志中此后追加的记录原样接在后面。
+        取快照期间 put() 的记录不会丢失（回放时同一网关以最后一行为准），gateways 传入返回快照
+        的函数时才能保证这一点，传入现成的字典时仍会接上压缩开始前追加的记录。
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            mark = self.path.stat().st_size if self.path.exists() else 0
+        gateways = _snapshot(gateways)
+        with self._lock:
+            if self._lines <= max(len(gateways), 1) * self.compact_ratio:
+                if self._file is not None:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                return
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            tail_lines = 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for url, gateway in gateways.items():
+                    f.write(json.dumps({'url': url, 'gateway': gateway},
+                                       separators=(',', ':'), default=_encode) + '\n')
+                if self.path.exists():
+                    with open(self.path, 'r', encoding='utf-8') as old:
+                        old.seek(mark)
+                        for line in old:
+                            if line.strip():
+                                f.write(line if line.endswith('\n') else line + '\n')
+                                tail_lines += 1
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._lines = len(gateways) + tail_lines
+
+    def export_json(self, path, gateways):
+        write_json_atomic(path, {'gateways': gateways})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+STATE_STORES = {
+    JsonStateStore.name: JsonStateStore,
+    SqliteStateStore.name: SqliteStateStore,
+    AppendLogStateStore.name: AppendLogStateStore,
+}
+
+
+def open_state_store(backend, path=None):
+    """按名称创建存储后端，path 为空时使用该后端的默认文件"""
+    if backend not in STATE_STORES:
+        raise ValueError(f"未知的存储后端: {backend}")
+    return STATE_STORES[backend](path or DEFAULT_STATE_FILES[backend])
@@ -0,0 +1,267 @@
+"""块/CAR 探测模式（trustless gateway）
+
+原来探测总是按 UnixFS 路径请求 /ipfs/<cid> 的一个字节范围，耗时取决于网关的反序列化和缓存层；
+自行校验数据的 trustless 检索客户端关心的是网关提供原始块和 CAR 流的速度。PROBE_MODE 选择：
+
+- 'path'：原来的路径请求（Range 0-1048576）；
+- 'raw'：?format=raw（Accept: application/vnd.ipld.raw），响应体就是 CID 对应的一个块；
+- 'car'：?format=car&dag-scope=entity&entity-bytes=0:N（Accept: application/vnd.ipld.car），
+  按 dfs 顺序返回该实体的块，entity-bytes 把文件内容限制在与路径请求相同的 1 MiB。
+
+CAR 流边接收边解析（CarStream 只缓存尚未完整的长度前缀和 CID，块数据直接送入哈希后丢弃），
+统计完整的块数和块字节数。两种模式的结果中都有 blocks / block_bytes / first_block_time
+（收到第一个完整块的时间，ms）/ block_rate（块/秒）/ block_speed（完整块的字节/秒），
+网关的 block_stats 保存它们的 EMA；全局权重、冷/热缓存得分和网关×CID 矩阵评分时
+首块时间和块吞吐量分别代替首字节时间和下载速度。两种后端都最多读取 max_bytes 字节，
+CAR 格式错误时停止读取（curl 后端结束 curl 进程）。
+成功的条件是 200/206 且至少收到一个完整的块（见 ipfs_gateway_verify.probe_success）。
+开启内容校验时每个块都按它的 CID 校验，CAR 的第一个块还必须是所请求的根 CID。
+"""
+import time
+
+from ipfs_gateway_score import smooth
+from ipfs_gateway_verify import (ContentVerifier, content_complete, is_verifiable, parse_cid,
+                                 parse_cid_bytes, read_varint)
+
+PROBE_MODES = ('path', 'raw', 'car')
+CAR_ENTITY_BYTES = 1048576      # car 模式 entity-bytes 的上限（与路径请求的范围相同）
+CAR_MAX_BYTES = 4 * 1048576     # car 模式最多读取的字节数（含 CID 和长度前缀等开销）
+RAW_MAX_BYTES = 2 * 1048576     # raw 模式最多读取的字节数（块大小的上限）
+CID_MAX_BYTES = 128             # CAR 中单个 CID 的最大长度，超过仍无法解析时按格式错误处理
+
+# 各模式请求的媒体类型
+ACCEPT = {
+    'raw': 'application/vnd.ipld.raw',
+    'car': 'application/vnd.ipld.car; version=1; order=dfs; dups=n',
+}
+
+
+def trustless_url(test_url, mode):
+    """把路径测试 URL 改为块/CAR 请求"""
+    if mode == 'raw':
+        return f"{test_url}?format=raw"
+    return f"{test_url}?format=car&dag-scope=entity&entity-bytes=0:{CAR_ENTITY_BYTES - 1}"
+
+
+class BlockStream:
+    """块/CAR 响应体的观察者：feed() 按到达顺序接收数据，finish() 给出块指标"""
+
+    mode = None
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.accept = ACCEPT[self.mode]
+        self.blocks = 0
+        self.block_bytes = 0
+        self.first_data_at = None
+        self.first_block_at = None
+        self.last_block_at = None
+
+    def _block_done(self, size, now):
+        self.blocks += 1
+        self.block_bytes += size
+        if self.first_block_at is None:
+            self.first_block_at = now
+        self.last_block_at = now
+
+    def metrics(self, start):
+        """按块计算的指标，start 为请求开始的时间（与 clock 相同的时钟）"""
+        fields = {'blocks': self.blocks, 'block_bytes': self.block_bytes}
+        if self.blocks:
+            # 吞吐量按从收到第一段数据到最后一个完整块的时间计算，与 speed 的传输阶段对应
+            window = self.last_block_at - self.first_data_at
+            if window <= 0:
+                window = self.last_block_at - start
+            fields['first_block_time'] = (self.first_block_at - start) * 1000
+            fields['block_rate'] = self.blocks / window if window > 0 else 0.0
+            fields['block_speed'] = self.block_bytes / window if window > 0 else 0.0
+        return fields
+
+
+class RawBlockStream(BlockStream):
+    """raw 模式：响应体是一个块，Content-Type 为 application/vnd.ipld.raw 且完整收到时计为一个块
+
+    不支持 trustless 请求的网关会忽略 format 参数返回文件内容或错误页，它们不计为块。
+    """
+
+    mode = 'raw'
+    max_bytes = RAW_MAX_BYTES
+
+    def __init__(self, verifier=None, clock=time.monotonic):
+        super().__init__(clock)
+        self.verifier = verifier
+        self.size = 0
+        self.last_data_at = None
+
+    def feed(self, data):
+        now = self.clock()
+        if self.first_data_at is None:
+            self.first_data_at = now
+        self.last_data_at = now
+        self.size += len(data)
+        if self.verifier is not None:
+            self.verifier.update(data)
+
+    def finish(self, status_code, headers, start, complete=False):
+        """complete 为响应体是否完整读完（连接没有中断，chunked 响应收到了结束块）
+
+        完整的块：Content-Length / Content-Range 与收到的字节数相符，或者是完整读完的 chunked 200
+        响应（没有 Content-Length）；开启校验时与 CID 的摘要一致本身就说明块是完整的。
+        """
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        whole = (content_complete(status_code, headers, self.size)
+                 or (status_code == 200 and chunked and complete))
+        matched = self.verifier is not None and self.verifier.matches()
+        if status_code in (200, 206) and content_type == self.accept and (whole or matched):
+            self._block_done(self.size, self.last_data_at)
+        fields = self.metrics(start)
+        if self.verifier is not None and status_code in (200, 206):
+            fields['integrity'] = 'ok' if matched else 'mismatch' if whole else 'incomplete'
+        return fields
+
+
+class CarStream(BlockStream):
+    """car 模式：增量解析 CARv1 流
+
+    格式为 varint(头长度) + 头 + 若干 [varint(段长度) + CID + 块数据]。头（dag-cbor）直接跳过；
+    只有长度前缀和 CID 可能跨越两次 feed()，需要暂存，块数据在到达时送入校验器后即丢弃。
+    流格式错误时停止解析（feed() 返回 False，调用方可以停止读取），已完整的块仍然计入。
+    """
+
+    mode = 'car'
+    max_bytes = CAR_MAX_BYTES
+
+    def __init__(self, root=None, verify=False, clock=time.monotonic):
+        super().__init__(clock)
+        self.root = None
+        if verify and root:
+            try:
+                self.root = parse_cid(root)
+            except ValueError:
+                pass
+        self.verify = verify
+        self.error = None
+        self.mismatches = 0
+        self.root_ok = None         # 第一个块是否为所请求的根 CID（校验模式）
+        self._state = 'header_len'
+        self._pending = b''         # 尚未完整的长度前缀或 CID
+        self._remaining = 0         # 当前头或块还需要的字节数
+        self._section = 0           # 当前段剩余的字节数（CID + 块数据）
+        self._block_size = 0
+        self._verifier = None
+
+    def feed(self, data):
+        if self.error is not None:
+            return False
+        now = self.clock()
+        if self.first_data_at is None:
+            self.first_data_at = now
+        view = memoryview(data)
+        pos = 0
+        try:
+            while pos < len(view):
+                if self._state in ('header', 'block'):
+                    n = min(self._remaining, len(view) - pos)
+                    if self._state == 'block' and self._verifier is not None:
+                        self._verifier.update(view[pos:pos + n])
+                    pos += n
+                    self._remaining -= n
+                    if self._remaining == 0:
+                        self._advance(now)
+                    continue
+                pos = self._read_prefix(view, pos, now)
+        except ValueError as e:
+            self.error = str(e)
+            return False
+
+    def _read_prefix(self, view, pos, now):
+        """解析长度前缀或 CID（可能跨越多次 feed），返回新的读取位置"""
+        buffer = self._pending + bytes(view[pos:pos + CID_MAX_BYTES])
+        try:
+            if self._state == 'cid':
+                value, end = parse_cid_bytes(buffer)
+            else:
+                value, end = read_varint(buffer)
+        except (ValueError, IndexError):
+            # 数据不够时继续等待，超过可能的最大长度仍无法解析才是格式错误
+            if self._state == 'cid':
+                limit, what = min(CID_MAX_BYTES, self._section), 'CID'
+            else:
+                limit, what = 10, '长度前缀'
+            if len(buffer) >= limit:
+                raise ValueError(f"CAR 格式错误: 无法解析{what}")
+            self._pending = buffer
+            return len(view)
+        consumed = end - len(self._pending)
+        self._pending = b''
+        if self._state == 'header_len':
+            self._state, self._remaining = 'header', value
+            if value == 0:
+                raise ValueError("CAR 格式错误: 头为空")
+        elif self._state == 'section_len':
+            self._state, self._section = 'cid', value
+        else:
+            self._start_block(value, self._section - end)
+            if self._remaining == 0:
+                self._advance(now)
+        return pos + consumed
+
+    def _start_block(self, info, size):
+        if size < 0:
+            raise ValueError("CAR 格式错误: 段长度小于 CID 长度")
+        if self.verify:
+            if self.blocks == 0 and self.root_ok is None and self.root is not None:
+                self.root_ok = (info.hash_code, info.digest) == (self.root.hash_code, self.root.digest)
+            self._verifier = ContentVerifier(info) if is_verifiable(info) else None
+        self._state, self._remaining, self._block_size = 'block', size, size
+
+    def _advance(self, now):
+        """当前的头或块已经读完"""
+        if self._state == 'block':
+            if self._verifier is not None and not self._verifier.matches():
+                self.mismatches += 1
+            self._verifier = None
+            self._block_done(self._block_size, now)
+        self._state = 'section_len'
+
+    def finish(self, status_code, headers, start, complete=False):
+        if status_code not in (200, 206):
+            return {'blocks': 0, 'block_bytes': 0}
+        fields = self.metrics(start)
+        if self.error is not None:
+            fields['car_error'] = self.error
+        if self.verify:
+            if self.mismatches or (self.blocks and self.root_ok is False):
+                fields['integrity'] = 'mismatch'
+            else:
+                fields['integrity'] = 'ok' if self.blocks else 'incomplete'
+        return fields
+
+
+def probe_stream(mode, cid, verifier=None, verify=False):
+    """为一次块/CAR 探测创建响应体观察者，路径模式返回 None"""
+    if mode == 'raw':
+        return RawBlockStream(verifier)
+    if mode == 'car':
+        return CarStream(cid, verify)
+    return None
+
+
+def new_block_stats():
+    """网关在块/CAR 模式下的指标：首块时间 (ms)、块/秒、块吞吐量 (KB/s) 的 EMA 和累计块数"""
+    return {'tests': 0, 'blocks': 0, 'first_block_time': None, 'block_rate': None,
+            'block_speed': None}
+
+
+def update_block_stats(stats, test_result, alpha):
+    """把一次块/CAR 探测计入网关的 block_stats（原地更新）"""
+    stats['tests'] += 1
+    stats['blocks'] += test_result['blocks']
+    if test_result['blocks']:
+        stats['first_block_time'] = smooth(stats['first_block_time'],
+                                            test_result['first_block_time'], alpha)
+        stats['block_rate'] = smooth(stats['block_rate'], test_result['block_rate'], alpha)
+        stats['block_speed'] = smooth(stats['block_speed'], test_result['block_speed'] / 1024,
+                                       alpha)
+    return stats
@@ -0,0 +1,220 @@
+"""内容完整性校验
+
+原来 update_gateway_stats 只看状态码：返回 206 的网关即使给的是乱码、HTML 错误页或强制门户的
+页面也算一次完整的成功，速度快的"说谎"网关反而得到最高的权重。校验模式把响应体边下载边送入
+增量哈希（不缓存整个响应体，也不需要下载完再读第二遍），与 CID 中的 multihash 比较：
+
+- raw 编码（0x55）的 CID：按路径请求得到的就是块本身，直接校验；
+- identity 哈希的 CID：内容就在 CID 里，逐段与之比较；
+- 其他编码（如 dag-pb 的 Qm... CID）：按路径请求得到的是反序列化后的文件内容，无法对照 CID，
+  改为请求 ?format=raw 取回原始块再校验（block_request）。
+
+校验结果写入测试结果的 'integrity'：'ok' 为一致，'mismatch' 为不一致，'incomplete' 为响应不是
+完整的块（206 没有 Content-Range 或范围、总长度与收到的字节数不符，块大于请求范围或传输中断），
+无法判断。'mismatch' 是单独的一类失败：即使状态码为 206 也不计为成功（probe_success），并在
+网关的 mismatch_ema 上累积，按 INTEGRITY_PENALTY 重罚权重。'incomplete' 同样不计为成功，
+否则网关只要返回截短或标错范围的 206 就能绕过校验；它可能只是传输中断，不计入 mismatch_ema。
+"""
+import base64
+import hashlib
+from collections import namedtuple
+from functools import lru_cache
+
+INTEGRITY_PENALTY = 10      # 权重惩罚指数：γ_integrity = (1 - mismatch_ema) ^ INTEGRITY_PENALTY
+
+CODEC_RAW = 0x55
+CODEC_DAG_PB = 0x70
+HASH_IDENTITY = 0x00
+
+# multihash 编号 -> 增量哈希的构造函数
+HASHERS = {
+    0x12: hashlib.sha256,
+    0x13: hashlib.sha512,
+    0x14: hashlib.sha3_512,
+    0x15: hashlib.sha3_384,
+    0x16: hashlib.sha3_256,
+    0x17: hashlib.sha3_224,
+    0xb220: lambda: hashlib.blake2b(digest_size=32),
+    0xb240: hashlib.blake2b,
+}
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+CidInfo = namedtuple('CidInfo', ('version', 'codec', 'hash_code', 'digest'))
+
+
+def _base58_decode(text):
+    value = 0
+    for char in text:
+        value = value * 58 + BASE58_ALPHABET.index(char)
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return b'\0' * (len(text) - len(text.lstrip('1'))) + data
+
+
+def _base32_decode(text):
+    text = text.upper()
+    return base64.b32decode(text + '=' * (-len(text) % 8))
+
+
+def _base64_decode(text, altchars=None):
+    return base64.b64decode(text + '=' * (-len(text) % 4), altchars=altchars, validate=True)
+
+
+# multibase 前缀 -> 解码函数
+MULTIBASE = {
+    'b': _base32_decode,
+    'B': _base32_decode,
+    'z': _base58_decode,
+    'f': bytes.fromhex,
+    'F': bytes.fromhex,
+    'm': _base64_decode,
+    'u': lambda text: _base64_decode(text, altchars=b'-_'),
+}
+
+
+def read_varint(data, pos=0):
+    """读取无符号 varint，返回 (值, 新位置)"""
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("varint 不完整")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _parse_multihash(data, pos=0):
+    """返回 (哈希编号, 摘要, 结束位置)"""
+    hash_code, pos = read_varint(data, pos)
+    length, pos = read_varint(data, pos)
+    digest = data[pos:pos + length]
+    if len(digest) != length:
+        raise ValueError("multihash 长度不符")
+    return hash_code, digest, pos + length
+
+
+def parse_cid_bytes(data, pos=0):
+    """从二进制 CID 解析 CidInfo，返回 (CidInfo, 结束位置)（CAR 文件中的 CID 为二进制形式）"""
+    if data[pos:pos + 2] == b'\x12\x20':
+        hash_code, digest, end = _parse_multihash(data, pos)
+        return CidInfo(0, CODEC_DAG_PB, hash_code, digest), end
+    version, pos = read_varint(data, pos)
+    if version != 1:
+        raise ValueError(f"不支持的 CID 版本: {version}")
+    codec, pos = read_varint(data, pos)
+    hash_code, digest, end = _parse_multihash(data, pos)
+    return CidInfo(1, codec, hash_code, digest), end
+
+
+@lru_cache(maxsize=4096)
+def parse_cid(text):
+    """解析文本形式的 CID（CIDv0 的 Qm... 或带 multibase 前缀的 CIDv1），无法解析时抛出 ValueError"""
+    text = text.strip()
+    try:
+        if len(text) == 46 and text.startswith('Qm'):
+            data = _base58_decode(text)
+        else:
+            decode = MULTIBASE.get(text[:1])
+            if decode is None:
+                raise ValueError(f"不支持的 multibase 前缀: {text[:1]!r}")
+            data = decode(text[1:])
+        info, end = parse_cid_bytes(data)
+    except (ValueError, IndexError) as e:
+        raise ValueError(f"无法解析 CID {text!r}: {e}") from None
+    if end != len(data):
+        raise ValueError(f"无法解析 CID {text!r}: 多余的字节")
+    return info
+
+
+def is_verifiable(info):
+    """该 CID 的哈希函数是否支持校验"""
+    return info.hash_code == HASH_IDENTITY or info.hash_code in HASHERS
+
+
+def block_request(cid):
+    """校验该 CID 时需要改用 ?format=raw 请求原始块（按路径请求得到的不是块本身），无法校验时返回 False"""
+    try:
+        info = parse_cid(cid)
+    except ValueError:
+        return False
+    return is_verifiable(info) and info.codec != CODEC_RAW and info.hash_code != HASH_IDENTITY
+
+
+def content_complete(status_code, headers, size):
+    """响应体是否为完整的块：206 需要 Content-Range 覆盖 0 到末尾，200 需要 Content-Length 相符"""
+    content_range = headers.get('content-range')
+    if status_code == 206:
+        if not content_range:
+            return False
+        try:
+            span, _, total = content_range.split(None, 1)[-1].partition('/')
+            first, _, last = span.partition('-')
+            return int(first) == 0 and int(last) + 1 == size == int(total)
+        except ValueError:
+            return False
+    content_length = headers.get('content-length')
+    return content_length is not None and content_length.strip() == str(size)
+
+
+class ContentVerifier:
+    """单次探测的增量校验：响应体按到达顺序交给 update()，结束后由 finish() 给出结论"""
+    __slots__ = ('info', 'hasher', 'size', 'matched')
+
+    def __init__(self, info):
+        if not is_verifiable(info):
+            raise ValueError(f"不支持的哈希函数: 0x{info.hash_code:x}")
+        self.info = info
+        self.hasher = None if info.hash_code == HASH_IDENTITY else HASHERS[info.hash_code]()
+        self.size = 0
+        self.matched = True         # identity：到目前为止的数据与 CID 中的内容一致
+
+    def update(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
+        elif self.matched:
+            digest = self.info.digest
+            self.matched = digest[self.size:self.size + len(data)] == data
+        self.size += len(data)
+
+    def finish(self, status_code, headers, size=None):
+        """返回 'ok' / 'mismatch' / 'incomplete'，不是 200/206 响应时返回 None
+
+        headers 为最后一个响应的响应头（小写键）；size 默认为 update() 收到的字节数。
+        """
+        if status_code not in (200, 206):
+            return None
+        size = self.size if size is None else size
+        if not content_complete(status_code, headers, size):
+            return 'incomplete'
+        return 'ok' if self.matches() else 'mismatch'
+
+    def matches(self):
+        """已收到的数据是否与 CID 一致（调用方需确认数据已经完整）"""
+        if self.hasher is None:
+            return self.matched and self.size == len(self.info.digest)
+        # 截断的 multihash 只比较前 len(digest) 个字节
+        return self.hasher.digest()[:len(self.info.digest)] == self.info.digest
+
+
+def make_verifier(cid):
+    """为 CID 创建校验器，CID 无法解析或哈希函数不支持时返回 None"""
+    try:
+        return ContentVerifier(parse_cid(cid))
+    except ValueError:
+        return None
+
+
+def probe_success(test_result):
+    """探测是否成功：没有校验失败（内容不一致或无法确认完整），且状态码为 206
+
+    块/CAR 模式（结果中有 'blocks'，见 ipfs_gateway_trustless）请求的是完整响应，
+    成功的条件是 200/206 且至少收到一个完整的块。
+    """
+    if test_result.get('integrity') in ('mismatch', 'incomplete'):
+        return False
+    if 'blocks' in test_result:
+        return test_result['status_code'] in (200, 206) and test_result['blocks'] > 0
+    return test_result['status_code'] == 206
@@ -1,13 +1,34 @@
-import json
 import subprocess
 import math
 import random
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from pathlib import Path
+from urllib.parse import urlsplit
 import time
 import os
-# import heapq
+import sys
+import threading
+import asyncio
+
+from ipfs_gateway_cache import CacheClassifier, bust_url, cache_headers, update_cache_score
+from ipfs_gateway_dns import DnsError, dns_failure_result, get_resolver, is_ip_literal
+from ipfs_gateway_fetch import FETCH_TOP_K, MultiSourceFetcher
+from ipfs_gateway_history import ProbeHistory
+from ipfs_gateway_ingest import ingest_gateway_lists, merge_gateway_lists
+from ipfs_gateway_log import (DEBUG, log_debug, log_enabled, log_error, log_info, log_warning,
+                              setup_logging, should_trace)
+from ipfs_gateway_matrix import CidMatrix
+from ipfs_gateway_probe import AsyncProbeEngine, build_probe_result
+from ipfs_gateway_rank import RankIndex
+from ipfs_gateway_report import RENDERERS, CidAggregates, summary_data
+from ipfs_gateway_select import GatewaySelector
+from ipfs_gateway_sched import CircuitBreaker, ProbeScheduler, deadline_result, skipped_result
+from ipfs_gateway_score import score_sample
+from ipfs_gateway_state import PHASES, GatewayState, StripedLocks
+from ipfs_gateway_store import DEFAULT_STATE_FILES, JsonStateStore, open_state_store
+from ipfs_gateway_trustless import PROBE_MODES, probe_stream, trustless_url, update_block_stats
+from ipfs_gateway_verify import INTEGRITY_PENALTY, block_request, make_verifier
 
 # 全局变量
 N = 10                  # EMA移动平均窗口大小
@@ -16,140 +37,273 @@ BETA = 2.0              # 权重平滑指数
 W_MIN = 0.001           # 保底最小权重
 BASE_LN = 0.8           # 响应时间惩罚指数
 k_speed = 0.7           # 下载速度惩罚系数
-# EPSILON = 0.2           # 随机抽样探索率
+EPSILON = 0.2           # 随机抽样探索率
+PROBE_BACKEND = 'async' # 探测后端: 'async' (进程内异步引擎) 或 'curl' (每次探测启动 curl 进程)
+CURL_MAX_WORKERS = 50   # curl 后端的线程池大小
+ASYNC_MAX_CONCURRENCY = 1000  # 异步后端的最大并发探测数
+POOL_MAX_PER_HOST = 4   # 连接池：每个网关主机最多保持的连接数
+POOL_MAX_TOTAL = 1000   # 连接池：全局最多保持的连接数
+POOL_IDLE_TIMEOUT = 60  # 连接池：空闲连接保留时间 (秒)
+MATRIX_MODE = True      # 为 True 时把 网关×CID 的全部探测提交到同一个并发池，而不是逐个CID测试
+MAX_INFLIGHT_PER_GATEWAY = 2  # 矩阵模式下每个网关同时进行的最大探测数
+BREAKER_THRESHOLD = 3   # 熔断：网关连续连接失败/超时多少次后跳过其后续探测 (0 表示关闭熔断)
+BREAKER_HALF_OPEN_INTERVAL = 60  # 熔断：每隔多少秒对熔断中的网关放行一次试探性探测
+PROBE_BUDGET = 100      # 调度模式：每轮探测的网关数量
+SCHEDULER_STRATEGY = 'epsilon'  # 调度模式的探索策略: 'epsilon' / 'ucb' / 'thompson'
+SCORE_SERVER_TIME = False  # 为 True 时 γ_time 只按服务器处理时间计算（扣除建立连接/TLS握手耗时）
+STATE_BACKEND = 'json'  # 网关数据存储后端: 'json' (整文件) / 'sqlite' (WAL，逐条写入) / 'log' (追加日志)
+ROUND_DEADLINE = None   # 轮次截止时间 (秒)：超过后结束本轮，未完成的探测记为超时 (None 表示等待全部完成)
+ROUND_TARGET_FRACTION = 1.0  # 完成比例达到该值时即结束本轮，其余探测记为超时 (1.0 表示等待全部完成)
+PHASE_HISTORY_SIZE = 50 # 每个网关保留的分阶段耗时记录数
+LOG_LEVEL = 'INFO'      # 控制台日志级别: 'TRACE' / 'DEBUG' / 'INFO' / 'WARNING' / 'ERROR'
+LOG_JSON_FILE = None    # 设置文件名后额外写出 JSON Lines 格式的日志 (如 'gateway_log.jsonl')
+LOG_JSON_LEVEL = 'DEBUG'  # JSON Lines 日志的级别
+TRACE_SAMPLE_RATE = 0.0 # 逐探测追踪的抽样比例：被抽中的探测以 INFO 级别输出结果及更新前后的状态
+HISTORY_DIR = 'gateway_history'  # 探测历史时间序列的目录 (None 表示不记录)
+LOG_RETENTION_DAYS = None  # gateway_logs 中测速日志的保留天数 (None 表示不清理，需要时再开启)
+LOG_PRUNE_PATTERNS = ('gateway_test_*.log', 'summary_report_*.log')  # 可被清理的日志文件名
+SUMMARY_FORMATS = ('text',)  # 汇总报告的格式: 'text' / 'json' / 'csv'，可同时输出多种
+CID_MATRIX_FILE = 'gateway_cid_matrix.json'  # 网关×CID 性能矩阵的保存文件 (None 表示不保存)
+CACHE_BUST = False      # 为 True 时每个探测 URL 附加随机查询参数绕过 HTTP 缓存，全部按冷请求计分
+VERIFY_CONTENT = False  # 为 True 时按 CID 校验返回的内容，校验失败不计为成功并重罚权重（见 ipfs_gateway_verify）
+DEFAULT_TEST_CID = "QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn"  # 没有指定 CID 时的测试内容（空文件夹）
+PROBE_MODE = 'path'     # 探测模式: 'path' (按路径请求字节范围) / 'raw' (?format=raw 原始块) / 'car' (?format=car CAR 流)
 
-def debug_print(msg, data=None, prefix="[DEBUG] "):
-    """统一的调试信息输出函数"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"{prefix}{timestamp} {msg}")
-    if data is not None:
-        print(f"{prefix}Data: {json.dumps(data, indent=2)}")
+def percentile(values, q):
+    """最近秩法计算百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
 
 class GatewaySpeedTest:
     def __init__(self, main_gateway_file='ipfs_gateway.txt', 
                  side_gateway_file='ipfs_gateway_side.txt',
-                 data_file='gateway_data.json',
-                 log_dir='gateway_logs'):
+                 data_file=None,
+                 log_dir='gateway_logs',
+                 probe_backend=PROBE_BACKEND,
+                 score_server_time=SCORE_SERVER_TIME,
+                 state_backend=STATE_BACKEND,
+                 round_deadline=ROUND_DEADLINE,
+                 round_target_fraction=ROUND_TARGET_FRACTION,
+                 trace_sample_rate=TRACE_SAMPLE_RATE,
+                 history_dir=HISTORY_DIR,
+                 cid_matrix_file=CID_MATRIX_FILE,
+                 cache_bust=CACHE_BUST,
+                 verify_content=VERIFY_CONTENT,
+                 probe_mode=PROBE_MODE):
         self.main_gateway_file = main_gateway_file
         self.side_gateway_file = side_gateway_file
-        self.data_file = data_file
+        self.data_file = data_file or DEFAULT_STATE_FILES[state_backend]
+        self.store = open_state_store(state_backend, self.data_file)
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
+        self.cid = None
+        self.lock = threading.RLock()    # 保护排名索引和调度器，常驻服务模式下接口线程会并发读取
+        self.state_locks = StripedLocks()  # 单个网关的字段由其条带锁保护，不同网关可并发更新
+        self.probe_backend = probe_backend
+        self.score_server_time = score_server_time
+        self.round_deadline = round_deadline
+        self.round_target_fraction = round_target_fraction
+        self.trace_sample_rate = trace_sample_rate
+        self.history = ProbeHistory(history_dir) if history_dir else None
+        self.cid_stats = CidAggregates()   # 本轮各CID的探测汇总，用于生成汇总报告
+        self.cid_matrix_file = cid_matrix_file
+        self.cid_matrix = CidMatrix(self.pair_weight, ALPHA)  # 每个 (网关, CID) 组合的统计
+        if cid_matrix_file:
+            try:
+                self.cid_matrix.load(cid_matrix_file)
+            except Exception as e:
+                log_error("加载网关×CID矩阵失败: %s", e)
+        self.cache_bust = cache_bust
+        self.cache_classifier = CacheClassifier()  # 判定每次探测是冷请求还是命中缓存的热请求
+        self.verify_content = verify_content
+        if probe_mode not in PROBE_MODES:
+            raise ValueError(f"未知的探测模式: {probe_mode}")
+        self.probe_mode = probe_mode       # 块/CAR 模式按首块时间和块吞吐量评分（见 ipfs_gateway_trustless）
+        self.resolver = get_resolver()     # 进程内共享的 DNS 缓存，curl 和异步后端共用
+        self._probe_engine = None
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_HALF_OPEN_INTERVAL)
+        self._scheduler = None
         self.gateway_data = self.load_gateway_data()
-        debug_print(f"已加载 {len(self.gateway_data['gateways'])} 个网关")
+        self.rank_index = RankIndex()
+        for url, gateway in self.gateway_data['gateways'].items():
+            self.rank_index.update(url, gateway['current_weight'])
+        self.selector = GatewaySelector.from_gateways(self.gateway_data['gateways'])
+        log_info("已加载 %d 个网关", len(self.gateway_data['gateways']))
 
     def load_gateway_data(self):
-        """从JSON文件加载网关数据，如果文件不存在则初始化新数据"""
-        debug_print("开始加载网关数据")
+        """从存储后端加载网关数据，如果没有数据则初始化新数据"""
+        log_debug("开始加载网关数据")
 
         try:
             # 尝试加载现有数据
-            if Path(self.data_file).exists():
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    debug_print(f"从 {self.data_file} 加载了数据")
-                    
-                    # 更新所有网关条目的字段
-                    updated_data = {'gateways': {}}
-                    for url, gateway in data['gateways'].items():
-                        updated_data['gateways'][url] = self.ensure_gateway_fields(gateway)
-                    debug_print(f"更新了 {len(updated_data['gateways'])} 个网关的数据结构")
-                    return updated_data
+            gateways = self.store.load()
+            if gateways is None and self.store.name != 'json' and Path(DEFAULT_STATE_FILES['json']).exists():
+                # 新后端为空时从旧的 JSON 文件迁移
+                log_info("从 %s 迁移数据到 %s", DEFAULT_STATE_FILES['json'], self.data_file)
+                gateways = JsonStateStore(DEFAULT_STATE_FILES['json']).load()
+                if gateways:
+                    self.store.put_many(gateways)
+
+            if gateways is not None:
+                log_info("从 %s 加载了数据", self.data_file)
+                
+                # 更新所有网关条目的字段
+                updated_data = {'gateways': {}}
+                for url, gateway in gateways.items():
+                    updated_data['gateways'][url] = self.ensure_gateway_fields(gateway)
+                log_debug("更新了 %d 个网关的数据结构", len(updated_data['gateways']))
+
+                # 把网关列表中新增的网关增量合并进来，并整理重复的URL
+                # （JSON 后端的 put / delete 在下次 save_gateway_data 时统一写入）
+                changed, removed = self._merge_gateway_lists(updated_data['gateways'])
+                for url in removed:
+                    self.store.delete(url)
+                for url in changed:
+                    self.store.put(url, updated_data['gateways'][url])
+                return updated_data
             else:
-                debug_print("数据文件不存在，初始化新数据")
-                return self._initialize_gateway_data()
+                log_info("数据文件不存在，初始化新数据")
+                data = self._initialize_gateway_data()
+                self.store.put_many(data['gateways'])
+                return data
                 
         except Exception as e:
-            debug_print(f"加载数据失败: {str(e)}", prefix="[ERROR] ")
-            debug_print("初始化新数据", prefix="[RECOVERY] ")
+            log_error("加载数据失败: %s", e)
+            # 保留无法读取的数据文件，避免被新数据覆盖
+            if self.store.name == 'json' and Path(self.data_file).exists():
+                backup = f"{self.data_file}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                os.replace(self.data_file, backup)
+                log_info("已将无法读取的数据文件备份为 %s", backup, prefix="[RECOVERY] ")
+            log_info("初始化新数据", prefix="[RECOVERY] ")
             return self._initialize_gateway_data()
 
     def ensure_gateway_fields(self, gateway):
-        """确保网关数据包含所有必需的字段"""
-        # 创建一个新的默认条目
-        default_entry = self._create_gateway_entry(
-            url=gateway.get('url', ''),
-            is_main=gateway.get('is_main', False)
-        )
-        
-        # 保留现有数据中的值
-        for key in default_entry.keys():
-            if key in gateway and gateway[key] is not None:
-                default_entry[key] = gateway[key]
-                
-        return default_entry
+        """把加载的网关字典转换为字段完整的 GatewayState（缺失的字段取默认值，只在加载时做一次）"""
+        if isinstance(gateway, GatewayState):
+            return gateway
+        return GatewayState.from_dict(gateway)
 
     def _initialize_gateway_data(self):
         """初始化网关数据结构"""
-        debug_print("初始化新的网关数据结构")
+        log_debug("初始化新的网关数据结构")
         data = {'gateways': {}}
-        
-        # 读取并初始化主网关
-        if Path(self.main_gateway_file).exists():
-            with open(self.main_gateway_file, 'r') as f:
-                for line in f:
-                    url = line.strip()
-                    if url:
-                        data['gateways'][url] = self._create_gateway_entry(url, is_main=True)
-            debug_print(f"已初始化 {len(data['gateways'])} 个主网关")
-        
-        # 读取并初始化侧网关
-        if Path(self.side_gateway_file).exists():
-            with open(self.side_gateway_file, 'r') as f:
-                count_before = len(data['gateways'])
-                for line in f:
-                    url = line.strip()
-                    if url and url not in data['gateways']:
-                        data['gateways'][url] = self._create_gateway_entry(url, is_main=False)
-            debug_print(f"已初始化 {len(data['gateways']) - count_before} 个侧网关")
-        
+        self._merge_gateway_lists(data['gateways'])
+        main_count = sum(1 for gateway in data['gateways'].values() if gateway['is_main'])
+        log_info("已初始化 %d 个主网关", main_count)
+        log_info("已初始化 %d 个侧网关", len(data['gateways']) - main_count)
         return data
 
+    def _merge_gateway_lists(self, gateways):
+        """读取主、侧网关列表（规范化、去重、合并同一后端的别名）并增量合并到 gateways
+
+        返回 (changed, removed)，见 ipfs_gateway_ingest.merge_gateway_lists。
+        """
+        entries, aliases = ingest_gateway_lists(self.main_gateway_file, self.side_gateway_file,
+                                                gateways)
+        return merge_gateway_lists(gateways, entries, aliases, self._create_gateway_entry)
+
     def _create_gateway_entry(self, url, is_main=False):
-        """创建新的网关条目"""
-        return {
-            'url': url,
-            'is_main': is_main,
-            'success_count': 0,              # 只统计206的成功次数
-            'test_count': 0,                 # 只统计有效的测试次数（排除200状态码）
-            'current_ema': 1.0,
-            'current_weight': 1.0,
-            'last_test_time': None,
-            'last_response_time': None,
-            'last_status_code': None,
-            'last_download_speed': None,     # 最后一次下载速度 (KB/s)
-            'avg_download_speed': 0,         # 平均下载速度
-            'download_speeds_history': [],   # 历史下载速度记录
-            # 历史数据相关字段
-            'total_attempts': 0,             # 总尝试次数（包括所有状态码）
-            'response_times_history': [],    # 存储最近N次响应时间
-            'success_history': [],           # 存储最近N次成功状态
-            'weight_history': [],            # 存储最近N次权重
-            # 'bayesian_prior': 1.0,           # 贝叶斯先验
-            # 'confidence': 1.0                # 置信度
-        }
+        """创建新的网关条目（字段及默认值见 ipfs_gateway_state.GATEWAY_FIELDS）"""
+        return GatewayState(url, is_main)
 
-    def test_single_gateway(self, url):
-        """测试单个网关的速度和状态"""
-        debug_print(f"开始测试网关: {url}")
-        if self.cid:
-            test_file = self.cid
-        else:
-            test_file = "QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn" # 默认用空文件夹
-            
-        full_url = f"{url.rstrip('/')}/ipfs/{test_file}"
-        debug_print(f"测试URL: {full_url}")
+    def _build_test_url(self, url, cid=None):
+        """构造网关的测试URL"""
+        test_file = cid or self.cid or DEFAULT_TEST_CID  # 默认用空文件夹
+        return f"{url.rstrip('/')}/ipfs/{test_file}"
+
+    def _build_probe_url(self, url, cid=None):
+        """构造探测使用的URL：块/CAR 模式改为 trustless 请求，路径模式在校验需要时改为请求原始块，
+        开启缓存破坏时附加随机查询参数"""
+        full_url = self._build_test_url(url, cid)
+        if self.probe_mode != 'path':
+            full_url = trustless_url(full_url, self.probe_mode)
+        elif self.verify_content and block_request(cid or self.cid or DEFAULT_TEST_CID):
+            full_url += '?format=raw'
+        return bust_url(full_url) if self.cache_bust else full_url
+
+    def _probe_verifier(self, cid=None):
+        """校验模式下为一次探测创建内容校验器，未开启校验或 CID 无法校验时返回 None"""
+        if not self.verify_content:
+            return None
+        return make_verifier(cid or self.cid or DEFAULT_TEST_CID)
+
+    def _probe_observers(self, cid=None):
+        """返回一次探测的 (内容校验器, 块流)：路径模式下只有校验器，块/CAR 模式下由块流统计块并校验"""
+        verifier = self._probe_verifier(cid)
+        if self.probe_mode == 'path':
+            return verifier, None
+        stream = probe_stream(self.probe_mode, cid or self.cid or DEFAULT_TEST_CID,
+                              verifier=verifier, verify=self.verify_content)
+        return None, stream
+
+    def get_probe_engine(self):
+        """获取（必要时创建）异步探测引擎"""
+        if self._probe_engine is None:
+            self._probe_engine = AsyncProbeEngine(max_concurrency=ASYNC_MAX_CONCURRENCY,
+                                                  pool_max_per_host=POOL_MAX_PER_HOST,
+                                                  pool_max_total=POOL_MAX_TOTAL,
+                                                  pool_idle_timeout=POOL_IDLE_TIMEOUT,
+                                                  resolver=self.resolver)
+        return self._probe_engine
+
+    def close(self):
+        """保存网关×CID 性能矩阵，释放探测引擎和存储后端等资源"""
+        self.save_cid_matrix()
+        if self._probe_engine is not None:
+            self._probe_engine.close()
+            self._probe_engine = None
+        self.store.close()
+        if self.history is not None:
+            self.history.close()
+
+    def test_single_gateway(self, url, cid=None):
+        """测试单个网关的速度和状态（curl 后端）"""
+        full_url = self._build_probe_url(url, cid)
+        log_debug("开始测试网关: %s 测试URL: %s", url, full_url)
+
+        # 主机名由共享的解析器解析（命中缓存时不再等待 DNS），解析失败时不启动 curl
+        parts = urlsplit(full_url)
+        try:
+            addresses = self.resolver.resolve(parts.hostname)
+        except DnsError as e:
+            log_debug("解析失败: %s (%s)", url, e.kind)
+            return dns_failure_result(e.kind)
         
-        # 准备 curl 命令
+        # 准备 curl 命令（-D - 把响应头输出到 stdout，位于 -w 的统计行之前）
+        verifier, stream = self._probe_observers(cid)
+        sink = stream.feed if stream is not None else verifier.update if verifier is not None else None
+        write_out = ('%{http_code} %{time_starttransfer} %{speed_download} %{size_download} '
+                     '%{time_namelookup} %{time_connect} %{time_appconnect} %{time_total}\n')
+        if sink is not None:
+            # 校验或块/CAR 模式：响应体紧跟响应头写到 stdout 边读边处理，统计行改写到 stderr（curl 7.63+）
+            write_out = '%{stderr}' + write_out
+            output_file = '-'
+        else:
+            output_file = 'NUL' if os.name == 'nt' else '/dev/null'
+        # 块/CAR 模式不带 Range 请求完整响应，按媒体类型协商
+        if stream is None:
+            request_args = ['--range', '0-1048576']
+        else:
+            request_args = ['-H', f'Accept: {stream.accept}']
         cmd_curl = [
-            'curl', '-L', 
-            '-w', '%{http_code} %{time_starttransfer} %{speed_download} %{size_download}\n',
-            '-o', 'NUL' if os.name == 'nt' else '/dev/null', 
+            'curl', '-L', '-D', '-',
+            '-w', write_out,
+            '-o', output_file,
             '-s', '--max-time', '15',
-            '--range', '0-1048576',
+            *request_args,
             full_url
         ]
-        debug_print(f"CURL命令: {' '.join(cmd_curl)}")
+        if not is_ip_literal(parts.hostname):
+            # --resolve 使用已解析的地址，curl 在这些地址之间自行做 Happy Eyeballs
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            resolve_to = ','.join(f"[{address}]" if ':' in address else address
+                                  for address in addresses)
+            cmd_curl[1:1] = ['--resolve', f"{parts.hostname}:{port}:{resolve_to}"]
+        if log_enabled(DEBUG):
+            log_debug("CURL命令: %s", ' '.join(cmd_curl))
 
         # 为 Windows 平台设置 subprocess 标志
         if os.name == 'nt':
@@ -162,51 +316,65 @@ class GatewaySpeedTest:
             creationflags = 0
 
         try:
-            result = subprocess.run(
-                cmd_curl, 
-                capture_output=True, 
-                text=True, 
-                timeout=15,
-                startupinfo=startupinfo,
-                creationflags=creationflags
-            )
-            output = result.stdout.strip()
-            debug_print(f"CURL输出: {output}")
+            start = time.monotonic()
+            if sink is None:
+                result = subprocess.run(
+                    cmd_curl, 
+                    capture_output=True, 
+                    text=True, 
+                    timeout=15,
+                    startupinfo=startupinfo,
+                    creationflags=creationflags
+                )
+                lines = result.stdout.strip().splitlines()
+                output = lines[-1].strip() if lines else ''
+                headers = self._parse_curl_headers(lines[:-1])
+            else:
+                # 与异步后端相同：最多读取请求范围的长度或块流的 max_bytes
+                limit = stream.max_bytes if stream is not None else 1048577
+                output, headers, complete = self._run_curl_streaming(cmd_curl, sink, limit,
+                                                                     startupinfo=startupinfo,
+                                                                     creationflags=creationflags)
+            log_debug("CURL输出: %s", output)
             
-            parts = output.split()
-            if len(parts) == 4:
-                http_code, time_starttransfer, speed_download, size_download = parts
+            fields = output.split()
+            if len(fields) == 8:
+                (http_code, time_starttransfer, speed_download, size_download,
+                 time_namelookup, time_connect, time_appconnect, time_total) = fields
                 http_code = int(http_code)
                 time_starttransfer = float(time_starttransfer)
                 speed_download = float(speed_download)
                 size_download = int(size_download)
-
-                # 确保响应时间不超过1500ms
-                response_time = min(time_starttransfer * 1000, 1500)
-
-                # 计算等效下载速度
-                effective_speed = size_download / time_starttransfer if time_starttransfer > 0 else 0
+                # curl 的各时间点都从请求开始累计：time_appconnect 为 TLS 握手完成的时间点，
+                # HTTP 网关为 0，此时建立连接的耗时就是 time_connect
+                time_namelookup = float(time_namelookup)
+                time_appconnect = float(time_appconnect)
+                time_tls = max(time_appconnect - float(time_connect), 0) if time_appconnect > 0 else 0
+                time_connect = max(float(time_connect), time_appconnect)
 
                 if size_download == 0:
-                    debug_print(f"下载大小为0: {url}")
-                    return {
-                        'response_time': 1500,
-                        'status_code': http_code,
-                        'speed': 0,
-                        'size': 0
-                    }
-
-                test_result = {
-                    'response_time': response_time,
-                    'status_code': http_code,
-                    'speed': effective_speed,
-                    'size': size_download
-                }
-                debug_print(f"测试完成: {url}", test_result)
+                    log_debug("下载大小为0: %s", url)
+
+                test_result = build_probe_result(http_code, time_starttransfer,
+                                                 size_download, time_connect,
+                                                 time_total=float(time_total),
+                                                 time_namelookup=time_namelookup,
+                                                 time_tls=time_tls)
+                if stream is not None:
+                    # 首块时间由本进程计时，包含启动 curl 的开销
+                    test_result.update(stream.finish(http_code, headers, start, complete=complete))
+                elif verifier is not None:
+                    integrity = verifier.finish(http_code, headers, size_download)
+                    if integrity is not None:
+                        test_result['integrity'] = integrity
+                headers = cache_headers(headers)
+                if headers:
+                    test_result['cache_headers'] = headers
+                log_debug("测试完成: %s", url, data=test_result)
                 return test_result
                 
             else:
-                debug_print(f"无效输出: {url}", {'output': output})
+                log_debug("无效输出: %s", url, data={'output': output})
                 return {
                     'response_time': 1500,
                     'status_code': 0,
@@ -215,7 +383,7 @@ class GatewaySpeedTest:
                 }
                 
         except subprocess.TimeoutExpired:
-            debug_print(f"测试超时: {url}")
+            log_debug("测试超时: %s", url)
             return {
                 'response_time': 1500,
                 'status_code': 0,
@@ -223,7 +391,7 @@ class GatewaySpeedTest:
                 'size': 0
             }
         except Exception as e:
-            debug_print(f"测试失败: {url}", {'error': str(e)}, prefix="[ERROR] ")
+            log_error("测试失败: %s", url, data={'error': str(e)})
             return {
                 'response_time': 1500,
                 'status_code': 0,
@@ -231,72 +399,459 @@ class GatewaySpeedTest:
                 'size': 0
             }
 
-    def run_speed_test(self, cid=None, cids=None, idx=0, epoch=0, max_workers=50):
-        """运行多线程速度测试（测试单个CID）"""
-        debug_print(f"开始批量测速，最大并发数: {max_workers}")
+    def run_speed_test(self, cid=None, cids=None, idx=0, epoch=0, max_workers=None, urls=None):
+        """运行速度测试（测试单个CID）
+
+        max_workers 为并发数：curl 后端为线程数，异步后端为同时进行的探测数。
+        urls 为要测试的网关（分片模式下为本分片的网关），默认测试全部网关。
+        """
+        if cid is not None:
+            self.cid = cid
+        if cids is None:
+            cids = [self.cid]
+        max_workers = self._resolve_max_workers(max_workers)
+        log_info("开始批量测速，后端: %s，最大并发数: %d", self.probe_backend, max_workers)
         results = []
         start_time = time.time()
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {
-                executor.submit(self.test_single_gateway, url): url 
-                for url in self.gateway_data['gateways']
+        urls = list(self.gateway_data['gateways']) if urls is None else list(urls)
+        completed = 0
+
+        jobs = [(url, self.cid) for url in urls]
+        # 结果在探测完成时已计入网关统计，这里只收集
+        for (url, _), test_result in self._iter_probe_results(jobs, max_workers):
+            completed += 1
+            results.append({
+                'url': url,
+                'result': test_result
+            })
+            log_debug("网关进度: %d/%d cid进度: %d/%d epoch: %d cid: %s 完成测试: %s",
+                      completed, len(urls), idx + 1, len(cids), epoch + 1, cid, url)
+
+        elapsed_time = time.time() - start_time
+        log_info("批量测速完成，耗时: %.2f秒，熔断中的网关: %d，累计跳过探测: %d",
+                 elapsed_time, self.breaker.open_count(), self.breaker.skipped)
+        self.save_gateway_data()
+        return results
+
+    def _resolve_max_workers(self, max_workers):
+        """根据后端确定默认并发数"""
+        if max_workers:
+            return max_workers
+        return CURL_MAX_WORKERS if self.probe_backend == 'curl' else ASYNC_MAX_CONCURRENCY
+
+    @staticmethod
+    def _parse_curl_headers(lines):
+        """解析 curl -D 输出的响应头行，跟随重定向时只保留最后一个响应的响应头（小写键）"""
+        headers = {}
+        for line in lines:
+            if line.startswith('HTTP/'):
+                headers = {}
+            elif ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def _run_curl_streaming(self, cmd_curl, sink, limit=None, **popen_kwargs):
+        """运行响应体写到 stdout 的 curl，返回 (统计行, 最后一个响应的响应头, 响应体是否完整)
+
+        stdout 中依次是各个响应（1xx、跟随的重定向、最终响应）的响应头和最终响应的响应体，
+        响应体按到达顺序逐块交给 sink(data)（校验器或块流），不在内存中保留整个响应体。
+        响应体达到 limit 字节或 sink 返回 False（如 CAR 格式错误）时停止读取并结束 curl，
+        与异步后端一致；此时 curl 来不及输出统计行，改用本进程的计时构造（见 _aborted_write_out）。
+        curl 正常退出（退出码为 0）且没有被提前结束时响应体是完整的。
+        """
+        start = time.monotonic()
+        process = subprocess.Popen(cmd_curl, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   **popen_kwargs)
+        timer = threading.Timer(15, process.kill)
+        timer.start()
+        head, header_lines, in_body = b'', [], False
+        size, first_body_at, aborted = 0, None, False
+        try:
+            while True:
+                data = process.stdout.read1(65536)
+                if not data:
+                    break
+                if not in_body:
+                    head += data
+                    while not in_body:
+                        end = head.find(b'\r\n\r\n')
+                        if end < 0:
+                            break
+                        block = head[:end].decode('latin-1').split('\r\n')
+                        head = head[end + 4:]
+                        header_lines.extend(block)
+                        in_body = self._is_final_head(block)
+                    if not in_body or not head:
+                        continue
+                    data, head = head, b''
+                if first_body_at is None:
+                    first_body_at = time.monotonic()
+                if limit is not None and size + len(data) >= limit:
+                    data, aborted = data[:limit - size], True
+                size += len(data)
+                if sink(data) is False:
+                    aborted = True
+                if aborted:
+                    process.kill()
+                    break
+            stderr = process.stderr.read()
+            process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+            process.stderr.close()
+        if aborted:
+            output = self._aborted_write_out(header_lines, start, first_body_at, size)
+        else:
+            lines = stderr.decode('latin-1').strip().splitlines()
+            output = lines[-1].strip() if lines else ''
+        complete = not aborted and process.returncode == 0
+        return output, self._parse_curl_headers(header_lines), complete
+
+    @staticmethod
+    def _aborted_write_out(header_lines, start, first_body_at, size):
+        """提前结束的 curl 的统计行（与 -w 的格式相同），建立连接的各阶段耗时未知，记为 0"""
+        http_code = 0
+        for line in header_lines:
+            fields = line.split(None, 2)
+            if line.startswith('HTTP/') and len(fields) > 1 and fields[1].isdigit():
+                http_code = int(fields[1])
+        total = time.monotonic() - start
+        starttransfer = first_body_at - start if first_body_at is not None else total
+        transfer = total - starttransfer
+        speed = size / transfer if transfer > 0 else 0.0
+        return f"{http_code} {starttransfer:.6f} {speed:.3f} {size} 0 0 0 {total:.6f}"
+
+    @classmethod
+    def _is_final_head(cls, block):
+        """该响应头块是否属于最终响应（不是 1xx 中间响应，也不是 curl 会跟随的重定向）"""
+        fields = block[0].split(None, 2) if block else []
+        if len(fields) < 2 or not fields[1].isdigit():
+            return True
+        status = int(fields[1])
+        if 100 <= status < 200:
+            return False
+        return not (300 <= status < 400 and 'location' in cls._parse_curl_headers(block))
+
+    def _iter_probe_results(self, jobs, max_workers, max_per_gateway=None):
+        """按完成顺序产出 ((url, cid), test_result)，根据后端选择线程池或异步引擎
+
+        jobs: (url, cid) 序列
+        max_per_gateway: 每个网关同时进行的最大探测数，None 表示不限制
+
+        每个结果在产出前已经计入网关统计：探测完成后直接在工作线程（curl 后端）或
+        探测任务（异步后端）中调用 update_gateway_stats，不再排队等调用方的循环逐个处理。
+
+        设置了轮次截止（round_deadline / round_target_fraction）时，超过截止时间或
+        完成比例达到目标后不再等待剩余探测，剩余的每个任务都以超时结果计入统计并产出，
+        因此本轮仍然覆盖全部任务。
+        """
+        jobs = list(jobs)
+        # 本轮探测开始前并行解析所有网关的主机名（已缓存的跳过）
+        self.prefetch_dns({url for url, _ in jobs})
+        applied = {}            # (url, cid) -> 已计入统计的结果
+        applied_lock = threading.Lock()
+
+        def _apply(job, test_result):
+            # 每个任务只计入一次：截止后才完成的探测与截止产生的超时结果以先到者为准
+            with applied_lock:
+                if job in applied:
+                    return applied[job]
+                applied[job] = test_result
+            self.classify_cache(job[0], job[1], test_result)
+            self.update_gateway_stats(job[0], test_result)
+            self.cid_stats.add(job[1], job[0], test_result)
+            self.cid_matrix.update(job[0], job[1], test_result)
+            if self.history is not None:
+                self.history.record(job[0], job[1], test_result)
+            return test_result
+
+        pending = set(jobs)
+        deadline = None
+        if self.round_deadline is not None:
+            deadline = time.monotonic() + self.round_deadline
+        target = len(jobs)
+        if self.round_target_fraction is not None and self.round_target_fraction < 1:
+            target = math.ceil(len(jobs) * self.round_target_fraction)
+
+        if self.probe_backend == 'curl':
+            results = self._iter_curl_results(jobs, max_workers, max_per_gateway, deadline, _apply)
+        else:
+            results = self._iter_async_results(jobs, max_workers, max_per_gateway, deadline, _apply)
+        try:
+            for job, test_result in results:
+                pending.discard(job)
+                yield job, test_result
+                if len(jobs) - len(pending) >= target:
+                    break
+        finally:
+            results.close()
+
+        if pending:
+            log_info("轮次截止: 已完成 %d/%d，其余 %d 个探测记为超时",
+                     len(jobs) - len(pending), len(jobs), len(pending), prefix="[DEADLINE] ")
+            # 按提交顺序产出，保持结果顺序稳定
+            for job in jobs:
+                if job in pending:
+                    yield job, _apply(job, deadline_result())
+
+    def prefetch_dns(self, urls):
+        """并行预解析网关的主机名，解析失败的主机名进入否定缓存，探测时直接以 dns_error 结束"""
+        stats = self.resolver.prefetch(urlsplit(url).hostname for url in urls)
+        if stats['failed'] or stats['pending']:
+            log_info("DNS 预解析: 成功 %d，失败 %d，未完成 %d",
+                     stats['resolved'], stats['failed'], stats['pending'])
+        return stats
+
+    def _iter_curl_results(self, jobs, max_workers, max_per_gateway, deadline, apply):
+        """curl 后端：线程池并发执行，结果在工作线程中计入统计，超过 deadline 后停止等待"""
+        gateway_slots = {}
+        if max_per_gateway:
+            gateway_slots = {url: threading.Semaphore(max_per_gateway) for url, _ in jobs}
+
+        def _probe_once(url, cid):
+            if not self.breaker.allow(url):
+                return apply((url, cid), skipped_result())
+            try:
+                test_result = self.test_single_gateway(url, cid)
+            except BaseException:
+                self.breaker.release(url)
+                raise
+            self.breaker.record(url, test_result)
+            return apply((url, cid), test_result)
+
+        def _probe(url, cid):
+            slot = gateway_slots.get(url)
+            if slot is None:
+                return _probe_once(url, cid)
+            with slot:
+                return _probe_once(url, cid)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        finished = False
+        try:
+            future_to_job = {
+                executor.submit(_probe, url, cid): (url, cid)
+                for url, cid in jobs
             }
-            
-            debug_print(f"提交了 {len(future_to_url)} 个测试任务")
-            completed = 0
-            
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                completed += 1
+            log_debug("提交了 %d 个测试任务", len(future_to_job))
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                for future in as_completed(future_to_job, timeout=timeout):
+                    job = future_to_job[future]
+                    try:
+                        yield job, future.result()
+                    except Exception as e:
+                        log_error("测试异常: %s - %s", job[0], e)
+                finished = True
+            except FutureTimeoutError:
+                pass
+        finally:
+            # 提前结束时不等待仍在运行的 curl 进程（它们的结果被丢弃），未开始的任务直接取消
+            executor.shutdown(wait=finished, cancel_futures=True)
+
+    def _iter_async_results(self, jobs, max_workers, max_per_gateway, deadline, apply):
+        """异步后端：在引擎的事件循环中并发探测，结果在探测任务中计入统计，超过 deadline 后取消剩余探测"""
+        engine = self.get_probe_engine()
+        probe_jobs = [((url, cid), self._build_probe_url(url, cid), url) for url, cid in jobs]
+        log_debug("提交了 %d 个测试任务", len(probe_jobs))
+
+        async def _probe(job, full_url):
+            url = job[0]
+            if not self.breaker.allow(url):
+                return apply(job, skipped_result())
+            verifier, stream = self._probe_observers(job[1])
+            try:
+                test_result = await engine.probe(full_url, verifier, stream)
+            except BaseException:
+                # 轮次截止取消或探测异常时没有结果可记录，释放可能正在进行的半开试探
+                self.breaker.release(url)
+                raise
+            self.breaker.record(url, test_result)
+            return apply(job, test_result)
+
+        agen = engine.probe_many(probe_jobs, max_concurrency=max_workers,
+                                 max_per_group=max_per_gateway, probe_func=_probe)
+        try:
+            while True:
                 try:
-                    test_result = future.result()
-                    self.update_gateway_stats(url, test_result)
-                    results.append({
-                        'url': url,
-                        'result': test_result
-                    })
-                    debug_print(f"网关进度: {completed}/{len(future_to_url)} cid进度: {idx+1}/{len(cids)} epoch: {epoch+1} cid: {cid} 完成测试: {url}")
-                except Exception as e:
-                    debug_print(f"测试异常: {url} - {str(e)}", prefix="[ERROR] ")
+                    if deadline is None:
+                        yield engine.run(agen.__anext__())
+                    else:
+                        yield engine.run(asyncio.wait_for(
+                            agen.__anext__(), max(deadline - time.monotonic(), 0)))
+                except (StopAsyncIteration, asyncio.TimeoutError):
+                    break
+        finally:
+            engine.run(agen.aclose())
+
+    def get_probe_scheduler(self):
+        """获取（必要时创建）调度模式使用的探测调度器"""
+        if self._scheduler is None:
+            self._scheduler = ProbeScheduler(self.gateway_data['gateways'], PROBE_BUDGET,
+                                             epsilon=EPSILON, strategy=SCHEDULER_STRATEGY,
+                                             w_min=W_MIN)
+        return self._scheduler
+
+    def run_scheduled_round(self, cids, budget=None, round_idx=0, max_workers=None):
+        """调度模式：按权重只探测本轮预算内的网关
+
+        调度器挑选 budget 个网关（默认 PROBE_BUDGET），每个网关测试一个CID（按轮次轮换），
+        update_gateway_stats 会按新权重安排其下次应测时间。
+        """
+        if not isinstance(cids, (list, tuple)):
+            cids = [cids]
+        scheduler = self.get_probe_scheduler()
+        max_workers = self._resolve_max_workers(max_workers)
+        with self.lock:
+            selected = scheduler.select(budget)
+        jobs = [(url, cids[(round_idx + i) % len(cids)]) for i, url in enumerate(selected)]
+        log_info("调度第 %d 轮: 选中 %d/%d 个网关，策略: %s", round_idx + 1, len(selected),
+                 len(self.gateway_data['gateways']), SCHEDULER_STRATEGY)
+
+        results = []
+        pending = set(selected)
+        start_time = time.time()
+        try:
+            for (url, cid), test_result in self._iter_probe_results(jobs, max_workers):
+                pending.discard(url)
+                results.append({
+                    'url': url,
+                    'cid': cid,
+                    'result': test_result
+                })
+        finally:
+            with self.lock:
+                scheduler.release(pending)
 
         elapsed_time = time.time() - start_time
-        debug_print(f"批量测速完成，耗时: {elapsed_time:.2f}秒")
+        log_info("调度第 %d 轮完成，耗时: %.2f秒", round_idx + 1, elapsed_time)
         self.save_gateway_data()
+        self.save_cid_matrix()
         return results
 
-    def test_cids(self, cids, epoch=0, max_workers=50):
-        """测试多个CID的网关性能"""
+    def test_cids(self, cids, epoch=0, max_workers=None, matrix=None):
+        """测试多个CID的网关性能
+
+        matrix 为 True 时（默认取 MATRIX_MODE）所有 网关×CID 的探测一次性提交，
+        否则逐个CID依次测试。
+        """
         if not isinstance(cids, (list, tuple)):
             cids = [cids]
+        if matrix is None:
+            matrix = MATRIX_MODE
             
-        debug_print(f"开始测试 {len(cids)} 个CID")
+        log_info("开始测试 %d 个CID", len(cids))
+        self.cid_stats.reset(cids)
         
-        for idx, cid in enumerate(cids):
-            debug_print(f"\n开始测试CID: {cid}")
-            self.cid = cid
-            
-            # 为每个CID创建单独的日志文件
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_file = self.log_dir / f"gateway_test_{cid}_{timestamp}.log"
-            
-            # 运行测速
-            results = self.run_speed_test(cid, cids, idx, epoch, max_workers)
-
-            # 获取测速结果
-            ranked_gateways = self.get_ranked_gateways()
-            
-            # 保存测试结果
-            self.save_test_results_log(ranked_gateways, log_file)
-            self.save_test_results_log(ranked_gateways) # 保存一个最新的到根目录
-            
-            # 打印当前CID的测试结果
-            self._print_test_results(ranked_gateways, cid)
+        if matrix:
+            self.run_matrix_test(cids, epoch, max_workers)
+        else:
+            for idx, cid in enumerate(cids):
+                log_info("开始测试CID: %s", cid)
+                self.cid = cid
+                
+                # 运行测速
+                results = self.run_speed_test(cid, cids, idx, epoch, max_workers)
+                self._finish_cid(cid)
             
         # 生成汇总报告
-        summary_file = self.log_dir / f"summary_report_{timestamp}.log"
-        self._generate_summary_report(cids, summary_file)
-        self._generate_summary_report(cids) # 保存一个最新的到根目录
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._generate_summary_report(cids, (
+            self.log_dir / f"summary_report_{timestamp}.log",
+            "summary_report_latest.log",    # 保存一个最新的到根目录
+        ))
+        self.save_cid_matrix()
+        self.prune_logs()
+
+    def prune_logs(self, retention_days=LOG_RETENTION_DAYS):
+        """清理探测历史中过期的段；retention_days 不为 None 时还删除 log_dir 中超过保留天数的测速日志
+
+        只删除本程序按时间戳命名的 gateway_test_*.log 和 summary_report_*.log（长期趋势由探测历史保存），
+        纳入版本控制的日志和目录中的其他文件都保留。
+        """
+        if self.history is not None:
+            self.history.prune()
+        if retention_days is None:
+            return
+        cutoff = time.time() - retention_days * 86400
+        tracked = self._tracked_files(self.log_dir)
+        for pattern in LOG_PRUNE_PATTERNS:
+            for path in self.log_dir.glob(pattern):
+                try:
+                    if (path.is_file() and path.resolve() not in tracked
+                            and path.stat().st_mtime < cutoff):
+                        path.unlink()
+                except OSError as e:
+                    log_error("清理日志文件失败: %s - %s", path, e)
+
+    @staticmethod
+    def _tracked_files(directory):
+        """目录中纳入 git 版本控制的文件（绝对路径），不在 git 仓库中或没有 git 时返回空集合"""
+        try:
+            result = subprocess.run(['git', 'ls-files', '-z', '--', '.'], cwd=directory,
+                                    capture_output=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return set()
+        if result.returncode != 0:
+            return set()
+        return {(Path(directory) / name).resolve()
+                for name in result.stdout.decode('utf-8', 'replace').split('\0') if name}
+
+    def _finish_cid(self, cid):
+        """单个CID测试完成后保存日志并打印结果"""
+        # 为每个CID创建单独的日志文件
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_file = self.log_dir / f"gateway_test_{cid}_{timestamp}.log"
+
+        # 获取测速结果
+        ranked_gateways = self.get_ranked_gateways()
+        
+        # 保存测试结果
+        self.save_test_results_log(ranked_gateways, log_file)
+        self.save_test_results_log(ranked_gateways) # 保存一个最新的到根目录
+        
+        # 打印当前CID的测试结果
+        self._print_test_results(ranked_gateways, cid)
+
+    def run_matrix_test(self, cids, epoch=0, max_workers=None,
+                        max_per_gateway=MAX_INFLIGHT_PER_GATEWAY):
+        """把 网关×CID 的全部探测提交到同一个并发池
+
+        每个结果完成后立即更新网关统计；某个CID的所有网关都完成后立即写出该CID的日志。
+        返回 {cid: [{'url': ..., 'result': ...}, ...]}。
+        """
+        max_workers = self._resolve_max_workers(max_workers)
+        urls = list(self.gateway_data['gateways'])
+        jobs = [(url, cid) for cid in cids for url in urls]
+        log_info("开始矩阵测速: %d 个网关 × %d 个CID，后端: %s，最大并发数: %d，单网关并发: %d",
+                 len(urls), len(cids), self.probe_backend, max_workers, max_per_gateway)
+
+        results = {cid: [] for cid in cids}
+        remaining = {cid: len(urls) for cid in cids}
+        completed = 0
+        start_time = time.time()
+
+        for (url, cid), test_result in self._iter_probe_results(jobs, max_workers, max_per_gateway):
+            completed += 1
+            results[cid].append({
+                'url': url,
+                'result': test_result
+            })
+            log_debug("矩阵进度: %d/%d epoch: %d cid: %s 完成测试: %s",
+                      completed, len(jobs), epoch + 1, cid, url)
+
+            remaining[cid] -= 1
+            if remaining[cid] == 0:
+                log_info("CID %s 的所有网关已完成测试", cid)
+                self.save_gateway_data()
+                self._finish_cid(cid)
+
+        elapsed_time = time.time() - start_time
+        log_info("矩阵测速完成，耗时: %.2f秒，熔断中的网关: %d，累计跳过探测: %d",
+                 elapsed_time, self.breaker.open_count(), self.breaker.skipped)
+        return results
 
     def _print_test_results(self, ranked_gateways, cid):
         """打印单个CID的测试结果"""
@@ -351,140 +906,105 @@ class GatewaySpeedTest:
                 )
                 print(row)
             except Exception as e:
-                debug_print(f"打印网关数据时出错: {gateway.get('url', 'Unknown')} - {str(e)}", prefix="[ERROR] ")
+                log_error("打印网关数据时出错: %s - %s", gateway.get('url', 'Unknown'), e)
 
-    def _generate_summary_report(self, cids, summary_file="summary_report_latest.log"):
-        """生成测试汇总报告"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
+    def _generate_summary_report(self, cids, summary_files=("summary_report_latest.log",),
+                                 formats=None):
+        """生成测试汇总报告
+
+        报告由本轮累加的各CID汇总和一次排名结果生成，不再扫描和读回日志文件；
+        渲染一次后写入 summary_files 中的每个文件。formats 默认取 SUMMARY_FORMATS，
+        'json' / 'csv' 另存为同名的 .json / .csv 文件。
+        """
+        formats = formats or SUMMARY_FORMATS
         try:
-            with open(summary_file, 'w', encoding='utf-8') as f:
-                f.write("=== IPFS网关测试汇总报告 ===\n\n")
-                f.write(f"测试时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"测试的CID数量: {len(cids)}\n\n")
-                
-                # 获取所有网关的排名
-                ranked_gateways = self.get_ranked_gateways()
-                
-                f.write("\n=== 性能最佳的网关 (Top 20) ===\n")
-                f.write("-" * 120 + "\n")
-                f.write(f"{'网关URL':<49} {'权重':<6} {'成功率':<5} {'响应时间':<7} {'平均速度':<8} {'最大速度':<9} {'不稳定性':<8}\n")
-                f.write("-" * 120 + "\n")
-                
-                for gw in ranked_gateways[:20]:
-                    success_rate = f"{gw['success_rate']:.2%}" if gw['test_count'] > 0 else "N/A"
-                    f.write(
-                        f"{gw['url']:<50} "
-                        f"{gw['weight']:<8.3f} "
-                        f"{success_rate:<8} "
-                        f"{gw['last_response_time']:<10.1f} "
-                        f"{gw['avg_download_speed']:<12.1f} "
-                        f"{gw['max_download_speed']:<12.1f} "
-                        f"{gw['speed_stability']:<8.2f}\n"
-                    )
-                
-                f.write("\n=== 各CID详细测试结果 ===\n")
-                for cid in cids:
-                    f.write(f"\nCID: {cid}\n")
-                    f.write("-" * 50 + "\n")
-                    
-                    # 获取该CID最新的日志文件
-                    log_files = list(self.log_dir.glob(f"gateway_test_{cid}_*.log"))
-                    if log_files:
-                        latest_log = max(log_files, key=lambda x: x.stat().st_mtime)
-                        with open(latest_log, 'r', encoding='utf-8') as log:
-                            stats_section = False
-                            for line in log:
-                                if line.strip() == "统计信息:":
-                                    stats_section = True
-                                elif stats_section and line.strip():
-                                    f.write(line)
-                
-                f.write("\n\n=== 网关性能分析 ===\n")
-                
-                # 计算整体统计信息
-                active_gateways = [gw for gw in ranked_gateways if gw['test_count'] > 0]
-                total_gateways = len(ranked_gateways)
-                active_count = len(active_gateways)
-                
-                f.write(f"\n总网关数量: {total_gateways}")
-                f.write(f"\n活跃网关数量: {active_count}")
-                
-                if active_count > 0:
-                    # 速度统计
-                    avg_speeds = [gw['avg_download_speed'] for gw in active_gateways if gw['avg_download_speed'] > 0]
-                    if avg_speeds:
-                        f.write(f"\n平均下载速度: {sum(avg_speeds) / len(avg_speeds):.2f} KB/s")
-                        f.write(f"\n最高下载速度: {max(gw['max_download_speed'] for gw in active_gateways):.2f} KB/s")
-                    
-                    # 响应时间统计
-                    response_times = [gw['last_response_time'] for gw in active_gateways]
-                    f.write(f"\n平均响应时间: {sum(response_times) / len(response_times):.2f} ms")
-                    f.write(f"\n最快响应时间: {min(response_times):.2f} ms")
-                    
-                    # 成功率统计
-                    success_rates = [gw['success_rate'] for gw in active_gateways]
-                    avg_success_rate = sum(success_rates) / len(success_rates)
-                    f.write(f"\n平均成功率: {avg_success_rate:.2%}")
-                
-                f.write("\n\n=== 速度分布统计 ===\n")
-                speed_ranges = {
-                    '极快 (>1000KB/s)': lambda s: s > 1000,
-                    '快速 (500-1000KB/s)': lambda s: 500 <= s <= 1000,
-                    '中等 (200-500KB/s)': lambda s: 200 <= s < 500,
-                    '慢速 (50-200KB/s)': lambda s: 50 <= s < 200,
-                    '极慢 (<50KB/s)': lambda s: s < 50
-                }
-                
-                for range_name, range_func in speed_ranges.items():
-                    count = sum(1 for gw in active_gateways if range_func(gw['avg_download_speed']))
-                    if active_count > 0:
-                        percentage = (count / active_count) * 100
-                        f.write(f"\n{range_name}: {count} 个网关 ({percentage:.1f}%)")
-                
-            debug_print(f"汇总报告已保存到: {summary_file}")
+            data = summary_data(cids, self.cid_stats, self.get_ranked_gateways())
+            for fmt in formats:
+                content = RENDERERS[fmt](data)
+                for summary_file in summary_files:
+                    path = Path(summary_file)
+                    if fmt != 'text':
+                        path = path.with_suffix(f'.{fmt}')
+                    with open(path, 'w', encoding='utf-8', newline='') as f:
+                        f.write(content)
+                    log_info("汇总报告已保存到: %s", path)
         except Exception as e:
-            debug_print(f"生成汇总报告失败: {str(e)}", prefix="[ERROR] ")
+            log_error("生成汇总报告失败: %s", e)
 
     def calculate_gamma_time(self, response_time):
         """计算响应时间惩罚参数 γ_time"""
         k = -math.log(BASE_LN)
         gamma_time = math.exp(-k * response_time / 1500)
-        debug_print(f"计算gamma: response_time={response_time}, k={k}, gamma_time={gamma_time}")
+        log_debug("计算gamma: response_time=%s, k=%s, gamma_time=%s", response_time, k, gamma_time)
         return gamma_time
 
     def calculate_gamma_speed(self, speed):
         """计算下载速度惩罚参数 γ_speed"""
         k = 1 / k_speed - 1
         gamma_speed = 1 / (1 + k * math.exp(-speed / 1024))
-        debug_print(f"计算gamma: speed={speed}, k={k}, gamma_speed={gamma_speed}")
+        log_debug("计算gamma: speed=%s, k=%s, gamma_speed=%s", speed, k, gamma_speed)
         return gamma_speed
 
+    def calculate_gamma_integrity(self, mismatch_ema):
+        """计算内容校验惩罚参数 γ_integrity，从未校验失败的网关为 1"""
+        return math.pow(1 - mismatch_ema, INTEGRITY_PENALTY)
+
+    def classify_cache(self, url, cid, test_result):
+        """判定一次探测是冷请求还是命中缓存的热请求，写入 test_result['cache'] / ['cache_reason']
+
+        首字节时间特征以该网关冷请求的首字节时间 EMA 为基准。返回 'cold' / 'warm'，
+        熔断跳过和轮次截止的结果返回 None（只计入全局统计）。
+        """
+        gateway = self.gateway_data['gateways'].get(url)
+        if gateway is None:
+            return None
+        with self.state_locks.lock_for(url):
+            cold_ttfb = gateway['cache_scores']['cold']['ttfb']
+        cache, reason = self.cache_classifier.classify(url, cid, test_result, cold_ttfb=cold_ttfb,
+                                                       busted=self.cache_bust)
+        if cache is not None:
+            test_result['cache'] = cache
+            test_result['cache_reason'] = reason
+        return cache
+
     def update_gateway_stats(self, url, test_result):
-        """更新网关统计信息"""
+        """更新网关统计信息
+
+        可以在多个工作线程/探测任务中并发调用：网关字段在该网关的条带锁内原地更新，
+        只有同步排名索引和调度器的几步索引操作需要短暂持有 self.lock。
+        """
+        with self.state_locks.lock_for(url):
+            self._update_gateway_stats(url, test_result)
+
+    def _update_gateway_stats(self, url, test_result):
+        """更新网关统计信息（调用方需持有该网关的条带锁）"""
         try:
             # 1. 初始化和数据准备
-            debug_print(f"更新网关统计: {url}")
-            debug_print("测试结果:", test_result)
-            
+            log_debug("更新网关统计: %s", url, data=test_result)
+            # 抽中的探测以 INFO 级别输出完整追踪，其余探测只在 DEBUG 级别输出
+            trace = should_trace(self.trace_sample_rate)
+            verbose = trace or log_enabled(DEBUG)
+
             gateway = self.gateway_data['gateways'][url]
-            gateway = self.ensure_gateway_fields(gateway)
-            self.gateway_data['gateways'][url] = gateway
 
             status_code = test_result['status_code']
             response_time = min(test_result['response_time'], 1500)  # 限制最大响应时间
             download_speed = test_result['speed'] / 1024  # 转换为 KB/s
+            # 参与评分的响应时间和速度：只对服务器处理时间评分时扣除建立连接和TLS握手的耗时，
+            # 块/CAR 模式用首块时间和块吞吐量（与冷/热缓存得分和网关×CID 矩阵相同）
+            sample = score_sample(test_result, self.score_server_time)
+            scored_time, scored_speed = sample.response_time, sample.speed
             
             # 记录更新前状态
-            old_stats = {
-                'ema': gateway['current_ema'],
-                'weight': gateway['current_weight'],
-                'success_count': gateway['success_count'],
-                'test_count': gateway['test_count'],
-                'total_attempts': gateway['total_attempts'],
-                'avg_download_speed': gateway['avg_download_speed']
-            }
-            debug_print("更新前状态:", old_stats)
+            if verbose:
+                old_stats = {
+                    'ema': gateway['current_ema'],
+                    'weight': gateway['current_weight'],
+                    'success_count': gateway['success_count'],
+                    'test_count': gateway['test_count'],
+                    'total_attempts': gateway['total_attempts'],
+                    'avg_download_speed': gateway['avg_download_speed']
+                }
             
             # 2. 更新基础统计信息
             gateway['total_attempts'] += 1
@@ -492,6 +1012,11 @@ class GatewaySpeedTest:
             gateway['last_response_time'] = response_time
             gateway['last_status_code'] = status_code
             gateway['last_download_speed'] = download_speed
+            gateway['last_connect_time'] = test_result.get('connect_time')
+            if not test_result.get('skipped'):
+                # 熔断跳过的探测没有解析主机名，保留上次的解析结果
+                gateway['last_dns_error'] = test_result.get('dns_error')
+                gateway['last_integrity'] = test_result.get('integrity')
             
             # 3. 更新下载速度统计
             gateway['download_speeds_history'].append(download_speed)
@@ -502,11 +1027,25 @@ class GatewaySpeedTest:
             valid_speeds = [s for s in gateway['download_speeds_history'] if s > 0]
             gateway['avg_download_speed'] = sum(valid_speeds) / len(valid_speeds) if valid_speeds else 0
             
+            # 记录分阶段耗时（熔断跳过和轮次截止的结果没有实测数据）
+            if 'ttfb' in test_result:
+                self._record_phases(gateway, test_result)
+
+            # 冷/热请求分别计分（见 classify_cache），全局 EMA 和权重仍合并计算
+            cache = test_result.get('cache')
+            if cache is not None:
+                update_cache_score(gateway['cache_scores'][cache], test_result, ALPHA, self.pair_weight)
+            # 块/CAR 模式的首块时间和块吞吐量单独记录（见 ipfs_gateway_trustless）
+            if 'blocks' in test_result:
+                update_block_stats(gateway['block_stats'], test_result, ALPHA)
+
             # 4. 更新测试计数和状态
             gateway['test_count'] += 1
-            current_success = 1 if status_code == 206 else 0
+            # 内容校验不一致的 206 不计为成功（见 ipfs_gateway_verify.probe_success）
+            current_success = sample.success
             if current_success:
                 gateway['success_count'] += 1
+            gateway['success_history'] = gateway['success_history'][-(N - 1):] + [current_success]
 
             #########################################################
             #########################算法部分#########################
@@ -519,42 +1058,126 @@ class GatewaySpeedTest:
             
             ## 5.2 计算惩罚项
             ## 5.2.1 计算响应时间惩罚
-            gamma_time = self.calculate_gamma_time(response_time)
+            gamma_time = self.calculate_gamma_time(scored_time)
             ## 5.2.2 计算下载速度惩罚
-            gamma_speed = self.calculate_gamma_speed(download_speed)
+            gamma_speed = self.calculate_gamma_speed(scored_speed)
+            ## 5.2.3 计算内容校验惩罚（只有完成校验的探测更新不一致率）
+            integrity = test_result.get('integrity')
+            if integrity in ('ok', 'mismatch'):
+                mismatch = 1 if integrity == 'mismatch' else 0
+                gateway['mismatch_ema'] = ALPHA * mismatch + (1 - ALPHA) * gateway['mismatch_ema']
+                if mismatch:
+                    gateway['integrity_failures'] += 1
+                    log_warning("内容校验失败: %s 返回的内容与 CID 不符", url)
+            gamma_integrity = self.calculate_gamma_integrity(gateway['mismatch_ema'])
 
             ## 5.3 计算最终权重
             base_weight = math.pow(new_ema, BETA)                                   # EMA加权
-            final_weight = max(base_weight * gamma_time * gamma_speed, W_MIN)       # 应用惩罚项并确保最小权重
+            final_weight = max(base_weight * gamma_time * gamma_speed * gamma_integrity,
+                               W_MIN)                                               # 应用惩罚项并确保最小权重
             gateway['current_weight'] = final_weight
             #########################################################
             
 
             # 更新权重历史
             gateway['weight_history'] = gateway.get('weight_history', [])[-9:] + [final_weight]
+
+            # 同步到排名索引和加权选择器（仍持有网关锁，同一网关按更新顺序同步）
+            with self.lock:
+                self.rank_index.update(url, final_weight)
+                # 调度模式下按新权重安排下次应测时间
+                if self._scheduler is not None:
+                    self._scheduler.record(url, gateway)
+            self.selector.update(url, final_weight, gateway['is_main'])
+
+            # 写入存储后端（JSON 后端在 save_gateway_data 时统一写入）
+            self.store.put(url, gateway)
             
             # 6. 记录详细的更新结果
-            debug_print("更新后状态:", {
-                'ema': new_ema,
-                'gamma_time': gamma_time,
-                'gamma_speed': gamma_speed,
-                'base_weight': base_weight,
-                'final_weight': final_weight,
-                'success_count': gateway['success_count'],
-                'test_count': gateway['test_count'],
-                'total_attempts': gateway['total_attempts'],
-                'avg_download_speed': gateway['avg_download_speed']
-            })
-            
+            if verbose:
+                new_stats = {
+                    'ema': new_ema,
+                    'gamma_time': gamma_time,
+                    'gamma_speed': gamma_speed,
+                    'gamma_integrity': gamma_integrity,
+                    'base_weight': base_weight,
+                    'final_weight': final_weight,
+                    'success_count': gateway['success_count'],
+                    'test_count': gateway['test_count'],
+                    'total_attempts': gateway['total_attempts'],
+                    'avg_download_speed': gateway['avg_download_speed']
+                }
+                if trace:
+                    log_info("探测追踪: %s", url, prefix="[TRACE] ", data={
+                        'result': test_result, 'before': old_stats, 'after': new_stats})
+                else:
+                    log_debug("更新前状态: %s", url, data=old_stats)
+                    log_debug("更新后状态: %s", url, data=new_stats)
+
         except Exception as e:
-            debug_print(f"更新网关统计时出错: {str(e)}", prefix="[ERROR] ")
-            # 确保即使出错也不会丢失网关数据
-            if url in self.gateway_data['gateways']:
-                self.gateway_data['gateways'][url] = self._create_gateway_entry(
-                    url, is_main=self.gateway_data['gateways'][url].get('is_main', False))
-
-    def get_ranked_gateways(self):
-        """获取按权重排序的网关列表"""
+            log_error("更新网关统计时出错: %s", e)
+            # 确保即使出错也不会丢失网关数据：原地恢复为默认状态
+            gateway = self.gateway_data['gateways'].get(url)
+            if gateway is not None:
+                gateway.reset()
+                with self.lock:
+                    self.rank_index.update(url, gateway['current_weight'])
+                self.selector.update(url, gateway['current_weight'])
+
+    def _record_phases(self, gateway, test_result):
+        """把一次探测的分阶段耗时追加到网关的历史中（每个阶段最多 PHASE_HISTORY_SIZE 条）
+
+        复用连接时没有 DNS/TCP/TLS 阶段，只在新建连接时记录；没有收到响应时不记录首字节时间，
+        没有下载数据时不记录传输时间，避免把缺失值当作 0 拉低百分位。
+        """
+        history = gateway['phase_history']
+        recorded = []
+        if test_result.get('connect_time'):
+            recorded += ['dns', 'tcp', 'tls']
+        if test_result['status_code']:
+            recorded.append('ttfb')
+        if test_result.get('size'):
+            recorded.append('transfer')
+        for phase in recorded:
+            values = history.setdefault(phase, [])
+            values.append(test_result[PHASES[phase]])
+            if len(values) > PHASE_HISTORY_SIZE:
+                del values[:-PHASE_HISTORY_SIZE]
+
+    def phase_percentiles(self, url):
+        """返回网关各阶段耗时的 {阶段: (p50, p95)}，没有记录的阶段为 (None, None)"""
+        with self.state_locks.lock_for(url):
+            history = self.gateway_data['gateways'][url].get('phase_history') or {}
+            history = {phase: list(values) for phase, values in history.items()}
+        return {
+            phase: (percentile(history.get(phase), 50), percentile(history.get(phase), 95))
+            for phase in PHASES
+        }
+
+    def get_ranked_gateways(self, limit=None):
+        """获取按权重排序的网关列表，limit 指定时只返回前 limit 个"""
+        # 排名顺序直接取自增量维护的排名索引，不再整体排序
+        with self.lock:
+            if limit is None:
+                ranked_urls = [url for url, _ in self.rank_index.iter_ranked()]
+            else:
+                ranked_urls = [url for url, _ in self.rank_index.top(limit)]
+        # 在锁外逐个取网关快照（快照需要网关的条带锁，不能在持有 self.lock 时获取）
+        ranked_gateways = self._rank_gateway_dicts(ranked_urls)
+        
+        # 添加调试信息
+        if log_enabled(DEBUG):
+            log_debug("网关排名和速度信息:")
+            for gw in ranked_gateways[:5]:  # 只显示前5个网关的信息
+                log_debug("URL: %s\n  最新速度: %.2f KB/s\n  平均速度: %.2f KB/s\n  最大速度: %.2f KB/s\n"
+                          "  近期平均: %.2f KB/s\n  速度稳定性: %.2f",
+                          gw['url'], gw['last_download_speed'], gw['avg_download_speed'],
+                          gw['max_download_speed'], gw['recent_avg_speed'], gw['speed_stability'])
+        
+        return ranked_gateways
+
+    def _rank_gateway_dicts(self, ranked_urls):
+        """按字典逐个计算排名字段，ranked_urls 为已排序的网关"""
         ranked_gateways = [
             {
                 'url': url,
@@ -575,7 +1198,7 @@ class GatewaySpeedTest:
                 # 添加最大下载速度
                 'max_download_speed': max(data.get('download_speeds_history', [0])) if data.get('download_speeds_history') else 0
             }
-            for url, data in self.gateway_data['gateways'].items()
+            for url, data in ((url, self.gateway_snapshot(url)) for url in ranked_urls)
         ]
         
         # 使用 get 方法安全地访问字段，并提供默认值
@@ -594,34 +1217,117 @@ class GatewaySpeedTest:
             else:
                 gateway['speed_stability'] = 0
         
-        # 按权重降序排序
-        ranked_gateways.sort(key=lambda x: x['weight'], reverse=True)
-        
-        # 添加调试信息
-        debug_print("网关排名和速度信息:")
-        for gw in ranked_gateways[:5]:  # 只显示前5个网关的信息
-            debug_print(f"URL: {gw['url']}")
-            debug_print(f"  最新速度: {gw['last_download_speed']:.2f} KB/s")
-            debug_print(f"  平均速度: {gw['avg_download_speed']:.2f} KB/s")
-            debug_print(f"  最大速度: {gw['max_download_speed']:.2f} KB/s")
-            debug_print(f"  近期平均: {gw['recent_avg_speed']:.2f} KB/s")
-            debug_print(f"  速度稳定性: {gw['speed_stability']:.2f}")
-        
         return ranked_gateways
 
+    def top_gateways(self, k=20):
+        """返回权重最高的 k 个网关 [(url, weight), ...]"""
+        with self.lock:
+            return self.rank_index.top(k)
+
+    def gateway_rank(self, url):
+        """返回网关的当前名次（0 表示权重最高）"""
+        with self.lock:
+            return self.rank_index.rank(url)
+
+    def weight_percentile(self, url):
+        """返回网关权重的百分位（权重不高于它的网关所占比例）"""
+        with self.lock:
+            return self.rank_index.percentile(url)
+
+    def gateway_snapshot(self, url):
+        """返回单个网关状态的一致快照（普通字典），网关不存在时返回 None"""
+        gateway = self.gateway_data['gateways'].get(url)
+        if gateway is None:
+            return None
+        with self.state_locks.lock_for(url):
+            return gateway.to_dict()
+
+    def snapshot_gateways(self):
+        """返回全部网关的快照 {url: 字典}，每个网关在其条带锁内复制，用于保存和导出"""
+        return {url: self.gateway_snapshot(url) for url in list(self.gateway_data['gateways'])}
+
+    def pair_weight(self, ema, response_time, speed_kb):
+        """网关×CID 组合的权重，公式与全局权重相同：max(EMA^β·γ_time·γ_speed, W_MIN)"""
+        return max(math.pow(ema, BETA) * self.calculate_gamma_time(response_time)
+                   * self.calculate_gamma_speed(speed_kb), W_MIN)
+
+    def best_gateways_for_cid(self, cid, k=10, main_only=False):
+        """该 CID 表现最好的 k 个网关 [(url, 得分, 来源), ...]
+
+        来源为 'pair' 时得分来自该 (网关, CID) 组合自身的统计（按测试次数向全局权重收缩），
+        为 'global' 时该组合没有数据，使用网关的全局权重。
+        """
+        gateways = self.gateway_data['gateways']
+        accept = (lambda url: gateways[url]['is_main']) if main_only else None
+        with self.lock:
+            return self.cid_matrix.best(cid, k, self.rank_index.iter_ranked(),
+                                        self.rank_index.weight, accept)
+
+    def pick_gateway(self, exclude=(), main_only=False):
+        """按权重随机选取一个网关（别名法，O(1)），exclude 为要排除的网关"""
+        return self.selector.pick(exclude=exclude, main_only=main_only)
+
+    def download_cid(self, cid, output_path, k=FETCH_TOP_K, main_only=False):
+        """从该 CID 得分最高的 k 个网关（见 best_gateways_for_cid）并行下载 cid 到 output_path，返回下载摘要
+
+        每个分块的下载结果都会通过 update_gateway_stats 计入网关统计，并计入网关×CID 矩阵。
+        """
+        # 按该 CID 的网关×CID 得分选源，没有数据的网关按全局权重
+        sources = [(url, self._build_test_url(url, cid))
+                   for url, _, _ in self.best_gateways_for_cid(cid, k, main_only)]
+        log_info("多源下载 %s: 使用 %d 个网关", cid, len(sources), prefix="[FETCH] ")
+
+        def _on_result(url, test_result):
+            self.update_gateway_stats(url, test_result)
+            self.cid_matrix.update(url, cid, test_result)
+            if self.history is not None:
+                self.history.record(url, cid, test_result)
+
+        fetcher = MultiSourceFetcher(self.get_probe_engine(), sources, on_result=_on_result)
+        summary = self.get_probe_engine().run(fetcher.fetch(output_path))
+        summary['cid'] = cid
+        self.save_gateway_data()
+
+        if summary['complete']:
+            log_info("下载完成: %s %d 字节, %.2f 秒, %.2f KB/s, 再平衡 %d 次, 对冲 %d 次",
+                     summary['path'], summary['size'], summary['elapsed'], summary['throughput'] / 1024,
+                     summary['rebalances'], summary['hedges'], prefix="[FETCH] ")
+        else:
+            log_error("下载失败: %s，没有可用的网关", cid)
+        return summary
+
     def save_gateway_data(self):
-        """保存网关数据到JSON文件"""
+        """保存网关数据
+
+        网关条目在加载和创建时已补全字段，这里把各网关的一致快照交给存储后端：
+        JSON 后端整文件原子写入；SQLite/追加日志后端的每次更新已经写入，这里只做检查点/压缩。
+        """
         try:
-            # 保存前确保所有网关的数据结构都是完整的
-            updated_data = {'gateways': {}}
-            for url, gateway in self.gateway_data['gateways'].items():
-                updated_data['gateways'][url] = self.ensure_gateway_fields(gateway)
-                
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(updated_data, f, indent=2)
-            debug_print(f"已保存数据到 {self.data_file}")
+            self.store.flush(self.snapshot_gateways)
+            log_info("已保存数据到 %s", self.data_file)
         except Exception as e:
-            debug_print(f"保存数据失败: {str(e)}", prefix="[ERROR] ")
+            log_error("保存数据失败: %s", e)
+
+    def save_cid_matrix(self):
+        """保存网关×CID 性能矩阵
+
+        矩阵文件是整文件写入，只在一轮测速（test_cids / 调度的一轮）结束和 close() 时保存，
+        不随每个 CID 的 save_gateway_data 重写。
+        """
+        if not self.cid_matrix_file:
+            return
+        try:
+            self.cid_matrix.save(self.cid_matrix_file)
+        except Exception as e:
+            log_error("保存网关×CID 性能矩阵失败: %s", e)
+
+    def export_gateway_data(self, path=DEFAULT_STATE_FILES['json']):
+        """按原有 JSON 格式导出全部网关数据"""
+        try:
+            self.store.export_json(path, self.snapshot_gateways())
+            log_info("已导出数据到 %s", path)
+        except Exception as e:
+            log_error("导出数据失败: %s", e)
 
     def save_test_results_log(self, ranked_gateways, log_file='gateway_test_results_latest.log'):
         """保存测试结果到日志文件"""
@@ -679,8 +1385,54 @@ class GatewaySpeedTest:
                         )
                         f.write(row + '\n')
                     except Exception as e:
-                        debug_print(f"写入网关数据时出错: {gateway.get('url', 'Unknown')} - {str(e)}", prefix="[ERROR] ")
+                        log_error("写入网关数据时出错: %s - %s", gateway.get('url', 'Unknown'), e)
                 
+                # 写入分阶段耗时：区分慢在我们的网络路径 (DNS/TCP/TLS) 还是网关的检索 (首字节/传输)
+                f.write("\n分阶段耗时 p50/p95 (ms):\n")
+                f.write(f"{'网关URL':<46} " + " ".join(f"{phase:>15}" for phase in PHASES) + '\n')
+                for gateway in ranked_gateways:
+                    url = gateway.get('url')
+                    if url not in self.gateway_data['gateways']:
+                        continue
+                    cells = []
+                    for p50, p95 in self.phase_percentiles(url).values():
+                        cells.append(f"{p50:.0f}/{p95:.0f}" if p50 is not None else "N/A")
+                    f.write(f"{url:<50} " + " ".join(f"{cell:>15}" for cell in cells) + '\n')
+
+                # 写入冷/热请求分别的得分：冷请求反映网关从 IPFS 网络检索的能力，热请求反映其 HTTP 缓存
+                f.write("\n冷/热请求得分 (权重 / 首字节时间 ms / 测试次数):\n")
+                f.write(f"{'网关URL':<46} {'冷请求':>24} {'热请求':>24}\n")
+                for gateway in ranked_gateways:
+                    url = gateway.get('url')
+                    snapshot = self.gateway_snapshot(url)
+                    if snapshot is None:
+                        continue
+                    cells = []
+                    for cache in ('cold', 'warm'):
+                        score = snapshot['cache_scores'][cache]
+                        if score['tests']:
+                            ttfb = f"{score['ttfb']:.0f}" if score['ttfb'] is not None else "N/A"
+                            cells.append(f"{score['weight']:.3f} / {ttfb} / {score['tests']}")
+                        else:
+                            cells.append("N/A")
+                    f.write(f"{url:<50} " + " ".join(f"{cell:>27}" for cell in cells) + '\n')
+
+                # 写入块/CAR 模式的指标：trustless 客户端关心的首块时间和块吞吐量
+                block_rows = []
+                for gateway in ranked_gateways:
+                    snapshot = self.gateway_snapshot(gateway.get('url'))
+                    if snapshot is not None and snapshot['block_stats']['tests']:
+                        block_rows.append((snapshot['url'], snapshot['block_stats']))
+                if block_rows:
+                    f.write("\n块/CAR 模式指标:\n")
+                    f.write(f"{'网关URL':<46} {'首块时间(ms)':>12} {'块/秒':>10} {'块吞吐量':>15} {'块数':>8}\n")
+                    for url, stats in block_rows:
+                        if stats['first_block_time'] is None:
+                            f.write(f"{url:<50} {'N/A':>16} {'N/A':>12} {'N/A':>19} {stats['blocks']:>10}\n")
+                            continue
+                        f.write(f"{url:<50} {stats['first_block_time']:>16.1f} {stats['block_rate']:>12.1f} "
+                                f"{stats['block_speed']:>14.2f} KB/s {stats['blocks']:>10}\n")
+
                 # 写入统计信息
                 f.write("\n统计信息:\n")
                 total_gateways = len(ranked_gateways)
@@ -699,7 +1451,7 @@ class GatewaySpeedTest:
                 f.write(f"平均下载速度: {avg_speed:.2f}KB/s\n")
                 
         except Exception as e:
-            debug_print(f"保存日志文件失败: {str(e)}", prefix="[ERROR] ")
+            log_error("保存日志文件失败: %s", e)
 
 
 
@@ -711,15 +1463,12 @@ class GatewaySpeedTest:
 
 
 if __name__ == '__main__':
-    debug_print("程序启动", prefix="[START] ")
+    setup_logging(LOG_LEVEL, json_file=LOG_JSON_FILE, json_level=LOG_JSON_LEVEL)
+    log_info("程序启动", prefix="[START] ")
     
     # 创建测速器实例
     tester = GatewaySpeedTest()
     
-    # 运行测速
-    print("\n" + "="*50)
-    debug_print("开始网关测速...", prefix="[TEST] ")
-    
 
     # 定义要测试的CID列表
     test_cids_lst = [
@@ -734,10 +1483,67 @@ if __name__ == '__main__':
         "bafybeidzmwwjp6jj5mrlubsgcglg3se7csved3j6rwezhfamplms6iwbvq",
         # 在此添加其他要测试的CID
     ]
+
+    # 多源下载模式: python ipfs_test_gateway_multi_cid.py fetch <CID> <输出文件> [--top-k 8] [--main-only]
+    if len(sys.argv) > 1 and sys.argv[1] == 'fetch':
+        from ipfs_gateway_fetch import parse_fetch_args
+        args = parse_fetch_args(sys.argv[2:])
+        summary = tester.download_cid(args.cid, args.output, k=args.top_k, main_only=args.main_only)
+        tester.close()
+        log_info("程序结束", prefix="[END] ")
+        sys.exit(0 if summary['complete'] else 1)
+
+    # 常驻服务模式: python ipfs_test_gateway_multi_cid.py serve [--port 8765 --interval 600 --budget 0]
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from ipfs_gateway_serve import parse_serve_args, serve
+        args = parse_serve_args(sys.argv[2:])
+        serve(tester, test_cids_lst, host=args.host, port=args.port,
+              interval=args.interval, budget=args.budget,
+              log=lambda msg: log_info(msg, prefix="[SERVE] "))
+        tester.close()
+        log_info("程序结束", prefix="[END] ")
+        sys.exit(0)
+
+    # 分片模式: python ipfs_test_gateway_multi_cid.py shard [--shards 4] [--index 0 --node tokyo]
+    if len(sys.argv) > 1 and sys.argv[1] == 'shard':
+        from ipfs_gateway_shard import (coordinate, format_ranking, parse_shard_args, probe_shard,
+                                        run_local_shards)
+        args = parse_shard_args(sys.argv[2:])
+        options = {'main_gateway_file': tester.main_gateway_file,
+                   'side_gateway_file': tester.side_gateway_file,
+                   'log_dir': str(tester.log_dir),
+                   'probe_backend': tester.probe_backend}
+        if args.index is not None:
+            # 多节点：只运行本节点的一个分片，增量文件交给 merge 合并
+            probe_shard(test_cids_lst, args.index, args.shards, args.node, args.dir, options)
+        else:
+            deltas = run_local_shards(test_cids_lst, args.shards, args.node, args.dir, options,
+                                      log_level=LOG_LEVEL)
+            ranked = coordinate(deltas, tester.pair_weight, Path(args.dir) / 'ranking.json')
+            print(format_ranking(ranked))
+        tester.close()
+        log_info("程序结束", prefix="[END] ")
+        sys.exit(0)
+
+    # 合并分片增量: python ipfs_test_gateway_multi_cid.py merge gateway_shards/delta-*.json
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        from ipfs_gateway_shard import coordinate, format_ranking, load_deltas, parse_merge_args
+        args = parse_merge_args(sys.argv[2:])
+        Path(args.dir).mkdir(exist_ok=True)
+        ranked = coordinate(load_deltas(args.deltas), tester.pair_weight,
+                            Path(args.dir) / 'ranking.json')
+        print(format_ranking(ranked))
+        tester.close()
+        log_info("程序结束", prefix="[END] ")
+        sys.exit(0)
+
+    # 运行测速
+    print("\n" + "="*50)
+    log_info("开始网关测速...", prefix="[TEST] ")
     
     # 运行测试 (在 range 中调整要循环的轮数)
     for epoch in range(3):
-        debug_print(f"第 {epoch+1} 轮网关测速...", prefix="[TEST] ")
+        log_info("第 %d 轮网关测速...", epoch + 1, prefix="[TEST] ")
         tester.test_cids(test_cids_lst, epoch)
         time.sleep(2)
         # results = tester.run_speed_test() # 测试空文件夹的 CID
@@ -745,9 +1551,10 @@ if __name__ == '__main__':
     # 获取排名结果
     print("\n" + "="*50)
     ranked_gateways = tester.get_ranked_gateways()
-    debug_print(f"获取到 {len(ranked_gateways)} 个网关的排名", prefix="[RANK] ")
+    log_info("获取到 %d 个网关的排名", len(ranked_gateways), prefix="[RANK] ")
  
     # 保存测试结果到日志文件
     tester.save_test_results_log(ranked_gateways)
+    tester.close()
     
-    debug_print("程序结束", prefix="[END] ")
\ No newline at end of file
+    log_info("程序结束", prefix="[END] ")
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""测试直接导入仓库根目录下的模块；http_server 提供本机的 HTTP/1.1 服务端"""
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(
+                (self.path, {name.lower(): value for name, value in self.headers.items()}))
+        status, headers, body = self.server.respond(self)
+        self.send_response_only(status)
+        headers = dict(headers)
+        chunked = headers.get('Transfer-Encoding') == 'chunked'
+        if not chunked and 'Content-Length' not in headers:
+            if isinstance(body, bytes):
+                headers['Content-Length'] = len(body)
+            else:
+                chunked = True
+                headers['Transfer-Encoding'] = 'chunked'
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for piece in [body] if isinstance(body, bytes) else body:
+                if chunked:
+                    piece = b'%x\r\n%s\r\n' % (len(piece), piece)
+                self.wfile.write(piece)
+                self.wfile.flush()
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    """本机测试服务端：respond(handler) 返回 (状态码, 响应头, 响应体)
+
+    响应体为 bytes 时按 Content-Length 发送；为可迭代对象时逐段发送，响应头中没有
+    Content-Length 或指定了 Transfer-Encoding: chunked 时按 chunked 编码。
+    connections 为已接受的连接数，requests 为收到的 (路径, 请求头) 列表。
+    """
+    daemon_threads = True
+
+    def __init__(self, respond):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.respond = respond
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+@pytest.fixture
+def http_server():
+    """启动本机测试服务端：http_server(respond) -> LocalServer，测试结束后关闭"""
+    servers = []
+
+    def start(respond):
+        server = LocalServer(respond)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
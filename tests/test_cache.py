@@ -0,0 +1,30 @@
+from ipfs_gateway_cache import CacheClassifier
+
+URL = 'https://a.example'
+
+
+def _classifier():
+    now = [0.0]
+    return CacheClassifier(window=3600, clock=lambda: now[0]), now
+
+
+def test_failed_repeat_is_not_warm():
+    classifier, now = _classifier()
+    ok = {'status_code': 206, 'response_time': 400, 'ttfb': 300}
+    assert classifier.classify(URL, 'cid', ok, cold_ttfb=300) == ('cold', 'first')
+
+    now[0] = 10
+    failed = {'status_code': 0, 'response_time': 1500}
+    assert classifier.classify(URL, 'cid', failed, cold_ttfb=300) == ('cold', 'failed')
+
+    now[0] = 20
+    mismatch = {'status_code': 206, 'response_time': 50, 'ttfb': 20, 'integrity': 'mismatch'}
+    assert classifier.classify(URL, 'cid', mismatch, cold_ttfb=300)[0] == 'cold'
+
+
+def test_fast_successful_repeat_is_warm():
+    classifier, now = _classifier()
+    classifier.classify(URL, 'cid', {'status_code': 206, 'response_time': 400, 'ttfb': 300})
+    now[0] = 10
+    fast = {'status_code': 206, 'response_time': 60, 'ttfb': 40}
+    assert classifier.classify(URL, 'cid', fast, cold_ttfb=300) == ('warm', 'ttfb')
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ipfs_gateway_bench import MockGatewayFleet
+from ipfs_gateway_dns import DnsError, DnsResolver, interleave_families, open_happy_eyeballs
+from ipfs_gateway_probe import AsyncProbeEngine
+
+
+class StubLookup:
+    """本地桩解析器：按表返回 (地址列表, TTL)，表中没有的主机名为 NXDOMAIN，记录调用次数"""
+
+    def __init__(self, records, ttl=None):
+        self.records = records
+        self.ttl = ttl
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, host):
+        with self.lock:
+            self.calls.append(host)
+        if host not in self.records:
+            raise DnsError(host, 'nxdomain')
+        return list(self.records[host]), self.ttl
+
+
+def _resolver(lookup, **kwargs):
+    now = [0.0]
+    resolver = DnsResolver(lookup=lookup, clock=lambda: now[0], **kwargs)
+    return resolver, now
+
+
+def test_cache_hit_and_ttl_expiry():
+    lookup = StubLookup({'gw.test': ['192.0.2.1', '2001:db8::1', '192.0.2.2']})
+    resolver, now = _resolver(lookup, ttl=300)
+    try:
+        assert resolver.resolve('gw.test') == ['2001:db8::1', '192.0.2.1', '192.0.2.2']
+        now[0] = 299
+        resolver.resolve('gw.test')
+        assert lookup.calls == ['gw.test']
+        assert resolver.stats()['hits'] == 1
+
+        now[0] = 301
+        resolver.resolve('gw.test')
+        assert lookup.calls == ['gw.test', 'gw.test']
+    finally:
+        resolver.close()
+
+
+def test_lookup_ttl_overrides_default():
+    lookup = StubLookup({'gw.test': ['192.0.2.1']}, ttl=10)
+    resolver, now = _resolver(lookup, ttl=300)
+    try:
+        resolver.resolve('gw.test')
+        now[0] = 11
+        resolver.resolve('gw.test')
+        assert len(lookup.calls) == 2
+    finally:
+        resolver.close()
+
+
+def test_negative_cache():
+    lookup = StubLookup({})
+    resolver, now = _resolver(lookup, negative_ttl=60)
+    try:
+        for _ in range(3):
+            with pytest.raises(DnsError) as error:
+                resolver.resolve('missing.test')
+            assert error.value.kind == 'nxdomain'
+        assert lookup.calls == ['missing.test']
+        assert resolver.failure('missing.test') == 'nxdomain'
+        assert resolver.stats()['negative'] == 1
+
+        now[0] = 61
+        assert resolver.failure('missing.test') is None
+        with pytest.raises(DnsError):
+            resolver.resolve('missing.test')
+        assert len(lookup.calls) == 2
+    finally:
+        resolver.close()
+
+
+def test_lookup_timeout_is_negatively_cached():
+    release = threading.Event()
+
+    def slow_lookup(host):
+        release.wait(5)
+        return ['192.0.2.1'], None
+
+    resolver, _ = _resolver(slow_lookup, timeout=0.05)
+    try:
+        with pytest.raises(DnsError) as error:
+            resolver.resolve('slow.test')
+        assert error.value.kind == 'timeout'
+        assert resolver.failure('slow.test') == 'timeout'
+    finally:
+        release.set()
+        resolver.close()
+
+
+def test_prefetch_counts():
+    lookup = StubLookup({'a.test': ['192.0.2.1'], 'b.test': ['192.0.2.2']})
+    resolver, _ = _resolver(lookup)
+    try:
+        stats = resolver.prefetch(['a.test', 'b.test', 'missing.test', '192.0.2.9', 'a.test'])
+        assert stats == {'resolved': 2, 'failed': 1, 'pending': 0}
+        assert resolver.prefetch(['a.test', 'missing.test'])['failed'] == 1
+        assert sorted(lookup.calls) == ['a.test', 'b.test', 'missing.test']
+    finally:
+        resolver.close()
+
+
+def test_interleave_families():
+    assert interleave_families(['1.1.1.1', '1.0.0.1', '::1', '1.1.1.1', '::2']) == \
+        ['::1', '1.1.1.1', '::2', '1.0.0.1']
+
+
+async def _serve():
+    async def handle(reader, writer):
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def test_happy_eyeballs_falls_back_after_refused_address():
+    async def run():
+        server = await _serve()
+        port = server.sockets[0].getsockname()[1]
+        try:
+            # 127.0.0.2 上没有监听，连接被拒绝后立即尝试下一个地址
+            reader, writer = await open_happy_eyeballs(['127.0.0.2', '127.0.0.1'], port, delay=5)
+            assert writer.get_extra_info('peername')[0] == '127.0.0.1'
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert time.monotonic() - start < 2
+
+
+def test_happy_eyeballs_starts_next_address_after_delay(monkeypatch):
+    attempts = []
+    real_open = asyncio.open_connection
+
+    async def open_connection(host, port, **kwargs):
+        attempts.append((host, time.monotonic()))
+        if host == '192.0.2.1':
+            await asyncio.sleep(3600)    # 不响应的地址
+        return await real_open(host, port, **kwargs)
+
+    async def run():
+        server = await _serve()
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await open_happy_eyeballs(['192.0.2.1', '127.0.0.1'], port,
+                                                       delay=0.1)
+            assert writer.get_extra_info('peername')[0] == '127.0.0.1'
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    monkeypatch.setattr(asyncio, 'open_connection', open_connection)
+    asyncio.run(run())
+    assert [host for host, _ in attempts] == ['192.0.2.1', '127.0.0.1']
+    assert attempts[1][1] - attempts[0][1] >= 0.09
+
+
+def test_engine_uses_stub_resolver():
+    fleet = MockGatewayFleet(1, mix={'fast': 1}, body_size=4096)
+    fleet.start()
+    lookup = StubLookup({'gw.test': ['127.0.0.2', '127.0.0.1']})
+    resolver = DnsResolver(lookup=lookup)
+    engine = AsyncProbeEngine(resolver=resolver)
+    try:
+        ok = engine.run(engine.probe(f"http://gw.test:{fleet.port}/gw0/ipfs/bafytest"))
+        assert ok['status_code'] == 206
+        missing = engine.run(engine.probe(f"http://missing.test:{fleet.port}/gw0/ipfs/bafytest"))
+        assert missing['status_code'] == 0
+        assert missing['dns_error'] == 'nxdomain'
+        assert lookup.calls == ['gw.test', 'missing.test']
+    finally:
+        engine.close()
+        resolver.close()
+        fleet.stop()
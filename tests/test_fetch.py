@@ -0,0 +1,101 @@
+import time
+
+from ipfs_gateway_fetch import MultiSourceFetcher
+from ipfs_gateway_probe import AsyncProbeEngine
+
+CONTENT = bytes(range(256)) * 1024     # 256 KiB
+
+
+def _pieces(data, piece, delay):
+    for offset in range(0, len(data), piece):
+        if delay:
+            time.sleep(delay)
+        yield data[offset:offset + piece]
+
+
+def _ranged(piece=16384, delay=0.0):
+    """支持 Range 的网关：按 piece 字节一段、每段间隔 delay 秒发送所请求的范围"""
+    def respond(handler):
+        spec = handler.headers.get('Range', '')[6:]
+        start, _, end = spec.partition('-')
+        start, end = int(start), min(int(end), len(CONTENT) - 1)
+        return 206, {'Content-Range': f"bytes {start}-{end}/{len(CONTENT)}",
+                     'Content-Length': end - start + 1}, _pieces(CONTENT[start:end + 1], piece, delay)
+    return respond
+
+
+def _fetch(servers, path, **kwargs):
+    results = []
+    engine = AsyncProbeEngine()
+    try:
+        fetcher = MultiSourceFetcher(
+            engine, [(server.url, f"{server.url}/ipfs/bafy") for server in servers],
+            on_result=lambda url, result: results.append((url, result)), **kwargs)
+        return engine.run(fetcher.fetch(path)), results
+    finally:
+        engine.close()
+
+
+def test_discover_skips_malformed_content_length(http_server, tmp_path):
+    # 忽略 Range 的网关返回 chunked 200，附带无法解析的 Content-Length
+    bad = http_server(lambda handler: (200, {'Transfer-Encoding': 'chunked',
+                                             'Content-Length': 'abc'}, [CONTENT[:1024]]))
+    good = http_server(_ranged())
+    path = tmp_path / 'out.bin'
+    summary, _ = _fetch([bad, good], path, chunk_size=65536, head_size=16384)
+    assert summary['complete']
+    assert summary['size'] == len(CONTENT)
+    assert path.read_bytes() == CONTENT
+    assert not summary['sources'][bad.url]['alive']
+    assert summary['sources'][good.url]['chunks'] > 0
+
+
+def test_slow_chunks_are_rebalanced(http_server, tmp_path):
+    # 第一个网关提供首块后很慢，它正在下载的分块应被截短，剩余部分交给快的网关；
+    # 快的网关也限速，使队列在检查慢速分块时还没有取空（取空后会改为对冲）
+    slow = http_server(_ranged(piece=1024, delay=0.02))
+    fast = http_server(_ranged(piece=8192, delay=0.01))
+    path = tmp_path / 'out.bin'
+    summary, results = _fetch([slow, fast], path, chunk_size=32768, head_size=4096,
+                              connections_per_gateway=1, rebalance_interval=0.05,
+                              min_split=8192)
+    assert summary['complete']
+    assert path.read_bytes() == CONTENT
+    assert summary['rebalances'] > 0
+    sources = summary['sources']
+    assert sources[fast.url]['bytes'] > sources[slow.url]['bytes']
+    # 每个分块的结果都按探测结果的格式上报
+    assert {url for url, _ in results} == {slow.url, fast.url}
+    assert all(result['status_code'] in (0, 206) for _, result in results)
+
+
+def test_idle_connection_hedges_slowest_chunk(http_server, tmp_path):
+    fast = http_server(_ranged())
+    slow = http_server(_ranged(piece=4096, delay=0.05))
+    path = tmp_path / 'out.bin'
+    start = time.monotonic()
+    summary, _ = _fetch([fast, slow], path, chunk_size=131072, head_size=16384,
+                        connections_per_gateway=1, rebalance_interval=60)
+    assert summary['complete']
+    assert path.read_bytes() == CONTENT
+    assert summary['hedges'] >= 1
+    # 慢速网关单独下载它的分块需要 2 秒以上
+    assert time.monotonic() - start < 1.5
+
+
+def test_truncated_chunk_is_requeued(http_server, tmp_path):
+    def truncated(handler):
+        # 只发送一半数据后关闭连接
+        status, headers, body = _ranged()(handler)
+        data = b''.join(body)
+        return status, {**headers, 'Connection': 'close'}, [data[:len(data) // 2]]
+
+    good = http_server(_ranged())
+    broken = http_server(truncated)
+    path = tmp_path / 'out.bin'
+    summary, results = _fetch([good, broken], path, chunk_size=65536, head_size=16384,
+                              max_failures=1)
+    assert summary['complete']
+    assert path.read_bytes() == CONTENT
+    assert not summary['sources'][broken.url]['alive']
+    assert any(url == broken.url and result['status_code'] == 0 for url, result in results)
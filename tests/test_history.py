@@ -0,0 +1,127 @@
+import os
+import subprocess
+import time
+from types import SimpleNamespace
+
+from ipfs_gateway_history import RAW_FORMAT, ROLLUP_FORMATS, ProbeHistory, main
+from ipfs_test_gateway_multi_cid import GatewaySpeedTest
+
+DAY = 86400
+URL = 'https://a.example'
+
+
+def _result(ttfb, status_code=206):
+    return {'status_code': status_code, 'size': 1024, 'response_time': ttfb + 10,
+            'ttfb': ttfb, 'total_time': ttfb + 10, 'transfer_time': 10}
+
+
+def test_raw_query_reads_only_the_window(tmp_path):
+    now = [1_700_000_000.0]
+    history = ProbeHistory(tmp_path, clock=lambda: now[0])
+    for i in range(100):
+        now[0] = 1_700_000_000.0 + i * 60
+        history.record(URL, 'cid-a' if i % 2 else 'cid-b', _result(i))
+        history.record('https://b.example', 'cid-a', _result(1000))
+    history.flush()
+
+    start = 1_700_000_000.0
+    stats = history.query(URL, 'ttfb', since=start + 10 * 60, until=start + 19 * 60)
+    assert stats['level'] == 'raw'
+    assert stats['count'] == 10
+    assert stats['mean'] == sum(range(10, 20)) / 10
+
+    stats = history.query(URL, 'ttfb', since=start + 10 * 60, until=start + 19 * 60, cid='cid-a')
+    assert stats['count'] == 5
+    assert history.query('https://missing.example', since=start, until=now[0])['count'] == 0
+    history.close()
+
+
+def test_queries_do_not_prune(tmp_path):
+    now = 1_700_000_000.0
+    history = ProbeHistory(tmp_path, clock=lambda: now)
+    history.record(URL, 'cid', _result(50), ts=now)
+    history.close()
+
+    # 该段已超过原始记录的保留期，但只做查询的进程不能删除它
+    old = now - 30 * DAY
+    segment = next(tmp_path.glob('raw-*.bin'))
+    os.utime(segment, (old, old))
+    reader = ProbeHistory(tmp_path, clock=lambda: now)
+    reader.query(URL, 'ttfb', days=1)
+    reader.close()
+    main([URL, '--dir', str(tmp_path), '--days', '1'])
+    assert segment.exists()
+
+    writer = ProbeHistory(tmp_path, clock=lambda: now)
+    writer.prune()
+    writer.close()
+    assert not segment.exists()
+
+
+def test_reader_does_not_create_directory(tmp_path):
+    ProbeHistory(tmp_path / 'missing').close()
+    assert not (tmp_path / 'missing').exists()
+    assert RAW_FORMAT.size == 52
+
+
+def test_prune_logs_keeps_tracked_and_unrelated_files(tmp_path):
+    subprocess.run(['git', 'init', '-q', str(tmp_path)], check=True)
+    names = ('gateway_test_cid_20250402_224320.log', 'gateway_test_cid_20250101_000000.log',
+             'summary_report_20250101_000000.log', 'notes.txt', 'gateway_test_cid_new.log')
+    for name in names:
+        (tmp_path / name).write_text('x')
+    subprocess.run(['git', 'add', names[0]], cwd=tmp_path, check=True)
+    old = time.time() - 40 * DAY
+    for name in names[:4]:
+        os.utime(tmp_path / name, (old, old))
+
+    tester = SimpleNamespace(history=None, log_dir=tmp_path,
+                             _tracked_files=GatewaySpeedTest._tracked_files)
+    # 默认不清理
+    GatewaySpeedTest.prune_logs(tester)
+    assert all((tmp_path / name).exists() for name in names)
+
+    GatewaySpeedTest.prune_logs(tester, retention_days=30)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == sorted(
+        [names[0], 'notes.txt', 'gateway_test_cid_new.log'])
+
+
+def test_rollups_are_smaller_than_the_samples_they_summarize(tmp_path):
+    # 每个网关每分钟一次时，一小时的 60 条原始记录汇总为一条 1h 记录
+    assert ROLLUP_FORMATS['1h'].size == 128
+    assert ROLLUP_FORMATS['1d'].size == 192
+    assert ROLLUP_FORMATS['1h'].size < 3 * RAW_FORMAT.size
+
+    start = 1_700_000_000.0 // 86400 * 86400
+    now = [start]
+    history = ProbeHistory(tmp_path, clock=lambda: now[0])
+    for i in range(120):
+        now[0] = start + i * 60
+        history.record(URL, 'cid', _result(100 + i))
+    history.close()
+    # 1m 级不写文件
+    assert not list(tmp_path.glob('1m-*.bin'))
+    assert (tmp_path / 'raw-{}.bin'.format(time.strftime('%Y%m%d', time.gmtime(start)))).stat().st_size == 120 * 52
+
+    # 超出原始记录保留期的窗口由 1h 汇总回答，计数和平均值与原始记录一致
+    now[0] = start + 20 * DAY
+    reader = ProbeHistory(tmp_path, clock=lambda: now[0])
+    stats = reader.query(URL, 'ttfb', since=start, until=start + 2 * 3600)
+    assert stats['level'] == '1h'
+    assert stats['count'] == stats['samples'] == 120
+    assert abs(stats['mean'] - (100 + 219) / 2) < 1e-3
+    assert reader.query(URL, 'dns', since=start, until=start + 2 * 3600)['samples'] == 0
+    reader.close()
+
+
+def test_minute_series_is_computed_from_raw_records(tmp_path):
+    start = 1_700_000_000.0 // 60 * 60
+    now = [start]
+    history = ProbeHistory(tmp_path, clock=lambda: now[0])
+    for i in range(6):
+        now[0] = start + i * 20
+        history.record(URL, 'cid', _result(100 * (i + 1)))
+    points = history.series(URL, level='1m', since=start, until=now[0])
+    assert [(p['time'], p['count'], p['mean']) for p in points] == [
+        (start, 3, 200), (start + 60, 3, 500)]
+    history.close()
@@ -0,0 +1,38 @@
+from ipfs_gateway_ingest import base_domain, canonical_url, group_aliases
+
+SHARED = frozenset({'203.0.113.10'})
+
+
+def _resolver(host):
+    return SHARED
+
+
+def test_base_domain_handles_multi_label_suffixes():
+    assert base_domain('a.example.co.uk') == 'example.co.uk'
+    assert base_domain('ipfs.gw.com.cn') == 'gw.com.cn'
+    assert base_domain('gateway.foo.eu.org') == 'foo.eu.org'
+    assert base_domain('my-gw.alice.workers.dev') == 'alice.workers.dev'
+    assert base_domain('ipfs-1.example.com') == 'example.com'
+    assert base_domain('ipfs.io') == 'ipfs.io'
+    assert base_domain('203.0.113.10') == '203.0.113.10'
+
+
+def test_unrelated_gateways_under_public_suffix_are_not_aliases():
+    urls = ['https://ipfs.alpha.co.uk', 'https://ipfs.beta.co.uk',
+            'https://gw.one.eu.org', 'https://gw.two.eu.org']
+    assert group_aliases(urls, resolver=_resolver) == {}
+
+
+def test_hosts_of_one_domain_with_same_addresses_are_aliases():
+    urls = ['https://ipfs-1.example.co.uk', 'https://ipfs-2.example.co.uk',
+            'https://ipfs-1.example.com', 'https://ipfs-2.example.com']
+    assert group_aliases(urls, resolver=_resolver) == {
+        'https://ipfs-2.example.co.uk': 'https://ipfs-1.example.co.uk',
+        'https://ipfs-2.example.com': 'https://ipfs-1.example.com',
+    }
+
+
+def test_canonical_url():
+    assert canonical_url(' HTTPS://Gw.Example.com:443/ipfs/ ') == 'https://gw.example.com'
+    assert canonical_url('http://2a01:4f8::20') == 'http://[2a01:4f8::20]'
+    assert canonical_url('# comment') is None
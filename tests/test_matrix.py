@@ -0,0 +1,68 @@
+import pytest
+
+from ipfs_gateway_matrix import CID_PRIOR, CidMatrix
+from ipfs_gateway_rank import RankIndex
+
+CID = 'bafkreiabc'
+GLOBAL = {'a': 5.0, 'b': 4.0, 'c': 3.0, 'd': 2.0, 'e': 1.0}
+OK = {'status_code': 206, 'response_time': 100, 'ttfb': 100, 'speed': 1024 * 100, 'size': 4096}
+FAIL = {'status_code': 0, 'response_time': 1500, 'speed': 0, 'size': 0}
+
+
+def _weight(ema, response_time, speed_kb):
+    return ema * 10
+
+
+def _setup():
+    index = RankIndex()
+    for url, weight in GLOBAL.items():
+        index.update(url, weight)
+    return CidMatrix(_weight, 0.3), index
+
+
+def _best(matrix, index, k, accept=None):
+    return matrix.best(CID, k, index.iter_ranked(), index.weight, accept)
+
+
+def test_pair_score_shrinks_towards_global_weight():
+    matrix, index = _setup()
+    matrix.update('c', CID, OK)
+    stats = matrix.get('c', CID)
+    assert stats['tests'] == 1 and stats['weight'] == 10
+    first = _best(matrix, index, 1)
+    assert first == [('c', pytest.approx((10 + CID_PRIOR * 3.0) / (1 + CID_PRIOR)), 'pair')]
+
+    for _ in range(19):
+        matrix.update('c', CID, OK)
+    (_, score, _), = _best(matrix, index, 1)
+    assert score == pytest.approx((20 * 10 + CID_PRIOR * 3.0) / (20 + CID_PRIOR))
+
+
+def test_best_merges_pairs_with_global_fallback():
+    matrix, index = _setup()
+    matrix.update('c', CID, OK)
+    for _ in range(6):
+        matrix.update('d', CID, FAIL)
+    ranked = _best(matrix, index, 10)
+    assert [(url, source) for url, _, source in ranked] == [
+        ('c', 'pair'), ('a', 'global'), ('b', 'global'), ('d', 'pair'), ('e', 'global')]
+    scores = [score for _, score, _ in ranked]
+    assert scores == sorted(scores, reverse=True)
+    # 有数据的网关不再以全局权重重复出现
+    assert len({url for url, _, _ in ranked}) == 5
+
+    assert [url for url, _, _ in _best(matrix, index, 3)] == ['c', 'a', 'b']
+    main = {'b', 'd', 'e'}
+    assert [url for url, _, _ in _best(matrix, index, 10, main.__contains__)] == ['b', 'd', 'e']
+
+
+def test_best_skips_removed_gateways_and_ignored_results():
+    matrix, index = _setup()
+    matrix.update('x', CID, OK)
+    matrix.update('a', CID, {**FAIL, 'skipped': True})
+    matrix.update('a', '', OK)
+    assert matrix.get('a', CID) is None
+    ranked = _best(matrix, index, 10)
+    assert 'x' not in {url for url, _, _ in ranked}
+    assert [source for _, _, source in ranked] == ['global'] * 5
+    assert _best(CidMatrix(_weight, 0.3), RankIndex(), 5) == []
@@ -0,0 +1,180 @@
+import asyncio
+import socket
+import ssl
+import threading
+import time
+
+from ipfs_gateway_probe import PROBE_RANGE_END, AsyncProbeEngine, ConnectionPool, build_probe_result
+
+BODY = b'x' * 4096
+
+
+def _ok(handler):
+    return 200, {}, BODY
+
+
+def _key(server):
+    return 'http', '127.0.0.1', server.server_address[1]
+
+
+def test_pool_per_host_limit_waits_for_release(http_server):
+    server = http_server(_ok)
+
+    async def main():
+        pool = ConnectionPool(ssl.create_default_context(), max_per_host=2)
+        first, _ = await pool.acquire(*_key(server))
+        second, _ = await pool.acquire(*_key(server))
+        third = asyncio.ensure_future(pool.acquire(*_key(server)))
+        await asyncio.sleep(0.1)
+        assert not third.done()
+        pool.release(first, True)
+        conn, phases = await asyncio.wait_for(third, 5)
+        assert conn is first and conn.reused
+        assert phases == (0.0, 0.0, 0.0)
+        assert pool.stats()['open_total'] == 2
+        pool.release(second, False)
+        pool.release(conn, True)
+        assert pool.stats() == {'open_total': 1, 'idle_total': 1, 'hosts': 1}
+        pool.close()
+
+    asyncio.run(main())
+    assert server.connections == 2
+
+
+def test_pool_global_limit_evicts_oldest_idle(http_server):
+    a = http_server(_ok)
+    b = http_server(_ok)
+
+    async def main():
+        pool = ConnectionPool(ssl.create_default_context(), max_total=2)
+        idle_a, _ = await pool.acquire(*_key(a))
+        pool.release(idle_a, True)
+        busy_b, _ = await pool.acquire(*_key(b))
+        # 全局名额已满：关闭 a 的空闲连接，给 b 的新连接腾出名额
+        second_b, _ = await pool.acquire(*_key(b))
+        assert idle_a.writer.is_closing()
+        assert pool.stats() == {'open_total': 2, 'idle_total': 0, 'hosts': 1}
+
+        # 没有可关闭的空闲连接时等待归还
+        waiting = asyncio.ensure_future(pool.acquire(*_key(a)))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        pool.release(busy_b, False)
+        conn, _ = await asyncio.wait_for(waiting, 5)
+        assert conn.key == _key(a)
+        pool.release(conn, False)
+        pool.release(second_b, False)
+        assert pool.stats()['open_total'] == 0
+
+    asyncio.run(main())
+
+
+def test_pool_evicts_idle_connections(http_server):
+    server = http_server(_ok)
+
+    async def main():
+        pool = ConnectionPool(ssl.create_default_context(), idle_timeout=10)
+        conn, _ = await pool.acquire(*_key(server))
+        pool.release(conn, True)
+        pool.evict_idle(now=time.monotonic() + 5)
+        assert pool.stats()['idle_total'] == 1
+        pool.evict_idle(now=time.monotonic() + 11)
+        assert pool.stats() == {'open_total': 0, 'idle_total': 0, 'hosts': 0}
+        assert conn.writer.is_closing()
+
+    asyncio.run(main())
+
+
+def test_engine_reuses_connection_across_probes(http_server):
+    server = http_server(_ok)
+    engine = AsyncProbeEngine()
+    try:
+        for cid in ('bafya', 'bafyb', 'bafyc'):
+            result = engine.run(engine.probe(f"{server.url}/ipfs/{cid}"))
+            assert result['status_code'] == 200 and result['size'] == len(BODY)
+    finally:
+        engine.close()
+    assert server.connections == 1
+    assert len(server.requests) == 3
+
+
+def _ranged(handler):
+    return 206, {'Content-Range': f"bytes 0-{len(BODY) - 1}/{len(BODY)}", 'Age': '30'}, BODY
+
+
+def _probe(url):
+    engine = AsyncProbeEngine(max_time=5)
+    try:
+        return engine.run(engine.probe(url))
+    finally:
+        engine.close()
+
+
+def test_probe_result_matches_curl_fields(http_server):
+    server = http_server(_ranged)
+    result = _probe(f"{server.url}/ipfs/bafy")
+    # 与 curl 后端相同：按 build_probe_result 构造，缓存相关的响应头放入 cache_headers
+    curl_result = build_probe_result(206, 0.05, len(BODY), 0.01, time_total=0.06)
+    assert set(result) == set(curl_result) | {'cache_headers'}
+    assert result['cache_headers'] == {'age': '30'}
+    assert result['status_code'] == 206 and result['size'] == len(BODY)
+    assert 0 < result['ttfb'] <= result['total_time']
+    assert result['speed'] > 0
+    _, headers = server.requests[0]
+    assert headers['range'] == f"bytes=0-{PROBE_RANGE_END}"
+
+
+def test_connect_failure_matches_curl_fields():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    result = _probe(f"http://127.0.0.1:{port}/ipfs/bafy")
+    assert set(result) == set(build_probe_result(0, 0.0, 0))
+    assert (result['status_code'], result['size'], result['speed']) == (0, 0, 0)
+    assert result['response_time'] == result['server_time'] == 1500
+
+
+def _concurrency_server(http_server):
+    """记录同时处理中的请求数的最大值"""
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def respond(handler):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.05)
+        with lock:
+            state['active'] -= 1
+        return 200, {}, BODY
+
+    return http_server(respond), state
+
+
+def _probe_all(jobs, **kwargs):
+    engine = AsyncProbeEngine()
+
+    async def collect():
+        return [item async for item in engine.probe_many(jobs, **kwargs)]
+
+    try:
+        return engine.run(collect())
+    finally:
+        engine.close()
+
+
+def test_probe_many_limits_each_group(http_server):
+    server, state = _concurrency_server(http_server)
+    jobs = [(i, f"{server.url}/ipfs/bafy{i}", 'gw') for i in range(4)]
+    results = _probe_all(jobs, max_per_group=1)
+    assert sorted(key for key, _ in results) == [0, 1, 2, 3]
+    assert all(result['status_code'] == 200 for _, result in results)
+    assert state['peak'] == 1
+
+
+def test_probe_many_limits_total_concurrency(http_server):
+    server, state = _concurrency_server(http_server)
+    jobs = [(i, f"{server.url}/ipfs/bafy{i}", f"gw{i}") for i in range(8)]
+    results = _probe_all(jobs, max_concurrency=3, max_per_group=1)
+    assert len(results) == 8
+    assert 1 < state['peak'] <= 3
@@ -0,0 +1,58 @@
+import random
+
+from ipfs_gateway_rank import RankIndex
+
+
+def _expected(weights, order):
+    """按权重稳定排序：权重相同时按首次加入的顺序"""
+    return sorted(weights.items(), key=lambda item: (-item[1], order.index(item[0])))
+
+
+def test_top_k_matches_full_sort_after_random_updates():
+    rng = random.Random(7)
+    index = RankIndex(load=4)       # 小桶，覆盖桶的拆分和删空
+    weights = {}
+    order = []
+    for step in range(2000):
+        url = f"https://gw{rng.randrange(60)}.example"
+        if weights and rng.random() < 0.1:
+            victim = rng.choice(sorted(weights))
+            index.remove(victim)
+            del weights[victim]
+            continue
+        if url not in order:
+            order.append(url)
+        weights[url] = rng.choice([0.0, 0.5, 1.0, rng.random() * 10])
+        index.update(url, weights[url])
+
+        if step % 100 == 0:
+            expected = _expected(weights, order)
+            assert len(index) == len(weights)
+            assert list(index.iter_ranked()) == expected
+            for k in (0, 1, 5, len(expected) + 3):
+                assert index.top(k) == expected[:k]
+    expected = _expected(weights, order)
+    for position, (url, weight) in enumerate(expected):
+        assert index.rank(url) == position
+        assert index.weight(url) == weight
+
+
+def test_equal_weights_keep_insertion_order():
+    index = RankIndex()
+    for url in ('a', 'b', 'c'):
+        index.update(url, 1.0)
+    index.update('a', 2.0)
+    index.update('a', 1.0)
+    assert [url for url, _ in index.top(3)] == ['a', 'b', 'c']
+
+
+def test_percentile_and_missing_gateway():
+    index = RankIndex()
+    for url, weight in (('a', 3.0), ('b', 2.0), ('c', 2.0), ('d', 1.0)):
+        index.update(url, weight)
+    assert index.percentile('a') == 1.0
+    assert index.percentile('b') == index.percentile('c') == 0.75
+    assert index.percentile('d') == 0.25
+    assert index.rank('x') is None and index.percentile('x') is None
+    index.remove('x')
+    assert len(index) == 4 and 'x' not in index
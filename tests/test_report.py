@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+import threading
+
+import pytest
+
+from ipfs_gateway_report import (CSV_FIELDS, CidAggregates, render_csv, render_json, render_text,
+                                 summary_data)
+
+CID = 'bafkreiabc'
+OTHER = 'bafkreidef'
+
+
+def _result(status_code=206, response_time=200, speed=1024 * 100, size=4096, **extra):
+    return {'status_code': status_code, 'response_time': response_time, 'speed': speed,
+            'size': size, **extra}
+
+
+def _gateway(url, weight, speed, tests=1):
+    return {'url': url, 'weight': weight, 'test_count': tests, 'success_rate': 1.0,
+            'last_response_time': 100.0, 'avg_download_speed': speed,
+            'max_download_speed': speed * 2, 'speed_stability': 0.1}
+
+
+def test_results_are_classified_once():
+    aggregates = CidAggregates()
+    aggregates.add(CID, 'https://a.example', _result())
+    aggregates.add(CID, 'https://a.example', _result(response_time=9000, speed=1024 * 300))
+    aggregates.add(CID, 'https://b.example', _result(status_code=0, speed=0, size=0))
+    aggregates.add(CID, 'https://b.example', _result(status_code=0, speed=0, size=0,
+                                                     dns_error='nxdomain'))
+    aggregates.add(CID, 'https://c.example', _result(integrity='mismatch'))
+    aggregates.add(CID, 'https://c.example', _result(status_code=504, speed=0, size=0))
+    aggregates.add(CID, 'https://d.example', _result(status_code=0, speed=0, size=0,
+                                                     deadline_exceeded=True))
+    aggregates.add(CID, 'https://d.example', _result(status_code=0, speed=0, size=0,
+                                                     skipped=True))
+    stats = aggregates.stats(CID)
+    assert stats['gateways'] == 4
+    assert stats['successful_gateways'] == 1
+    assert stats['probes'] == 8
+    assert stats['successes'] == 2
+    assert stats['integrity_failures'] == 1
+    assert stats['dns_failures'] == 1
+    # 连接失败、轮次截止和熔断跳过都没有收到响应
+    assert stats['timeouts'] == 3
+    assert stats['deadline_exceeded'] == 1 and stats['skipped'] == 1
+    assert stats['bytes'] == 4096 * 3
+    # 响应时间上限 1500ms，速度只平均有下载的结果
+    assert stats['avg_response_time'] == pytest.approx((200 * 7 + 1500) / 8)
+    assert stats['avg_download_speed'] == pytest.approx((100 + 300 + 100) / 3)
+
+
+def test_concurrent_adds_and_reset():
+    aggregates = CidAggregates()
+
+    def worker(n):
+        for i in range(500):
+            aggregates.add(CID if i % 2 else OTHER, f"https://gw{n}.example", _result())
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert aggregates.stats(CID)['probes'] == 2000
+    assert aggregates.stats(OTHER)['successes'] == 2000
+    assert aggregates.stats(CID)['gateways'] == 8
+
+    aggregates.reset([CID])
+    assert aggregates.stats(CID)['probes'] == 0
+    assert aggregates.stats(OTHER)['probes'] == 2000
+    aggregates.reset()
+    assert aggregates.stats(OTHER)['probes'] == 0
+
+
+def test_summary_renderers():
+    aggregates = CidAggregates()
+    aggregates.add(CID, 'https://a.example', _result())
+    ranked = [_gateway('https://a.example', 2.0, 1200.0), _gateway('https://b.example', 1.0, 80.0),
+              _gateway('https://c.example', 0.001, 0.0, tests=0)]
+    data = summary_data([CID, OTHER], aggregates, ranked, top_k=2)
+
+    assert [gw['url'] for gw in data['top']] == ['https://a.example', 'https://b.example']
+    assert data['overall']['total_gateways'] == 3 and data['overall']['active_gateways'] == 2
+    assert data['speed_distribution']['极快 (>1000KB/s)'] == 1
+    assert data['speed_distribution']['慢速 (50-200KB/s)'] == 1
+    assert data['cids'][OTHER]['probes'] == 0
+
+    assert json.loads(render_json(data))['cids'][CID]['successes'] == 1
+    rows = list(csv.DictReader(io.StringIO(render_csv(data))))
+    assert [row['cid'] for row in rows] == [CID, OTHER]
+    assert set(rows[0]) == set(CSV_FIELDS)
+    text = render_text(data)
+    assert f"CID: {CID}" in text and 'https://a.example' in text
@@ -0,0 +1,165 @@
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime
+
+from ipfs_gateway_probe import AsyncProbeEngine
+from ipfs_gateway_sched import (STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker,
+                                ProbeScheduler)
+from ipfs_test_gateway_multi_cid import GatewaySpeedTest
+
+CID = 'bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e'
+
+
+def _open_breaker(url):
+    breaker = CircuitBreaker(threshold=1, half_open_interval=0)
+    breaker.record(url, {'status_code': 0})
+    assert breaker.state(url) == STATE_OPEN
+    return breaker
+
+
+def test_release_returns_half_open_trial_to_open():
+    breaker = _open_breaker('https://a.example')
+    assert breaker.allow('https://a.example')
+    assert breaker.state('https://a.example') == STATE_HALF_OPEN
+    assert not breaker.allow('https://a.example')
+
+    breaker.release('https://a.example')
+    assert breaker.state('https://a.example') == STATE_OPEN
+    assert breaker.allow('https://a.example')
+
+
+def test_release_without_trial_is_a_no_op():
+    breaker = _open_breaker('https://a.example')
+    breaker.release('https://a.example')
+    breaker.release('https://b.example')
+    assert breaker.state('https://a.example') == STATE_OPEN
+    assert breaker.state('https://b.example') != STATE_HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_connect_failures():
+    breaker = CircuitBreaker(threshold=3, half_open_interval=60, clock=FakeClock())
+    url = 'https://a.example'
+    for result in ({'status_code': 0}, {'status_code': 0}, {'status_code': 206}):
+        breaker.record(url, result)
+    # 只统计连续的连接失败：成功和 HTTP 错误（收到了响应）都会清零计数
+    for result in ({'status_code': 0}, {'status_code': 504}, {'status_code': 0}, {'status_code': 0}):
+        breaker.record(url, result)
+    assert breaker.state(url) == STATE_CLOSED
+    breaker.record(url, {'status_code': 0})
+    assert breaker.state(url) == STATE_OPEN
+    assert not breaker.allow(url)
+    assert breaker.skipped == 1
+    assert breaker.open_count() == 1
+
+
+def test_breaker_half_open_trial_closes_or_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, half_open_interval=60, clock=clock)
+    url = 'https://a.example'
+    breaker.record(url, {'status_code': 0})
+    clock.now = 59
+    assert not breaker.allow(url)
+
+    # 冷却期后只放行一次试探，失败则重新计时
+    clock.now = 60
+    assert breaker.allow(url)
+    assert breaker.state(url) == STATE_HALF_OPEN
+    assert not breaker.allow(url)
+    breaker.record(url, {'status_code': 0})
+    assert breaker.state(url) == STATE_OPEN
+    clock.now = 100
+    assert not breaker.allow(url)
+
+    clock.now = 120
+    assert breaker.allow(url)
+    breaker.record(url, {'status_code': 206})
+    assert breaker.state(url) == STATE_CLOSED
+    assert breaker.allow(url)
+    assert breaker.open_count() == 0
+
+
+def test_breaker_disabled_with_zero_threshold():
+    breaker = CircuitBreaker(threshold=0)
+    for _ in range(5):
+        breaker.record('https://a.example', {'status_code': 0})
+    assert breaker.allow('https://a.example')
+    assert breaker.state('https://a.example') == STATE_CLOSED
+
+
+class HangingEngine(AsyncProbeEngine):
+    """探测永远不返回，只能被轮次截止取消"""
+
+    async def probe(self, full_url, verifier=None, stream=None):
+        await asyncio.sleep(3600)
+
+
+def test_deadline_cancelled_half_open_trial_can_be_probed_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    url = 'http://127.0.0.1:9'
+    (tmp_path / 'main.txt').write_text(url + '\n')
+    (tmp_path / 'side.txt').write_text('')
+    tester = GatewaySpeedTest(str(tmp_path / 'main.txt'), str(tmp_path / 'side.txt'),
+                              data_file=str(tmp_path / 'gateway_data.json'),
+                              log_dir=str(tmp_path / 'logs'), probe_backend='async',
+                              round_deadline=0.2, history_dir=None, cid_matrix_file=None)
+    try:
+        tester._probe_engine = HangingEngine()
+        tester.breaker = _open_breaker(url)
+
+        results = list(tester._iter_probe_results([(url, CID)], max_workers=1))
+        assert results[0][1].get('deadline_exceeded')
+
+        # 被取消的试探不能让网关一直停在半开状态
+        assert tester.breaker.state(url) == STATE_OPEN
+        assert tester.breaker.allow(url)
+    finally:
+        tester.close()
+
+
+NOW = 1_700_000_000.0
+
+
+def _gateway(weight, age, due=NOW + 3600):
+    """权重为 weight、age 秒前测过、due 时到期的网关条目"""
+    return {'current_weight': weight, 'next_due_time': due, 'test_count': 10,
+            'last_test_time': datetime.fromtimestamp(NOW - age).isoformat()}
+
+
+def test_exploration_is_capped_at_epsilon_budget():
+    gateways = {f'https://g{i}.example': _gateway(0.5, 600) for i in range(50)}
+    scheduler = ProbeScheduler(gateways, budget=10, epsilon=0.2, rng=random.Random(1),
+                               clock=lambda: NOW)
+    # 没有到期的网关时也只探索 ε·预算 个，不把利用的名额转给探索
+    assert len(scheduler.select()) == 2
+
+
+def test_exploration_prefers_stale_and_low_weight_gateways():
+    gateways = {
+        'https://fresh-strong.example': _gateway(1.0, 60),
+        'https://stale-weak.example': _gateway(0.01, 86400),
+    }
+    gateways.update({f'https://mid{i}.example': _gateway(0.5, 600) for i in range(8)})
+    picks = Counter()
+    for seed in range(200):
+        scheduler = ProbeScheduler(gateways, budget=5, epsilon=0.2, rng=random.Random(seed),
+                                   clock=lambda: NOW)
+        picks.update(scheduler.select())
+    assert picks['https://stale-weak.example'] >= 190
+    assert picks['https://fresh-strong.example'] < 5
+
+
+def test_untested_gateways_are_explored_first():
+    gateways = {f'https://g{i}.example': _gateway(0.01, 86400) for i in range(10)}
+    gateways['https://new.example'] = {'current_weight': 1.0, 'next_due_time': NOW + 3600}
+    scheduler = ProbeScheduler(gateways, budget=5, epsilon=0.2, rng=random.Random(3),
+                               clock=lambda: NOW)
+    assert 'https://new.example' in scheduler.select()
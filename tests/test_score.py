@@ -0,0 +1,37 @@
+from ipfs_gateway_cache import new_cache_score, update_cache_score
+from ipfs_gateway_matrix import CidMatrix
+from ipfs_gateway_score import score_sample
+
+PATH_RESULT = {'status_code': 206, 'response_time': 2400, 'ttfb': 300, 'server_time': 250,
+               'speed': 1024 * 20, 'size': 4096}
+
+
+def _weight(ema, response_time, speed_kb):
+    return ema * 1000 / response_time + speed_kb
+
+
+def test_score_sample_caps_time_and_converts_speed():
+    sample = score_sample(PATH_RESULT)
+    assert sample == (1, 1500, 300, 20)
+    assert score_sample(PATH_RESULT, server_time=True).response_time == 250
+    failed = score_sample({'status_code': 0, 'response_time': 1500, 'speed': 0})
+    assert failed == (0, 1500, 1500, 0)
+
+
+def test_block_metrics_replace_byte_metrics():
+    result = dict(PATH_RESULT, status_code=200, blocks=2, first_block_time=120,
+                  block_speed=1024 * 300)
+    # 块/CAR 模式即使开启了服务器处理时间评分也用首块时间
+    assert score_sample(result, server_time=True) == (1, 120, 120, 300)
+
+
+def test_cache_score_and_matrix_pair_agree():
+    matrix = CidMatrix(_weight, 0.3)
+    score = new_cache_score()
+    for result in (PATH_RESULT, dict(PATH_RESULT, response_time=900, ttfb=100),
+                   {'status_code': 0, 'response_time': 1500, 'speed': 0}):
+        update_cache_score(score, result, 0.3, _weight)
+        matrix.update('https://a.example', 'cid', result)
+    pair = matrix.get('https://a.example', 'cid')
+    for name in score:
+        assert pair[name] == score[name]
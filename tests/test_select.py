@@ -0,0 +1,106 @@
+import random
+from collections import Counter
+
+import pytest
+
+from ipfs_gateway_select import AliasTable, GatewaySelector
+
+WEIGHTS = {'a': 5.0, 'b': 3.0, 'c': 1.5, 'd': 0.5, 'z': 0.0}
+MAIN = {'a', 'c'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _selector(max_stale=0, clock=None):
+    selector = GatewaySelector(rng=random.Random(1), max_stale=max_stale,
+                               clock=clock or FakeClock())
+    for url, weight in WEIGHTS.items():
+        selector.update(url, weight, url in MAIN)
+    return selector
+
+
+def _frequencies(pick, draws=20000):
+    counts = Counter(pick() for _ in range(draws))
+    return {url: count / draws for url, count in counts.items()}
+
+
+def test_alias_table_probabilities_are_exact():
+    table = AliasTable(WEIGHTS.items())
+    n = len(table)
+    assert 'z' not in table.urls
+    # 每列被选中的概率为 1/n，本列取 prob[i]，其余部分归别名
+    mass = Counter()
+    for i, url in enumerate(table.urls):
+        mass[url] += table.prob[i] / n
+        mass[table.urls[table.alias[i]]] += (1 - table.prob[i]) / n
+    for url, weight in WEIGHTS.items():
+        assert mass[url] == pytest.approx(weight / 10.0)
+
+
+def test_pick_follows_weights():
+    selector = _selector()
+    freq = _frequencies(selector.pick)
+    assert 'z' not in freq
+    for url in 'abcd':
+        assert freq[url] == pytest.approx(WEIGHTS[url] / 10.0, abs=0.02)
+
+
+def test_pick_with_exclude_renormalizes():
+    selector = _selector()
+    # 排除的权重少于一半：拒绝采样
+    freq = _frequencies(lambda: selector.pick(exclude={'b'}))
+    assert 'b' not in freq
+    assert freq['a'] == pytest.approx(5.0 / 7.0, abs=0.02)
+    # 排除的权重超过一半：线性抽样
+    freq = _frequencies(lambda: selector.pick(exclude={'a', 'b'}))
+    assert set(freq) == {'c', 'd'}
+    assert freq['c'] == pytest.approx(0.75, abs=0.02)
+    assert selector.pick(exclude=set(WEIGHTS)) is None
+
+
+def test_main_only_and_pick_many():
+    selector = _selector()
+    freq = _frequencies(lambda: selector.pick(main_only=True))
+    assert freq['a'] == pytest.approx(5.0 / 6.5, abs=0.02)
+    assert set(freq) == MAIN
+    assert set(selector.pick_many(2, main_only=True)) == MAIN
+    assert sorted(selector.pick_many(10)) == ['a', 'b', 'c', 'd']
+
+
+def _pick_all_pools(selector):
+    for pool in ('all', 'main', 'side'):
+        selector.pick(pool=pool)
+
+
+def test_stale_tables_are_rebuilt_in_batches():
+    clock = FakeClock()
+    selector = _selector(max_stale=1.0, clock=clock)
+    _pick_all_pools(selector)
+    assert selector.rebuilds == 3
+
+    # 过期的表在 max_stale 内继续使用，期间的多次更新合并为一次重建
+    selector.update('a', 0.1, True)
+    selector.update('c', 50.0, True)
+    selector.remove('d')
+    _pick_all_pools(selector)
+    assert selector.rebuilds == 3
+    # 已移除的网关即使还在过期的表中也不会被抽中
+    assert all(selector.pick(pool='side') == 'b' for _ in range(200))
+
+    clock.now = 1.0
+    _pick_all_pools(selector)
+    assert selector.rebuilds == 6
+    freq = _frequencies(lambda: selector.pick(main_only=True), draws=5000)
+    assert freq['c'] > 0.99
+
+    # 只更新主网关：次选网关的表不需要重建
+    selector.update('a', 5.0, True)
+    clock.now = 2.0
+    _pick_all_pools(selector)
+    assert selector.rebuilds == 8
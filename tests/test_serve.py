@@ -0,0 +1,135 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from ipfs_gateway_dns import DnsResolver
+from ipfs_gateway_history import ProbeHistory
+from ipfs_gateway_matrix import CidMatrix
+from ipfs_gateway_rank import RankIndex
+from ipfs_gateway_select import GatewaySelector
+from ipfs_gateway_serve import start_api_server
+
+CID = 'bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e'
+GATEWAYS = {
+    'https://a.example': {'is_main': True, 'current_weight': 3.0},
+    'https://b.example': {'is_main': False, 'current_weight': 2.0},
+    'https://c.example': {'is_main': True, 'current_weight': 1.0},
+}
+OK = {'status_code': 206, 'response_time': 100, 'ttfb': 100, 'speed': 1024 * 500,
+      'size': 4096, 'connect_time': 20}
+
+
+class _Tester:
+    """接口依赖的测速器状态：真实的排名索引、选取器、矩阵和探测历史"""
+
+    def __init__(self, history=None):
+        self.lock = threading.RLock()
+        self.resolver = DnsResolver()
+        self.history = history
+        self.gateway_data = {'gateways': {}}
+        self.rank_index = RankIndex()
+        self.selector = GatewaySelector()
+        self.cid_matrix = CidMatrix(lambda ema, response_time, speed_kb: ema * 10, 0.3)
+        for url, gateway in GATEWAYS.items():
+            self.gateway_data['gateways'][url] = {
+                **gateway, 'current_ema': 1.0, 'last_response_time': 100,
+                'avg_download_speed': 500}
+            self.rank_index.update(url, gateway['current_weight'])
+            self.selector.update(url, gateway['current_weight'], gateway['is_main'])
+
+    def gateway_snapshot(self, url):
+        gateway = self.gateway_data['gateways'].get(url)
+        return dict(gateway) if gateway is not None else None
+
+    def gateway_rank(self, url):
+        return self.rank_index.rank(url)
+
+    def weight_percentile(self, url):
+        return self.rank_index.percentile(url)
+
+    def best_gateways_for_cid(self, cid, k=10, main_only=False):
+        gateways = self.gateway_data['gateways']
+        accept = (lambda url: gateways[url]['is_main']) if main_only else None
+        return self.cid_matrix.best(cid, k, self.rank_index.iter_ranked(),
+                                    self.rank_index.weight, accept)
+
+    def pick_gateway(self, exclude=(), main_only=False):
+        return self.selector.pick(exclude=exclude, main_only=main_only)
+
+
+@pytest.fixture
+def api(tmp_path):
+    history = ProbeHistory(tmp_path / 'history')
+    tester = _Tester(history)
+    server, _ = start_api_server(tester, port=0)
+    host, port = server.server_address[:2]
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(f"http://{host}:{port}{path}", timeout=5) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    get.tester = tester
+    yield get
+    server.shutdown()
+    server.server_close()
+    history.close()
+
+
+def test_health_and_unknown_route(api):
+    status, payload = api('/health')
+    assert status == 200
+    assert payload['status'] == 'ok' and payload['gateways'] == 3
+    assert 'dns' in payload
+    assert api('/nope')[0] == 404
+
+
+def test_top_orders_by_weight_and_filters_main(api):
+    _, payload = api('/top?k=2')
+    assert [g['url'] for g in payload['gateways']] == ['https://a.example', 'https://b.example']
+    _, payload = api('/top?k=5&main_only=1')
+    assert [g['url'] for g in payload['gateways']] == ['https://a.example', 'https://c.example']
+    assert api('/top?k=x')[0] == 400
+
+
+def test_top_for_cid_prefers_measured_pairs(api):
+    for _ in range(5):
+        api.tester.cid_matrix.update('https://c.example', CID, OK)
+    _, payload = api(f'/top?cid={CID}&k=3')
+    gateways = payload['gateways']
+    assert gateways[0]['url'] == 'https://c.example'
+    assert gateways[0]['source'] == 'pair' and gateways[0]['tests'] == 5
+    assert [g['source'] for g in gateways[1:]] == ['global', 'global']
+
+
+def test_gateway_rank_and_errors(api):
+    status, payload = api('/gateway?url=https://b.example')
+    assert status == 200
+    assert payload['rank'] == 1
+    assert payload['percentile'] == pytest.approx(2 / 3)
+    assert payload['gateway']['is_main'] is False
+    assert api('/gateway?url=https://x.example')[0] == 404
+    assert api('/gateway')[0] == 400
+
+
+def test_pick_respects_exclude_and_main_only(api):
+    status, payload = api('/pick?exclude=https://a.example,https://b.example')
+    assert status == 200 and payload['url'] == 'https://c.example'
+    assert payload['weight'] == 1.0
+    assert api('/pick?exclude=https://a.example,https://c.example&main_only=1')[0] == 404
+
+
+def test_history_stats(api):
+    for _ in range(3):
+        api.tester.history.record('https://a.example', CID, OK)
+    status, payload = api('/history?url=https://a.example&metric=ttfb&days=1')
+    assert status == 200
+    assert payload['count'] == 3 and payload['mean'] == 100
+    assert api('/history?url=https://a.example&metric=nope')[0] == 400
+    api.tester.history = None
+    assert api('/history?url=https://a.example')[0] == 404
@@ -0,0 +1,96 @@
+import itertools
+
+import pytest
+
+from ipfs_gateway_bench import MockGatewayFleet
+from ipfs_gateway_shard import (EMA_HALF_LIFE, GatewayDelta, ema_weight, merge_deltas,
+                                run_local_shards, shard_of)
+
+URL = 'https://a.example'
+
+
+def _delta(node, ema, ema_time, weight, successes=1, tests=2):
+    gateway = GatewayDelta()
+    gateway.add({'status_code': 206, 'response_time': 100 * successes, 'ttfb': 50 * successes,
+                 'speed': 1024 * 100, 'size': 1024})
+    for _ in range(tests - 1):
+        gateway.add({'status_code': 0, 'response_time': 1500, 'speed': 0, 'size': 0})
+    gateway.set_ema(ema, ema_time, weight)
+    gateway.nodes.add(node)
+    return {'node': node, 'gateways': {URL: gateway.to_dict()}}
+
+
+def _same(a, b):
+    assert a.keys() == b.keys()
+    for url in a:
+        x, y = a[url].to_dict(), b[url].to_dict()
+        for name in ('ema', 'ema_time', 'ema_weight'):
+            assert x.pop(name) == pytest.approx(y.pop(name))
+        assert x == y
+
+
+def test_merge_is_commutative_and_associative():
+    deltas = [_delta('tokyo', 0.9, 1000.0, 5.0),
+              _delta('paris', 0.2, 1000.0 + EMA_HALF_LIFE, 3.0, successes=2),
+              _delta('ohio', 0.6, 1000.0 + 3 * EMA_HALF_LIFE, 8.0, tests=3)]
+    expected = merge_deltas(deltas)
+    for order in itertools.permutations(deltas):
+        _same(merge_deltas(order), expected)
+
+    # (a + b) + c == a + (b + c)
+    left = merge_deltas(deltas[:2])[URL].merge(merge_deltas(deltas[2:])[URL])
+    right = merge_deltas(deltas[:1])[URL].merge(merge_deltas(deltas[1:])[URL])
+    _same({URL: left}, {URL: right})
+    assert expected[URL].tests == 7
+    assert expected[URL].nodes == {'tokyo', 'paris', 'ohio'}
+
+
+def test_merge_decays_older_ema():
+    old = _delta('tokyo', 1.0, 0.0, 4.0)
+    new = _delta('paris', 0.0, 2 * EMA_HALF_LIFE, 4.0)
+    merged = merge_deltas([old, new])[URL]
+    # 较早的一方衰减了两个半衰期，权重为 1，较新的一方为 4
+    assert merged.ema == pytest.approx(1 / 5)
+    assert merged.ema_time == 2 * EMA_HALF_LIFE
+    assert merged.ema_weight == pytest.approx(5.0)
+
+    same_time = merge_deltas([_delta('tokyo', 1.0, 0.0, 4.0), _delta('paris', 0.0, 0.0, 4.0)])
+    assert same_time[URL].ema == pytest.approx(0.5)
+
+
+def test_ema_weight_saturates_at_window():
+    alpha = 2 / 11
+    assert ema_weight(0, alpha) == 0
+    assert ema_weight(1, alpha) == pytest.approx(1.0)
+    assert ema_weight(5, alpha) < ema_weight(10, alpha) < 10
+    assert ema_weight(1000, alpha) == pytest.approx(10.0)
+
+
+def test_run_local_shards_against_mock_gateways(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fleet = MockGatewayFleet(6, mix={'fast': 0.5, 'error': 0.5}, body_size=4096, seed=7)
+    urls = fleet.start()
+    try:
+        (tmp_path / 'main.txt').write_text('\n'.join(urls) + '\n')
+        (tmp_path / 'side.txt').write_text('')
+        options = {'main_gateway_file': str(tmp_path / 'main.txt'),
+                   'side_gateway_file': str(tmp_path / 'side.txt'),
+                   'log_dir': str(tmp_path / 'logs'), 'probe_backend': 'async'}
+        deltas = run_local_shards(['bafkreitestshard'], shards=2, node='local',
+                                  shard_dir=str(tmp_path / 'shards'), options=options,
+                                  log_level='ERROR')
+    finally:
+        fleet.stop()
+
+    assert [delta['shard'] for delta in deltas] == [0, 1]
+    for delta in deltas:
+        assert all(shard_of(url, 2) == delta['shard'] for url in delta['gateways'])
+        assert (tmp_path / 'shards' / f"delta-local-{delta['shard']}of2.json").exists()
+
+    merged = merge_deltas(deltas)
+    assert sorted(merged) == sorted(urls)
+    for url, kind in zip(urls, fleet.kinds):
+        assert merged[url].tests == 1
+        assert merged[url].successes == (1 if kind == 'fast' else 0)
+        assert merged[url].nodes == {'local'}
+        assert merged[url].ema_weight == pytest.approx(1.0)
@@ -0,0 +1,31 @@
+from ipfs_gateway_store import AppendLogStateStore
+
+
+def test_compaction_keeps_puts_made_while_snapshotting(tmp_path):
+    store = AppendLogStateStore(tmp_path / 'state.jsonl', compact_ratio=1)
+    gateways = {'https://a.example': {'test_count': 1}, 'https://b.example': {'test_count': 1}}
+    for _ in range(3):
+        store.put_many(gateways)
+
+    def snapshot():
+        # 快照取得之后、压缩之前，另一个线程写入了新的状态
+        copied = {url: dict(gateway) for url, gateway in gateways.items()}
+        store.put('https://a.example', {'test_count': 2})
+        return copied
+
+    store.flush(snapshot)
+    store.close()
+
+    reloaded = AppendLogStateStore(tmp_path / 'state.jsonl')
+    state = reloaded.load()
+    assert state['https://a.example'] == {'test_count': 2}
+    assert state['https://b.example'] == {'test_count': 1}
+    assert reloaded._lines == 3
+
+
+def test_flush_below_threshold_does_not_compact(tmp_path):
+    store = AppendLogStateStore(tmp_path / 'state.jsonl')
+    store.put('https://a.example', {'test_count': 1})
+    store.flush({'https://a.example': {'test_count': 1}})
+    store.close()
+    assert len((tmp_path / 'state.jsonl').read_text().splitlines()) == 1
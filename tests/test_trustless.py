@@ -0,0 +1,151 @@
+import base64
+import hashlib
+import sys
+import time
+
+from ipfs_gateway_cache import new_cache_score, update_cache_score
+from ipfs_gateway_matrix import CidMatrix
+from ipfs_gateway_probe import AsyncProbeEngine
+from ipfs_gateway_trustless import ACCEPT, CarStream, RawBlockStream
+from ipfs_gateway_verify import make_verifier
+from ipfs_test_gateway_multi_cid import GatewaySpeedTest
+
+CID = 'bafkreiabc'
+BLOCK = b'raw block data\n' * 64
+# raw 编码、sha2-256 的 CIDv1（base32）
+BLOCK_CID = 'b' + base64.b32encode(
+    bytes([1, 0x55, 0x12, 0x20]) + hashlib.sha256(BLOCK).digest()).decode().lower().rstrip('=')
+CHUNKED_RAW = {'content-type': ACCEPT['raw'], 'transfer-encoding': 'chunked'}
+
+# 冒充 curl：输出响应头后无限输出响应体，统计行永远不会出现
+ENDLESS_BODY = (
+    "import sys\n"
+    "out = sys.stdout.buffer\n"
+    "out.write(b'HTTP/1.1 200 OK\\r\\nContent-Type: {ctype}\\r\\n\\r\\n')\n"
+    "while True:\n"
+    "    out.write({chunk!r} * 4096)\n"
+    "    out.flush()\n"
+)
+
+
+def _tester(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'main.txt').write_text('http://127.0.0.1:9\n')
+    (tmp_path / 'side.txt').write_text('')
+    return GatewaySpeedTest(str(tmp_path / 'main.txt'), str(tmp_path / 'side.txt'),
+                            data_file=str(tmp_path / 'gateway_data.json'),
+                            log_dir=str(tmp_path / 'logs'), probe_backend='curl',
+                            history_dir=None, cid_matrix_file=None)
+
+
+def _run_endless(tester, stream, chunk):
+    cmd = [sys.executable, '-c', ENDLESS_BODY.format(ctype=stream.accept, chunk=chunk)]
+    start = time.monotonic()
+    output, headers, complete = tester._run_curl_streaming(cmd, stream.feed, stream.max_bytes)
+    assert not complete
+    return output.split(), headers, time.monotonic() - start
+
+
+def test_curl_stops_at_max_bytes(tmp_path, monkeypatch):
+    tester = _tester(tmp_path, monkeypatch)
+    try:
+        stream = RawBlockStream()
+        stream.max_bytes = 100000
+        parts, headers, elapsed = _run_endless(tester, stream, b'x')
+        assert elapsed < 10
+        assert stream.size == 100000
+        assert headers['content-type'] == ACCEPT['raw']
+        # 提前结束时由本进程构造统计行：状态码和实际读取的字节数
+        assert len(parts) == 8
+        assert parts[0] == '200' and parts[3] == '100000'
+    finally:
+        tester.close()
+
+
+def test_curl_stops_on_car_format_error(tmp_path, monkeypatch):
+    tester = _tester(tmp_path, monkeypatch)
+    try:
+        stream = CarStream()
+        # 头长度为 0 是格式错误，之后的数据不再读取
+        parts, _, elapsed = _run_endless(tester, stream, b'\x00')
+        assert elapsed < 10
+        assert stream.error is not None
+        assert int(parts[3]) < stream.max_bytes
+    finally:
+        tester.close()
+
+
+def _weight(ema, response_time, speed_kb):
+    return ema * 1000 / response_time + speed_kb
+
+
+BLOCK_RESULT = {'status_code': 200, 'response_time': 1200, 'ttfb': 1100, 'speed': 1024 * 10,
+                'size': 4096, 'blocks': 3, 'block_bytes': 3000, 'first_block_time': 200,
+                'block_rate': 30.0, 'block_speed': 1024 * 500}
+
+
+def test_cache_score_uses_block_metrics():
+    score = update_cache_score(new_cache_score(), BLOCK_RESULT, 0.3, _weight)
+    assert score['response_time'] == 200
+    assert score['ttfb'] == 200
+    assert score['speed'] == 500
+
+
+def test_matrix_uses_block_metrics():
+    matrix = CidMatrix(_weight, 0.3)
+    matrix.update('https://a.example', CID, BLOCK_RESULT)
+    stats = matrix.get('https://a.example', CID)
+    assert stats['response_time'] == 200
+    assert stats['ttfb'] == 200
+    assert stats['speed'] == 500
+
+
+def test_path_results_keep_byte_metrics():
+    result = {'status_code': 206, 'response_time': 400, 'ttfb': 300, 'speed': 1024 * 20,
+              'size': 4096}
+    score = update_cache_score(new_cache_score(), result, 0.3, _weight)
+    assert (score['response_time'], score['ttfb'], score['speed']) == (400, 300, 20)
+
+
+def _raw_stream(body, verifier=None):
+    stream = RawBlockStream(verifier)
+    stream.feed(body)
+    return stream
+
+
+def test_chunked_raw_block_counts_when_complete():
+    fields = _raw_stream(BLOCK).finish(200, CHUNKED_RAW, time.monotonic() - 0.1, complete=True)
+    assert fields['blocks'] == 1 and fields['block_bytes'] == len(BLOCK)
+
+
+def test_truncated_chunked_raw_block_is_not_counted():
+    fields = _raw_stream(BLOCK[:100]).finish(200, CHUNKED_RAW, time.monotonic(), complete=False)
+    assert fields['blocks'] == 0
+
+
+def test_verified_digest_counts_block_without_length():
+    # 没有 Content-Length 也没有确认读完，但摘要与 CID 一致
+    stream = _raw_stream(BLOCK, make_verifier(BLOCK_CID))
+    fields = stream.finish(200, {'content-type': ACCEPT['raw']}, time.monotonic() - 0.1)
+    assert fields['blocks'] == 1
+    assert fields['integrity'] == 'ok'
+
+
+def test_verified_chunked_mismatch():
+    stream = _raw_stream(BLOCK[:-1] + b'!', make_verifier(BLOCK_CID))
+    fields = stream.finish(200, CHUNKED_RAW, time.monotonic(), complete=True)
+    assert fields['integrity'] == 'mismatch'
+
+
+def test_engine_counts_chunked_raw_block(http_server):
+    pieces = [BLOCK[:300], BLOCK[300:]]
+    server = http_server(lambda handler: (200, {'Content-Type': ACCEPT['raw']}, pieces))
+    engine = AsyncProbeEngine()
+    try:
+        # 不校验：只能靠读到 chunked 结束块确认块是完整的
+        result = engine.run(engine.probe(f"{server.url}/ipfs/{BLOCK_CID}?format=raw",
+                                         stream=RawBlockStream()))
+    finally:
+        engine.close()
+    assert result['status_code'] == 200
+    assert result['blocks'] == 1 and result['block_bytes'] == len(BLOCK)
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+
+from ipfs_gateway_history import FLAG_INCOMPLETE, ProbeHistory, record_success
+from ipfs_gateway_verify import ContentVerifier, content_complete, parse_cid, probe_success
+
+DATA = b'hello ipfs gateway\n' * 100
+# raw 编码、sha2-256 的 CIDv1（base32）
+CID = 'b' + base64.b32encode(
+    bytes([1, 0x55, 0x12, 0x20]) + hashlib.sha256(DATA).digest()).decode().lower().rstrip('=')
+
+
+def _finish(body, status_code, headers):
+    verifier = ContentVerifier(parse_cid(CID))
+    verifier.update(body)
+    integrity = verifier.finish(status_code, headers)
+    result = {'status_code': status_code, 'response_time': 100, 'speed': 1024, 'size': len(body)}
+    if integrity is not None:
+        result['integrity'] = integrity
+    return integrity, result
+
+
+def test_complete_matching_206_is_success():
+    integrity, result = _finish(DATA, 206, {'content-range': f"bytes 0-{len(DATA) - 1}/{len(DATA)}"})
+    assert integrity == 'ok'
+    assert probe_success(result)
+
+
+def test_complete_200_with_length_is_ok():
+    integrity, _ = _finish(DATA, 200, {'content-length': str(len(DATA))})
+    assert integrity == 'ok'
+
+
+def test_mismatch_206_is_not_success():
+    body = DATA[:-1] + b'!'
+    integrity, result = _finish(body, 206, {'content-range': f"bytes 0-{len(body) - 1}/{len(body)}"})
+    assert integrity == 'mismatch'
+    assert not probe_success(result)
+
+
+def test_206_without_content_range_is_not_success():
+    integrity, result = _finish(DATA, 206, {})
+    assert integrity == 'incomplete'
+    assert not probe_success(result)
+
+
+def test_206_with_wrong_total_is_not_success():
+    headers = {'content-range': f"bytes 0-{len(DATA) - 1}/{len(DATA) * 2}"}
+    integrity, result = _finish(DATA, 206, headers)
+    assert integrity == 'incomplete'
+    assert not probe_success(result)
+
+
+def test_truncated_206_is_not_success():
+    body = DATA[:100]
+    integrity, result = _finish(body, 206, {'content-range': f"bytes 0-{len(DATA) - 1}/{len(DATA)}"})
+    assert integrity == 'incomplete'
+    assert not probe_success(result)
+    assert not content_complete(206, {'content-range': 'bytes 0-99/100'}, 99)
+
+
+def test_unverified_206_is_still_success():
+    assert probe_success({'status_code': 206, 'response_time': 100})
+    assert not probe_success({'status_code': 200, 'response_time': 100})
+
+
+def test_history_agrees_with_probe_success(tmp_path):
+    history = ProbeHistory(tmp_path, clock=lambda: 1_700_000_000.0)
+    for integrity in ('ok', 'mismatch', 'incomplete'):
+        history.record('https://a.example', CID, {'status_code': 206, 'response_time': 100,
+                                                  'size': 10, 'integrity': integrity})
+    stats = history.query('https://a.example', 'response_time', days=1)
+    history.close()
+    assert stats['count'] == 3
+    assert stats['success_rate'] == 1 / 3
+    assert not record_success(206, FLAG_INCOMPLETE)